@@ -0,0 +1,192 @@
+import os
+import sys
+import json
+import time
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from RankedRetrieval import RankedRetrieval
+from QueryCache import QueryCache, SharedPostings
+from SegmentReader import open_index, open_doc_store
+from SearchQuery import SearchQuery
+from IndexShards import ShardedSearch, has_shards
+from Metrics import percentile
+
+
+"""
+Runs a whole query log against the index at once, for offline
+evaluation and for warming caches, instead of one query at a
+time through the input() loop inside SearchQuery.py.
+
+Every query of the log is tokenized first, so the batch knows
+every term it needs before ranking anything:
+    - the same query asked again (same tokens and phrases) is
+      only ranked once
+    - the terms asked for by more than one query are grouped,
+      the most asked for first, and their postings are decoded
+      once into shared memory (SharedPostings, see QueryCache.py)
+      that every worker process reads
+    - the queries are sorted by their tokens, so the queries
+      sharing terms go to the same worker together and the
+      postings it decodes on its own are reused from its cache
+The queries are then ranked in parallel by a pool of worker
+processes that each open the index once, like SearchServer.py.
+When the index was merged into shards (see IndexShards.py), the
+queries are ranked one after the other instead, each on all of
+the shards at once.
+
+The results go to a JSONL file, one line per query of the log
+in its order:
+    {"query", "tokens", "results": [{"url", "score"}, ...],
+     "rank_ms": time spent ranking it, "repeat": true when
+     the same query was already ranked earlier in the log}
+and the throughput of the whole batch (queries/sec) is printed.
+
+Run a query log with:  python BatchSearch.py Queries.txt [results file] [workers]
+"""
+
+BATCH_RESULTS_FILE = "Batch_Results.jsonl"
+NUM_WORKERS = int(os.environ.get("SEARCH_WORKERS", os.cpu_count() or 1))
+SHARED_POSTINGS = 5000000 # most postings of the terms shared by several queries decoded into shared memory
+WORKER_CACHE_POSTINGS = 500000 # most decoded postings every worker caches on its own
+MAX_CHUNK = 64 # most queries handed to a worker at once
+
+# set inside every worker process by _init_worker
+worker_ranked_retrieval = None
+
+
+def read_query_log(file_path):
+    """
+    Returns the queries of a query log, one per
+    line, leaving out the empty lines.
+    """
+    with open(file_path, "r", encoding="utf-8") as queries_file:
+        return [line.strip() for line in queries_file if line.strip()]
+
+
+def _init_worker(main_directory, scoring_method, shared_postings_arguments):
+    """
+    Runs once inside each worker process, opening the
+    index and the shared postings of the batch.
+    """
+    global worker_ranked_retrieval
+    index_reader = open_index(main_directory)
+    shared_postings = SharedPostings.attach(*shared_postings_arguments)
+    cache = QueryCache(max_postings=WORKER_CACHE_POSTINGS, shared_postings=shared_postings)
+    worker_ranked_retrieval = RankedRetrieval(index_reader, scoring_method=scoring_method, cache=cache)
+
+
+def _worker_search(query, k, conjunctive, fast):
+    """
+    Ranks one (tokens, phrases) query inside a worker
+    process, returning its top k and the ms it took.
+    """
+    query_tokens, phrases = query
+    start_time = time.perf_counter()
+    if not worker_ranked_retrieval.index_reader.has_positions():
+        phrases = () # the words of the phrases are still required as plain tokens
+    top_k = worker_ranked_retrieval.search(list(query_tokens), k, conjunctive, phrases=[list(phrase) for phrase in phrases],
+                                           champions=fast)
+    return top_k, (time.perf_counter() - start_time) * 1000
+
+
+def _rank_sharded(sharded_search, queries, k, conjunctive, fast):
+    phrases_supported = sharded_search.has_positions()
+    for query_tokens, phrases in queries:
+        start_time = time.perf_counter()
+        top_k = sharded_search.search(list(query_tokens), k, conjunctive, champions=fast,
+                                      phrases=[list(phrase) for phrase in phrases] if phrases_supported else None)
+        yield top_k, (time.perf_counter() - start_time) * 1000
+
+
+def batch_search(queries, main_directory=".", results_path=BATCH_RESULTS_FILE, scoring_method="tf-idf", k=10,
+                 conjunctive=True, fast=False, num_workers=NUM_WORKERS):
+    """
+    Ranks every query of the list against the index inside
+    main_directory, writes the results to results_path as
+    JSONL and returns the summary of the batch.
+    """
+    time_start = time.perf_counter()
+    # tokenizes the whole log first, the same query is only ranked once
+    query_keys = []
+    for query_text in queries:
+        search_query = SearchQuery(query_text)
+        search_query.tokenize_query()
+        query_keys.append((tuple(search_query.get_query_tokens()), tuple(map(tuple, search_query.get_phrases()))))
+    distinct_queries = sorted({key for key in query_keys if key[0]})
+    term_queries = Counter(term for query_tokens, _ in distinct_queries for term in set(query_tokens))
+
+    results = dict() # (tokens, phrases) -> (top k, rank ms)
+    shared_terms = 0
+    shared_postings = 0
+    sharded = has_shards(main_directory)
+    time_ranking = time.perf_counter()
+    if sharded:
+        sharded_search = ShardedSearch(main_directory, scoring_method)
+        results = dict(zip(distinct_queries, _rank_sharded(sharded_search, distinct_queries, k, conjunctive, fast)))
+        sharded_search.close()
+    elif distinct_queries:
+        # the terms of several queries are decoded once, the most asked for first
+        index_reader = open_index(main_directory)
+        terms_to_share = [term for term, count in term_queries.most_common() if count > 1]
+        shared = SharedPostings.create_for_terms(index_reader, terms_to_share, SHARED_POSTINGS)
+        index_reader.close()
+        shared_terms = len(shared.terms)
+        shared_postings = shared.get_num_postings()
+        time_ranking = time.perf_counter()
+        # neighbouring queries (sorted by their tokens) share terms, so they go to a worker together
+        chunksize = max(1, min(MAX_CHUNK, len(distinct_queries) // (4 * num_workers)))
+        try:
+            with ProcessPoolExecutor(max_workers=num_workers, initializer=_init_worker,
+                                     initargs=(main_directory, scoring_method, shared.get_attach_arguments())) as executor:
+                worker_search = partial(_worker_search, k=k, conjunctive=conjunctive, fast=fast)
+                results = dict(zip(distinct_queries, executor.map(worker_search, distinct_queries, chunksize=chunksize)))
+        finally:
+            shared.close()
+            shared.unlink()
+    time_ranked = time.perf_counter()
+
+    # one line per query of the log, in its order
+    doc_store = open_doc_store(main_directory)
+    rank_times = []
+    ranked = set()
+    with open(results_path, "w", encoding="utf-8") as results_file:
+        for query_text, key in zip(queries, query_keys):
+            top_k, rank_ms = results.get(key, ([], 0.0))
+            repeat = key in ranked
+            ranked.add(key)
+            if key[0] and not repeat:
+                rank_times.append(rank_ms)
+            line = {"query": query_text, "tokens": list(key[0]),
+                    "results": [{"url": doc_store.get(docId), "score": score} for docId, score in top_k],
+                    "rank_ms": 0.0 if repeat else round(rank_ms, 3), "repeat": repeat}
+            results_file.write(json.dumps(line) + "\n")
+    doc_store.close()
+    time_end = time.perf_counter()
+
+    return {
+        "queries": len(queries),
+        "distinct_queries": len(distinct_queries),
+        "terms": len(term_queries),
+        "shared_terms": shared_terms,
+        "shared_postings": shared_postings,
+        "workers": num_workers if not sharded else 0,
+        "decode_seconds": round(time_ranking - time_start, 3), # tokenizing the log and decoding the shared postings
+        "rank_seconds": round(time_ranked - time_ranking, 3),
+        "total_seconds": round(time_end - time_start, 3),
+        "queries_per_sec": round(len(queries) / (time_end - time_start), 1) if time_end > time_start else 0.0,
+        "rank_p50_ms": round(percentile(rank_times, 50), 3),
+        "rank_p99_ms": round(percentile(rank_times, 99), 3),
+    }
+
+
+if __name__ == "__main__":
+    queries_path = sys.argv[1] if len(sys.argv) > 1 else "Queries.txt"
+    results_path = sys.argv[2] if len(sys.argv) > 2 else BATCH_RESULTS_FILE
+    num_workers = int(sys.argv[3]) if len(sys.argv) > 3 else NUM_WORKERS
+    summary = batch_search(read_query_log(queries_path), ".", results_path,
+                           scoring_method=os.environ.get("SEARCH_SCORING_METHOD", "tf-idf"),
+                           fast=os.environ.get("SEARCH_FAST", "") not in ("", "0"), num_workers=num_workers)
+    print(json.dumps(summary, indent=2))
+    print(f"Finished {summary['queries']} queries in: {summary['total_seconds']} seconds "
+          f"({summary['queries_per_sec']} queries/sec), results written to {results_path}")
@@ -0,0 +1,533 @@
+import os, json
+import sys
+import time
+import random
+import hashlib
+import platform
+import shutil
+import subprocess
+from bisect import bisect_right
+from collections import deque
+from contextlib import redirect_stdout
+from itertools import accumulate
+from IndexBuilder import IndexBuilder
+from IndexMerge import IndexMerge
+from SegmentReader import open_index, open_doc_store
+from RankedRetrieval import RankedRetrieval
+from SearchQuery import SearchQuery
+from Metrics import percentile
+from IndexShards import merge_shards, ShardedSearch, ShardReader
+from BatchSearch import batch_search
+from CorpusReader import LooseCorpus, PackedCorpus, list_json_files, measure_read_rate, pack_corpus
+try:
+    import resource # peak RSS, not available on Windows
+except ImportError:
+    resource = None
+
+
+"""
+Reproducible benchmarks of the whole pipeline, so a change
+to IndexBuilder, IndexMerge or the search side can be
+measured on any machine instead of only next to the DEV crawl.
+
+generate_corpus writes a synthetic crawl in the same format
+as DEV (one {"url", "content", "encoding"} JSON file per page,
+one folder per domain) from a seeded random.Random, so the
+same num_docs and seed always give the same files:
+    - the words of the pages follow a Zipfian distribution
+      over a made up vocabulary (a few words are everywhere,
+      most are rare), with English-like suffixes to stem
+    - the pages are full HTML (head, style, script, comments,
+      navigation, headings, paragraphs, lists, tables, footer)
+    - some pages are exact copies under another url, some are
+      near-duplicates with a few words changed and a few are
+      XML feeds, like in a real crawl
+It also writes Queries.txt, the fixed query log of the corpus:
+popular words, rare words and "quoted phrases" cut out of pages.
+
+run_benchmark builds and merges the index of the corpus and
+runs the query log against it, measuring:
+    build = docs/sec, seconds spent building and merging,
+            peak RSS of the builder and of its worker processes
+    read = files/sec reading the corpus as loose files (one
+            reader thread, then the prefetching reader threads)
+            and as a corpus pack (see CorpusReader.py)
+    index = bytes of every file of the index
+    queries = latency percentiles and queries/sec, per scoring method
+    batch = queries/sec of the whole query log run as one batch
+            (see BatchSearch.py)
+    shards = the same queries against the index split into shards
+            (see IndexShards.py), through the shard worker processes
+            and against every shard on its own, the slowest shard of
+            a query being its latency with one free core per shard
+and writes everything with the commit it ran on to a JSON file.
+
+Run the benchmarks with:      python Benchmark.py [num_docs] [seed] [results file]
+Compare two results files:    python Benchmark.py compare old.json new.json
+"""
+
+BENCHMARK_DIRECTORY = "Benchmark" # corpora (kept between runs) and the index being measured
+RESULTS_FILE = "Benchmark_Results.json"
+CORPUS_INFO_FILE = "Corpus_Info.txt"
+QUERIES_FILE = "Queries.txt"
+CORPUS_VERSION = 1 # bump when generate_corpus changes, so old corpora are generated again
+
+_SYLLABLES = ["ba", "ce", "di", "fo", "gu", "ka", "le", "mi", "no", "pu", "ra", "se", "ti", "vo", "za",
+              "bri", "cla", "dro", "fle", "gri", "pla", "stu", "tra", "chen", "mor", "tal", "ven", "quin"]
+_SUFFIXES = ["", "", "", "", "s", "ing", "ed", "er", "ation", "ly", "ness", "ment"]
+
+
+def _make_vocabulary(rng, size):
+    """
+    Returns size distinct made up words, the
+    most frequent ones being the shortest.
+    """
+    words = []
+    seen = set()
+    num_syllables = 1
+    collisions = 0 # made up words in a row that already existed
+    while len(words) < size:
+        word = "".join(rng.choices(_SYLLABLES, k=num_syllables + rng.randint(0, 1))) + rng.choice(_SUFFIXES)
+        if len(word) < 3 or word in seen:
+            collisions += 1
+            if collisions == 20: # the short words are used up
+                num_syllables += 1
+                collisions = 0
+            continue
+        collisions = 0
+        seen.add(word)
+        words.append(word)
+    return words
+
+
+class _ZipfSampler:
+    def __init__(self, rng, words, exponent, num_topics, topic_share):
+        self.rng = rng
+        self.words = words
+        self.cum_weights = list(accumulate(1 / rank ** exponent for rank in range(1, len(words) + 1)))
+        self.total = self.cum_weights[-1]
+        # every topic ranks the same words in its own order, so pages about different
+        # topics do not all share the same most frequent words (and SimHash fingerprints)
+        self.topics = [rng.sample(words, len(words)) for _ in range(num_topics)]
+        self.topic_share = topic_share # share of the words drawn from the topic of the page
+        self.topic = None
+
+    def sample(self, k):
+        random_value = self.rng.random
+        topic_words = self.topics[self.topic] if self.topic is not None else self.words
+        return [(topic_words if random_value() < self.topic_share else self.words)[
+                    bisect_right(self.cum_weights, random_value() * self.total)] for _ in range(k)]
+
+
+def _sentence(sampler, rng):
+    words = sampler.sample(rng.randint(6, 18))
+    if rng.random() < 0.15:
+        words.insert(rng.randrange(len(words)), str(rng.randint(1, 2030)))
+    if rng.random() < 0.03:
+        words.insert(rng.randrange(len(words)), rng.choice(["café", "naïve", "Zürich", "résumé"]))
+    words[0] = words[0].capitalize()
+    return " ".join(words) + rng.choice([".", ".", ".", "?", "!"])
+
+
+def _paragraph(sampler, rng):
+    return " ".join(_sentence(sampler, rng) for _ in range(rng.randint(1, 6)))
+
+
+def _page(sampler, rng, domain, num_words):
+    """
+    Returns the HTML of one page with about
+    num_words words of visible text.
+    """
+    title = " ".join(sampler.sample(rng.randint(2, 6))).title()
+    nav = " | ".join(f'<a href="https://{domain}/{word}">{word.capitalize()}</a>' for word in sampler.sample(rng.randint(3, 8)))
+    body = []
+    words = 0
+    while words < num_words:
+        kind = rng.random()
+        if kind < 0.15:
+            heading = " ".join(sampler.sample(rng.randint(2, 5))).title()
+            body.append(f"<h2>{heading}</h2>")
+            words += heading.count(" ") + 1
+        elif kind < 0.25:
+            items = [" ".join(sampler.sample(rng.randint(2, 8))) for _ in range(rng.randint(2, 6))]
+            body.append("<ul>" + "".join(f"<li>{item}</li>" for item in items) + "</ul>")
+            words += sum(item.count(" ") + 1 for item in items)
+        elif kind < 0.30:
+            rows = [sampler.sample(3) for _ in range(rng.randint(2, 5))]
+            body.append("<table>" + "".join("<tr>" + "".join(f"<td>{cell}</td>" for cell in row) + "</tr>"
+                                            for row in rows) + "</table>")
+            words += 3 * len(rows)
+        else:
+            paragraph = _paragraph(sampler, rng)
+            body.append(f"<p>{paragraph}</p>")
+            words += paragraph.count(" ") + 1
+    return ("<!DOCTYPE html>\n<html lang=\"en\"><head><meta charset=\"utf-8\">"
+            f"<title>{title}</title>"
+            "<style>body { font-family: sans-serif; } .nav a { margin: 0 4px; }</style>"
+            "<script>window.dataLayer = window.dataLayer || []; function track(id) { return id; }</script>"
+            "</head><body><!-- generated page -->"
+            f"<div class=\"nav\">{nav}</div><h1>{title}</h1>"
+            + "\n".join(body) +
+            f"<footer>Copyright {rng.randint(1995, 2024)} <a href=\"https://{domain}/\">{domain}</a></footer>"
+            "</body></html>")
+
+
+def generate_corpus(corpus_directory, num_docs=5000, seed=0, vocabulary_size=50000, zipf_exponent=1.0, num_topics=20,
+                    topic_share=0.6, num_domains=20, duplicate_rate=0.02, near_duplicate_rate=0.03, xml_rate=0.005,
+                    num_queries=500):
+    """
+    Writes a synthetic crawl of num_docs pages and its query log
+    to corpus_directory, unless the same corpus is already there.
+    """
+    info = {"version": CORPUS_VERSION, "num_docs": num_docs, "seed": seed, "vocabulary_size": vocabulary_size,
+            "zipf_exponent": zipf_exponent, "num_topics": num_topics, "topic_share": topic_share,
+            "num_domains": num_domains, "duplicate_rate": duplicate_rate, "near_duplicate_rate": near_duplicate_rate,
+            "xml_rate": xml_rate, "num_queries": num_queries}
+    info_path = os.path.join(corpus_directory, CORPUS_INFO_FILE)
+    if os.path.exists(info_path):
+        with open(info_path, "r", encoding="utf-8") as info_file:
+            if json.load(info_file) == info:
+                return info
+    shutil.rmtree(corpus_directory, ignore_errors=True)
+    os.makedirs(corpus_directory)
+
+    rng = random.Random(seed)
+    vocabulary = _make_vocabulary(rng, vocabulary_size)
+    sampler = _ZipfSampler(rng, vocabulary, zipf_exponent, num_topics, topic_share)
+    domains = [f"{''.join(rng.choices(_SYLLABLES, k=2))}.ics.uci.edu" for _ in range(num_domains)]
+    pages = deque(maxlen=1000) # (url, content) of the last pages written, for the copies
+    phrases = [] # consecutive words cut out of the pages, for the query log
+    for page_number in range(num_docs):
+        domain = rng.choice(domains)
+        path = "/".join(rng.sample(vocabulary[:2000], rng.randint(1, 3)))
+        url = f"https://{domain}/{path}/{page_number}"
+        kind = rng.random()
+        sampler.topic = rng.randrange(num_topics)
+        if pages and kind < duplicate_rate:
+            original_url, content = rng.choice(pages)
+            if rng.random() < 0.5:
+                url = original_url + rng.choice(["#content", "/", "#top"]) # same page, another url
+        elif pages and kind < duplicate_rate + near_duplicate_rate:
+            _, content = rng.choice(pages)
+            content = content.replace("<p>", f"<p>{' '.join(sampler.sample(2))} ", 1)
+        elif kind < duplicate_rate + near_duplicate_rate + xml_rate:
+            items = "".join(f"<item><title>{' '.join(sampler.sample(4))}</title></item>" for _ in range(5))
+            content = f'<?xml version="1.0" encoding="UTF-8"?><rss version="2.0"><channel>{items}</channel></rss>'
+        else:
+            content = _page(sampler, rng, domain, max(20, int(rng.lognormvariate(5.3, 0.7))))
+            if rng.random() < 0.2 and "<p>" in content:
+                words = content[content.index("<p>") + 3:].split("<")[0].split()
+                if len(words) >= 3:
+                    start = rng.randrange(len(words) - 1)
+                    phrases.append(" ".join(word.strip(".?!") for word in words[start:start + rng.randint(2, 3)]))
+        pages.append((url, content))
+
+        os.makedirs(os.path.join(corpus_directory, domain), exist_ok=True)
+        file_name = hashlib.md5(f"{page_number}:{url}".encode("utf-8")).hexdigest() + ".json"
+        with open(os.path.join(corpus_directory, domain, file_name), "w", encoding="utf-8") as page_file:
+            json.dump({"url": url, "content": content, "encoding": "utf-8"}, page_file)
+
+    queries = []
+    for _ in range(num_queries):
+        kind = rng.random()
+        sampler.topic = rng.randrange(num_topics)
+        if kind < 0.4:
+            queries.append(" ".join(rng.sample(vocabulary[:1000], rng.randint(1, 2)))) # popular words
+        elif kind < 0.8:
+            queries.append(" ".join(sampler.sample(rng.randint(2, 4))))
+        elif phrases:
+            queries.append(f'"{rng.choice(phrases)}"')
+        else:
+            queries.append(rng.choice(vocabulary))
+    with open(os.path.join(corpus_directory, QUERIES_FILE), "w", encoding="utf-8") as queries_file:
+        queries_file.write("\n".join(queries) + "\n")
+    with open(info_path, "w", encoding="utf-8") as info_file:
+        json.dump(info, info_file, indent=2)
+    return info
+
+
+def read_queries(corpus_directory):
+    with open(os.path.join(corpus_directory, QUERIES_FILE), "r", encoding="utf-8") as queries_file:
+        return [line for line in queries_file.read().split("\n") if line]
+
+
+def _peak_rss_mb(children=False):
+    """
+    Returns the peak RSS of this process (or of its largest
+    finished child process), None where it can not be read.
+    """
+    if resource is None:
+        return None
+    # ru_maxrss is in KB on Linux and in bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_CHILDREN if children else resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+def _commit():
+    """
+    Returns the commit the benchmarks run on (with
+    a + when the tree has changes), None outside git.
+    """
+    try:
+        repository = os.path.dirname(os.path.abspath(__file__))
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=repository,
+                                capture_output=True, text=True, check=True).stdout.strip()
+        changes = subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], cwd=repository,
+                                 capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return commit + ("+" if changes else "")
+
+
+def benchmark_build(corpus_directory, index_directory, positional=False, impact_bits=None, memoryBudgetMB=512):
+    """
+    Builds and merges the index of the corpus from scratch
+    inside index_directory, returning the build measurements.
+    """
+    shutil.rmtree(index_directory, ignore_errors=True)
+    os.makedirs(index_directory)
+    with open(os.devnull, "w") as devnull, redirect_stdout(devnull):
+        time_start = time.perf_counter()
+        index_builder = IndexBuilder(corpus_directory, positional=positional, outputDirectory=index_directory,
+                                     memoryBudgetMB=memoryBudgetMB)
+        index_builder.build_index()
+        time_built = time.perf_counter()
+        IndexMerge(index_directory, impact_bits=impact_bits).merge_index()
+        time_end = time.perf_counter()
+
+    num_files = len(index_builder.file_to_docId)
+    return {
+        "files": num_files,
+        "docs_indexed": len(index_builder.get_docId_to_url()),
+        "duplicates": len(index_builder.duplicates),
+        "near_duplicates": len(index_builder.near_duplicates),
+        "build_seconds": round(time_built - time_start, 3),
+        "merge_seconds": round(time_end - time_built, 3),
+        "total_seconds": round(time_end - time_start, 3),
+        "docs_per_sec": round(num_files / (time_end - time_start), 1),
+        "peak_rss_mb": _peak_rss_mb(), # the builder, measured before any query runs
+        "peak_worker_rss_mb": _peak_rss_mb(children=True),
+    }
+
+
+def benchmark_index_size(index_directory):
+    """
+    Returns the size of every file of the index, the batches
+    (only needed until the merge) being counted on their own.
+    """
+    files = dict()
+    batch_bytes = 0
+    for file in sorted(os.listdir(index_directory)):
+        size = os.path.getsize(os.path.join(index_directory, file))
+        if file.startswith(("Output_Batch_", "Output_Positions_")):
+            batch_bytes += size
+        else:
+            files[file] = size
+    return {"total_bytes": sum(files.values()), "batch_bytes": batch_bytes, "files": files}
+
+
+def benchmark_read(corpus_directory, pack_path):
+    """
+    Packs the corpus and reads it loose and packed, returning
+    the files/sec of every reader. The files are mostly in the
+    page cache by then, so this measures the cost per file of
+    the readers rather than the disk.
+    """
+    time_start = time.perf_counter()
+    pack_corpus(corpus_directory, pack_path)
+    results = {"pack_seconds": round(time.perf_counter() - time_start, 3)}
+    json_files = list_json_files(corpus_directory)
+    for name, corpus in (("loose_1_thread", LooseCorpus(json_files, threads=1, prefetch=1)),
+                         ("loose_prefetch", LooseCorpus(json_files)), ("packed", PackedCorpus(pack_path))):
+        results[f"{name}_files_per_sec"] = round(measure_read_rate(corpus)[2], 1)
+        corpus.close()
+    return results
+
+
+def benchmark_queries(index_directory, queries, scoring_method="tf-idf", k=10, repeat=1, champions=False):
+    """
+    Runs the query log against the index the way the search
+    service does (tokenize, rank, map the docIds to urls),
+    once to warm up and then repeat more times measured.
+
+    With champions, the queries are answered from the champion
+    lists, and the share of the exact top k they still find is
+    reported as overlap_at_k.
+    """
+    index_reader = open_index(index_directory)
+    doc_store = open_doc_store(index_directory)
+    ranked_retrieval = RankedRetrieval(index_reader, scoring_method=scoring_method)
+
+    def run(query_text, champions=champions):
+        search_query = SearchQuery(query_text)
+        search_query.tokenize_query()
+        phrases = search_query.get_phrases() if index_reader.has_positions() else None
+        top_k = ranked_retrieval.search(search_query.get_query_tokens(), k, phrases=phrases, champions=champions)
+        return [doc_store.get(docId) for docId, _ in top_k]
+
+    found = expected = 0
+    for query_text in queries: # warm up, so the page cache holds the index
+        urls = run(query_text)
+        if champions:
+            exact_urls = run(query_text, champions=False)
+            found += len(set(urls) & set(exact_urls))
+            expected += len(exact_urls)
+    latencies = []
+    empty_results = 0
+    time_start = time.perf_counter()
+    for _ in range(repeat):
+        for query_text in queries:
+            query_start = time.perf_counter()
+            urls = run(query_text)
+            latencies.append((time.perf_counter() - query_start) * 1000)
+            empty_results += not urls
+    time_end = time.perf_counter()
+    index_reader.close()
+    doc_store.close()
+    results = {
+        "queries": len(latencies),
+        "empty_results": empty_results,
+        "p50_ms": round(percentile(latencies, 50), 3),
+        "p90_ms": round(percentile(latencies, 90), 3),
+        "p99_ms": round(percentile(latencies, 99), 3),
+        "max_ms": round(max(latencies, default=0), 3),
+        "mean_ms": round(sum(latencies) / len(latencies), 3) if latencies else 0,
+        "queries_per_sec": round(len(latencies) / (time_end - time_start), 1),
+    }
+    if champions:
+        results["overlap_at_k"] = round(found / expected, 3) if expected else 1.0
+    return results
+
+
+def benchmark_shards(index_directory, queries, num_shards, scoring_method="tf-idf", k=10, repeat=1):
+    """
+    Merges the batches of the index into num_shards shards
+    and runs the query log through ShardedSearch, then
+    against every shard one after the other in this process
+    to get the time of the slowest shard of every query.
+    """
+    with open(os.devnull, "w") as devnull, redirect_stdout(devnull):
+        time_start = time.perf_counter()
+        manifest = merge_shards(index_directory, num_shards)
+        merge_seconds = time.perf_counter() - time_start
+    query_tokens = []
+    for query_text in queries:
+        search_query = SearchQuery(query_text)
+        search_query.tokenize_query()
+        if search_query.get_query_tokens():
+            query_tokens.append((search_query.get_query_tokens(), search_query.get_phrases()))
+
+    sharded_search = ShardedSearch(index_directory, scoring_method, cache=False)
+    for tokens, phrases in query_tokens: # warm up
+        sharded_search.search(tokens, k, phrases=phrases)
+    latencies = []
+    time_start = time.perf_counter()
+    for _ in range(repeat):
+        for tokens, phrases in query_tokens:
+            query_start = time.perf_counter()
+            sharded_search.search(tokens, k, phrases=phrases)
+            latencies.append((time.perf_counter() - query_start) * 1000)
+    time_end = time.perf_counter()
+    sharded_search.close()
+
+    shard_retrievals = [RankedRetrieval(ShardReader(index_directory, shard["name"], manifest), scoring_method=scoring_method)
+                        for shard in manifest["shards"]]
+    slowest_shard = []
+    for _ in range(repeat):
+        for tokens, phrases in query_tokens:
+            shard_latencies = []
+            for ranked_retrieval in shard_retrievals:
+                query_start = time.perf_counter()
+                ranked_retrieval.search(tokens, k, phrases=phrases if ranked_retrieval.index_reader.has_positions() else None)
+                shard_latencies.append((time.perf_counter() - query_start) * 1000)
+            slowest_shard.append(max(shard_latencies))
+    for ranked_retrieval in shard_retrievals:
+        ranked_retrieval.index_reader.close()
+    return {
+        "shards": len(manifest["shards"]),
+        "merge_seconds": round(merge_seconds, 3),
+        "queries": len(latencies),
+        "p50_ms": round(percentile(latencies, 50), 3),
+        "p99_ms": round(percentile(latencies, 99), 3),
+        "queries_per_sec": round(len(latencies) / (time_end - time_start), 1),
+        "slowest_shard_p50_ms": round(percentile(slowest_shard, 50), 3),
+        "slowest_shard_p99_ms": round(percentile(slowest_shard, 99), 3),
+    }
+
+
+def run_benchmark(num_docs=5000, seed=0, results_path=RESULTS_FILE, benchmark_directory=BENCHMARK_DIRECTORY,
+                  positional=True, impact_bits=8, scoring_methods=("tf-idf", "bm25"), repeat=3, num_shards=(1, 2, 4)):
+    """
+    Generates (or reuses) the corpus, measures the build, the
+    index and the queries, and writes the results to results_path.
+    """
+    corpus_directory = os.path.join(benchmark_directory, f"Corpus_{num_docs}_{seed}")
+    index_directory = os.path.join(benchmark_directory, "Index")
+    time_start = time.perf_counter()
+    corpus = generate_corpus(corpus_directory, num_docs, seed)
+    generate_seconds = time.perf_counter() - time_start
+
+    results = {
+        "commit": _commit(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "corpus": corpus,
+        "config": {"positional": positional, "impact_bits": impact_bits, "repeat": repeat, "num_shards": list(num_shards)},
+        "generate_seconds": round(generate_seconds, 3),
+        "build": benchmark_build(corpus_directory, index_directory, positional, impact_bits),
+        "read": benchmark_read(corpus_directory, os.path.join(benchmark_directory, f"Corpus_{num_docs}_{seed}.pack")),
+        "index": benchmark_index_size(index_directory),
+        "queries": {method + ("+champions" if champions else ""):
+                    benchmark_queries(index_directory, read_queries(corpus_directory), method, repeat=repeat,
+                                      champions=champions)
+                    for method in scoring_methods for champions in (False, True)},
+        "batch": batch_search(read_queries(corpus_directory), index_directory,
+                              os.path.join(benchmark_directory, "Batch_Results.jsonl"), scoring_methods[0]),
+    }
+    # the shards are merged from the same batches, after the queries against the merged index
+    results["shards"] = {str(shards): benchmark_shards(index_directory, read_queries(corpus_directory), shards,
+                                                       scoring_methods[0], repeat=repeat)
+                         for shards in num_shards}
+    with open(results_path, "w", encoding="utf-8") as results_file:
+        json.dump(results, results_file, indent=2)
+    return results
+
+
+def _flatten(results, prefix=""):
+    for key, value in results.items():
+        if isinstance(value, dict):
+            yield from _flatten(value, f"{prefix}{key}.")
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            yield f"{prefix}{key}", value
+
+
+def compare_results(old_results, new_results):
+    """
+    Prints every number of two benchmark results side
+    by side, with the change from the old to the new one.
+    """
+    old_values = dict(_flatten(old_results))
+    new_values = dict(_flatten(new_results))
+    print(f"{'':48} {str(old_results.get('commit')):>14} {str(new_results.get('commit')):>14}")
+    for name, new_value in new_values.items():
+        if name.startswith(("corpus.", "config.")):
+            continue
+        old_value = old_values.get(name)
+        change = f"{(new_value - old_value) / old_value * 100:+.1f}%" if old_value else ""
+        print(f"{name:48} {'' if old_value is None else old_value:>14} {new_value:>14} {change:>9}")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "compare":
+        with open(sys.argv[2], "r", encoding="utf-8") as old_file, open(sys.argv[3], "r", encoding="utf-8") as new_file:
+            compare_results(json.load(old_file), json.load(new_file))
+    else:
+        num_docs = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+        seed = int(sys.argv[2]) if len(sys.argv) > 2 else 0
+        results_path = sys.argv[3] if len(sys.argv) > 3 else RESULTS_FILE
+        results = run_benchmark(num_docs, seed, results_path)
+        print(json.dumps({key: results[key] for key in ("commit", "build", "read", "queries", "batch", "shards")}, indent=2))
+        print(f"index: {results['index']['total_bytes']} bytes")
+        print(f"Results written to {results_path}")
@@ -0,0 +1,243 @@
+import os
+import sys
+import mmap
+import time
+import struct
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from Metrics import NULL_METRICS
+
+
+"""
+The readers IndexBuilder gets the pages of the crawl from,
+so the parsers never wait on the file system.
+
+LooseCorpus reads the JSON files of a folder (the DEV crawl,
+one small file per page). The files are listed once up front,
+and a pool of reader threads keeps the next PREFETCH_FILES of
+them read ahead of the builder, so opening and reading one
+file overlaps with the others instead of every worker waiting
+on its own files.
+
+PackedCorpus reads a Corpus.pack archive instead, written
+once by pack_corpus from the same folder: every file of the
+crawl back to back in one memory-mapped file, so reading the
+whole crawl is one sequential read instead of a directory
+walk and an open per page.
+
+Corpus.pack layout (little-endian):
+    header  = magic b"CPAK", number of files : uint32
+    records = one per file, in sorted path order (the order
+              IndexBuilder indexes them in):
+              path length : uint16, size : uint32,
+              modification time of the file in ns : int64,
+              path (UTF-8), contents of the JSON file
+
+The path, size and modification time of every page are the
+ones of the file it was packed from, so a build from the pack
+gives the same docIds, file_to_docId and checkpoint as a build
+from the folder it was packed from.
+
+Both readers yield the raw bytes of every file, the JSON is
+decoded by the build's worker processes (see IndexBuilder).
+
+Pack a crawl with:            python CorpusReader.py pack DEV [Corpus.pack]
+Compare the read rates with:  python CorpusReader.py DEV [Corpus.pack]
+"""
+
+CORPUS_PACK_FILE = "Corpus.pack"
+READER_THREADS = 8 # threads reading the loose files ahead of the builder
+PREFETCH_FILES = 64 # files read ahead of the builder, at most
+_MAGIC = b"CPAK"
+_HEADER = struct.Struct("<4sI")
+_RECORD = struct.Struct("<HIq")
+
+
+def list_json_files(folder):
+    """
+    Returns the path of every JSON file inside the
+    folder, sorted so the docIds do not depend on
+    the file system's listing order.
+    """
+    return sorted(Path(folder).rglob('*.json'))
+
+
+def is_pack(file_path):
+    """
+    Returns True when file_path is a corpus pack.
+    """
+    if not os.path.isfile(file_path):
+        return False
+    with open(file_path, "rb") as pack_file:
+        return pack_file.read(len(_MAGIC)) == _MAGIC
+
+
+def open_corpus(path, threads=READER_THREADS, prefetch=PREFETCH_FILES):
+    """
+    Opens a crawl folder (LooseCorpus) or a corpus
+    pack written by pack_corpus (PackedCorpus).
+    """
+    if is_pack(path):
+        return PackedCorpus(path)
+    return LooseCorpus(list_json_files(path), threads, prefetch)
+
+
+def pack_corpus(folder, pack_path=CORPUS_PACK_FILE):
+    """
+    Writes every JSON file of the folder into one corpus
+    pack, in the order they are indexed. The pack is only
+    replaced once it is complete. Returns the number of
+    files packed.
+    """
+    corpus = LooseCorpus(list_json_files(folder))
+    files = corpus.get_files()
+    temporary_path = f"{pack_path}.tmp"
+    with open(temporary_path, "wb") as pack_file:
+        pack_file.write(_HEADER.pack(_MAGIC, len(files)))
+        for json_file, (size, mtime_ns), data in zip(files, corpus.stat_files(), corpus.read()):
+            encoded_path = json_file.encode("utf-8")
+            if len(data) != size:
+                raise ValueError(f"{json_file} changed while it was being packed")
+            pack_file.write(_RECORD.pack(len(encoded_path), size, mtime_ns))
+            pack_file.write(encoded_path)
+            pack_file.write(data)
+    os.replace(temporary_path, pack_path)
+    return len(files)
+
+
+class LooseCorpus:
+    def __init__(self, json_files, threads=READER_THREADS, prefetch=PREFETCH_FILES):
+        self.json_files = [str(json_file) for json_file in json_files]
+        self.threads = threads
+        self.prefetch = max(prefetch, 1)
+
+    def get_files(self):
+        return self.json_files
+
+    def stat_files(self):
+        """
+        Returns the (size, modification time in ns)
+        of every file, in get_files order.
+        """
+        stats = []
+        for json_file in self.json_files:
+            stat = os.stat(json_file)
+            stats.append((stat.st_size, stat.st_mtime_ns))
+        return stats
+
+    @staticmethod
+    def _read_file(json_file):
+        with open(json_file, "rb") as current_file:
+            return current_file.read()
+
+    def read(self, start=0, metrics=NULL_METRICS):
+        """
+        Yields the contents of every file from the start-th
+        on, in order. The reader threads stay up to prefetch
+        files ahead, the time spent waiting for them is the
+        read_files stage.
+        """
+        with ThreadPoolExecutor(max_workers=self.threads, thread_name_prefix="CorpusReader") as executor:
+            pending = deque()
+            next_files = iter(self.json_files[start:])
+            try:
+                for json_file in next_files:
+                    pending.append(executor.submit(self._read_file, json_file))
+                    if len(pending) == self.prefetch:
+                        break
+                while pending:
+                    with metrics.timer("read_files"):
+                        data = pending.popleft().result()
+                    json_file = next(next_files, None)
+                    if json_file is not None:
+                        pending.append(executor.submit(self._read_file, json_file))
+                    yield data
+            finally:
+                # the files read ahead are not needed when the caller stops early
+                for future in pending:
+                    future.cancel()
+
+    def close(self):
+        pass
+
+
+class PackedCorpus:
+    def __init__(self, pack_path=CORPUS_PACK_FILE):
+        self.pack_path = pack_path
+        self.pack_file = open(pack_path, "rb")
+        self.mapped_pack = mmap.mmap(self.pack_file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, num_files = _HEADER.unpack_from(self.mapped_pack, 0)
+        if magic != _MAGIC:
+            raise ValueError(f"{pack_path} is not a corpus pack")
+        # walks the record headers once, skipping over the contents
+        self.json_files = []
+        self.stats = [] # (size, modification time in ns) of every file
+        self.offsets = [] # where the contents of every file start inside the pack
+        offset = _HEADER.size
+        for _ in range(num_files):
+            path_length, size, mtime_ns = _RECORD.unpack_from(self.mapped_pack, offset)
+            offset += _RECORD.size
+            self.json_files.append(self.mapped_pack[offset:offset + path_length].decode("utf-8"))
+            offset += path_length
+            self.stats.append((size, mtime_ns))
+            self.offsets.append(offset)
+            offset += size
+        if offset != len(self.mapped_pack):
+            raise ValueError(f"{pack_path} is truncated or has trailing bytes")
+
+    def get_files(self):
+        return self.json_files
+
+    def stat_files(self):
+        return self.stats
+
+    def read(self, start=0, metrics=NULL_METRICS):
+        """
+        Yields the contents of every file from the
+        start-th on, in order, sliced out of the pack.
+        """
+        for offset, (size, _) in zip(self.offsets[start:], self.stats[start:]):
+            with metrics.timer("read_files"):
+                data = self.mapped_pack[offset:offset + size]
+            yield data
+
+    def close(self):
+        self.mapped_pack.close()
+        self.pack_file.close()
+
+
+def measure_read_rate(corpus):
+    """
+    Reads every file of the corpus once, returning
+    (files, bytes, files/sec).
+    """
+    time_start = time.perf_counter()
+    num_files = 0
+    num_bytes = 0
+    for data in corpus.read():
+        num_files += 1
+        num_bytes += len(data)
+    seconds = time.perf_counter() - time_start
+    return num_files, num_bytes, num_files / seconds if seconds else 0.0
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "pack":
+        folder = sys.argv[2] if len(sys.argv) > 2 else "DEV"
+        pack_path = sys.argv[3] if len(sys.argv) > 3 else CORPUS_PACK_FILE
+        time_start = time.time()
+        num_files = pack_corpus(folder, pack_path)
+        print(f"Packed {num_files} files into {pack_path} in: {time.time() - time_start} seconds...")
+    else:
+        # best run right after dropping the file system cache, otherwise both read from memory
+        folder = sys.argv[1] if len(sys.argv) > 1 else "DEV"
+        pack_path = sys.argv[2] if len(sys.argv) > 2 else CORPUS_PACK_FILE
+        corpora = [("loose, 1 thread", LooseCorpus(list_json_files(folder), threads=1, prefetch=1)),
+                   (f"loose, {READER_THREADS} threads", LooseCorpus(list_json_files(folder)))]
+        if os.path.exists(pack_path):
+            corpora.append(("packed", PackedCorpus(pack_path)))
+        for name, corpus in corpora:
+            num_files, num_bytes, files_per_sec = measure_read_rate(corpus)
+            print(f"{name:20} {num_files} files, {num_bytes / 1024 / 1024:.1f} MB, {files_per_sec:.0f} files/sec")
+            corpus.close()
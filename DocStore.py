@@ -0,0 +1,125 @@
+import mmap
+import struct
+import time
+from array import array
+
+
+"""
+A compact, memory-mapped docID -> URL store, written
+once by IndexBuilder so the search side never has to
+rebuild the index (or parse docID_to_URL.txt) just to
+turn docIDs back into URLs.
+
+DocStore.bin layout (little-endian):
+    header  = magic b"DOCS", first docId : uint32,
+              number of slots : uint32, number of URLs : uint32
+    offsets = (number of slots + 1) * uint64, where the
+              URL of docId d lives in blob[offsets[i]:offsets[i + 1]]
+              for i = d - first docId
+    blob    = every URL encoded in UTF-8, back to back
+
+Looking up a docId is two offset reads and one slice, O(1),
+and memory use does not depend on the number of documents
+because the file stays mapped instead of loaded into a dict.
+"""
+
+DOCSTORE_FILE = "DocStore.bin"
+DOC_LENGTHS_FILE = "Doc_Lengths.bin" # uint32 number of tokens per docId from the first docId on, slot 0 unused
+_MAGIC = b"DOCS"
+_HEADER = struct.Struct("<4sIII")
+_OFFSET = struct.Struct("<Q")
+
+
+def write_doc_lengths(file_path, doc_lengths):
+    """
+    Writes the array('I') of document lengths,
+    indexed by docId, to disk.
+    """
+    with open(file_path, "wb") as lengths_file:
+        doc_lengths.tofile(lengths_file)
+
+
+def read_doc_lengths(file_path, first_docId=1):
+    """
+    Reads the document lengths written by write_doc_lengths
+    back into an array('I') indexed by docId, the docIds
+    below first_docId (other segments) getting length 0.
+    """
+    doc_lengths = array("I", bytes(4 * (first_docId - 1)))
+    with open(file_path, "rb") as lengths_file:
+        doc_lengths.frombytes(lengths_file.read())
+    return doc_lengths
+
+
+class DocStore:
+    def __init__(self, file_path=DOCSTORE_FILE):
+        self.file_path = file_path
+        self.docstore_file = open(file_path, "rb")
+        self.mapped_store = mmap.mmap(self.docstore_file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.first_docId, self.num_slots, self.num_urls = _HEADER.unpack_from(self.mapped_store, 0)
+        if magic != _MAGIC:
+            raise ValueError(f"{file_path} is not a docstore file")
+        self.offsets_start = _HEADER.size
+        self.blob_start = self.offsets_start + (self.num_slots + 1) * _OFFSET.size
+
+    @staticmethod
+    def write(file_path, docId_to_url):
+        """
+        Packs a {docId : url} dictionary into a docstore
+        file. DocIDs missing from the dictionary inside
+        the covered range are stored as empty slots.
+        """
+        first_docId = min(docId_to_url) if docId_to_url else 1
+        num_slots = max(docId_to_url) - first_docId + 1 if docId_to_url else 0
+
+        offsets = bytearray()
+        blob = bytearray()
+        for docId in range(first_docId, first_docId + num_slots):
+            offsets += _OFFSET.pack(len(blob))
+            url = docId_to_url.get(docId)
+            if url is not None:
+                blob += url.encode("utf-8")
+        offsets += _OFFSET.pack(len(blob))
+
+        with open(file_path, "wb") as docstore_file:
+            docstore_file.write(_HEADER.pack(_MAGIC, first_docId, num_slots, len(docId_to_url)))
+            docstore_file.write(offsets)
+            docstore_file.write(blob)
+
+    def get(self, docId, default=None):
+        """
+        Returns the URL of the given docId, or the
+        default if the docId is not inside the store.
+        """
+        slot = docId - self.first_docId
+        if slot < 0 or slot >= self.num_slots:
+            return default
+        start, = _OFFSET.unpack_from(self.mapped_store, self.offsets_start + slot * _OFFSET.size)
+        end, = _OFFSET.unpack_from(self.mapped_store, self.offsets_start + (slot + 1) * _OFFSET.size)
+        if start == end:
+            return default
+        return self.mapped_store[self.blob_start + start:self.blob_start + end].decode("utf-8")
+
+    def __getitem__(self, docId):
+        url = self.get(docId)
+        if url is None:
+            raise KeyError(docId)
+        return url
+
+    def __contains__(self, docId):
+        return self.get(docId) is not None
+
+    def __len__(self):
+        return self.num_urls
+
+    def close(self):
+        self.mapped_store.close()
+        self.docstore_file.close()
+
+
+if __name__ == "__main__":
+    time_start = time.time() # start the timer for opening the docstore
+    doc_store = DocStore(DOCSTORE_FILE)
+    time_end = time.time() # end the timer for opening the docstore
+
+    print(f"Opened docstore with {len(doc_store)} URLs in: {time_end - time_start} seconds...")
@@ -1,6 +1,7 @@
 import os
 import json
 import re
+import hashlib
 import time
 import warnings # having an XMLParseAsHTMLWarning, using to catch it and identify XML file(s)
 import nltk
@@ -8,22 +9,67 @@ import threading
 import queue
 import math
 import multiprocessing
+import multiprocessing.util
 
+from array import array
 from collections import defaultdict
+from functools import partial
 from bs4 import BeautifulSoup, Comment, XMLParsedAsHTMLWarning
-from tokenizer import Tokenizer
+from tokenizer import Tokenizer, stem
 from pathlib import Path
-from nltk.stem import SnowballStemmer
+from urllib.parse import urlsplit, urlunsplit
 from ReportCreation import report_creation
+from simHashing import Simhashing, simhash
+from IndexMerge import IndexMerge, remove_stale_indexes
+from Metrics import Metrics, NULL_METRICS
+from CorpusReader import LooseCorpus, open_corpus
+from DocStore import DocStore, DOCSTORE_FILE, DOC_LENGTHS_FILE, write_doc_lengths
+from Lexicon import TERMS_FILE, read_terms, write_terms
+from PostingsCodec import DEFAULT_CODEC, encode_positions, get_codec, write_header, write_id_record
 # nltk.download('popular') # Use this to download all popular datasets for nltk, pls run once then you can comment it out
 
+# rough in-memory cost of the main index, used to decide when a batch is flushed:
+# a docId and a freq inside the postings array of a term (with its spare capacity),
+# and a new term ID's postings array and dictionary entry (the term itself is
+# stored once per build, not once per batch)
+POSTING_BYTES = 10
+TERM_BYTES = 150
+POSITION_BYTES = 36 # one position int inside a positions list, only with positional=True
+POSITIONS_LIST_BYTES = 64 # the positions list of a posting and its slot, only with positional=True
+NEAR_DUPLICATES_FILE = "Near_Duplicates.txt" # url of every dropped near-duplicate -> docId of the page it duplicates
+DUPLICATES_FILE = "Duplicates.txt" # url of every dropped exact duplicate (same canonical url or same text) -> docId
+BUILD_METRICS_FILE = "Build_Metrics.json" # summary of the build's metrics, only written when they are enabled (see Metrics.py)
+CHECKPOINT_FILE = "Build_Checkpoint.json" # progress of an unfinished build, written after every batch (see build_index)
+CHECKPOINT_LOG_FILE = "Build_Checkpoint_Files.jsonl" # what became of every file processed by an unfinished build
+CHECKPOINT_VERSION = 1
+
+# stemmed token -> term ID local to the worker process, reset by _init_worker for every pool, see _process_file
+_worker_term_ids = dict()
+_worker_metrics = NULL_METRICS # metrics of the worker process, set up by _init_worker
 
 
 class IndexBuilder:
-    def __init__(self, filePath, batchSize=10000):
+    def __init__(self, filePath, batchSize=None, codec=DEFAULT_CODEC, memoryBudgetMB=512, writerQueueSize=1, positional=False,
+                 outputDirectory=".", firstDocId=1, nearDuplicateDistance=3, metrics=None, checkpoint=True, knownDocuments=None):
         self.docId_to_url = dict() # dictionary to store the docId to URL mapping
-        self.filePath = filePath # path to the folder containing all the JSON files
-        self.batchSize = batchSize # number of files to process before writing to disk, defaulted to 10,000 files per batch
+        self.file_to_docId = dict() # path of every processed JSON file -> its docId, None if it was skipped
+        self.filePath = filePath # path to the folder containing all the JSON files, or to a corpus pack (see CorpusReader.py)
+        self.batchSize = batchSize # optional cap on the number of files per batch, None means only the memory budget decides
+        self.codec = get_codec(codec) # postings codec used for the batch files, varbyte by default
+        self.memoryBudget = memoryBudgetMB * 1024 * 1024 # bytes that all in-memory batches together may take up
+        self.writerQueueSize = writerQueueSize # sorted batches allowed to wait for the writer before the builder blocks
+        self.positional = positional # also index the positions of every word, needed for phrase queries
+        self.outputDirectory = outputDirectory # where the batches, the docstore and the document lengths are written
+        self.firstDocId = firstDocId # docId of the first document, above 1 when building a new segment (see IndexSegments.py)
+        self.nearDuplicateDistance = nearDuplicateDistance # max SimHash bits apart for a page to be dropped, None keeps every page
+        self.near_duplicates = dict() # url of every dropped near-duplicate -> docId of the page kept instead
+        self.duplicates = dict() # url of every dropped exact duplicate -> docId of the page kept instead
+        self.knownDocuments = knownDocuments or dict() # docId -> [content hash hex, SimHash] of pages indexed before (other segments)
+        self.doc_fingerprints = dict() # docId -> [content hash hex, SimHash] of every page indexed by this build
+        self.metrics = metrics if metrics is not None else Metrics() # per-stage metrics, off unless SEARCH_METRICS=1
+        self.checkpoint = checkpoint # checkpoint after every batch and resume an unfinished build from its last checkpoint
+        self._input_fingerprint = None # identifies the files and settings of the build a checkpoint belongs to
+        self._checkpointed_terms = 0 # terms already appended to Terms.txt by the checkpoints
     
     def _writer_thread_worker(self, writer_thread_queue):
         while True:
@@ -33,171 +79,621 @@ class IndexBuilder:
             writer_thread_queue.task_done()
 
 
-    def _write_to_disk(self, main_index, output_file_path):
+    @staticmethod
+    def _bounded(raw_files, in_flight):
+        """
+        Yields the contents of the JSON files to the pool, waiting for
+        a free slot in the in_flight semaphore before handing out each one
+        """
+        for raw_json in raw_files:
+            in_flight.acquire()
+            yield raw_json
+
+    def _write_to_disk(self, main_index, main_positions, output_file_path, terms, checkpoint):
         """
-        Writes the main index to the output file
+        Writes the main index to the output file, one
+        record per term ID in ascending term order (terms
+        being the ID -> term list) so IndexMerge can stream
+        the batches through a k-way merge instead of loading
+        them whole. The postings are encoded with the
+        postings codec (see PostingsCodec.py)
+
+        Then checkpoints the build up to this batch, see
+        _write_checkpoint.
         """
-        with open(output_file_path, 'w') as output_file:
-            json.dump(main_index, output_file, indent=2) # main index data is written to the output file in JSON format, easier for parsing later
-            # NOTE: will need to use json.load() to read the data back in later 
+        with self.metrics.timer("write_batch"):
+            self._write_batch(main_index, main_positions, output_file_path, terms)
+        if self.checkpoint:
+            with self.metrics.timer("checkpoint"):
+                self._write_checkpoint(terms, *checkpoint)
         print("\n-----------------------------------------------------")
         print(f"Output successfully written to {output_file_path}")
         print("-----------------------------------------------------")
 
+    def _write_batch(self, main_index, main_positions, output_file_path, terms):
+        term_ids = sorted(main_index, key=terms.__getitem__)
+        if self.positional:
+            # the positions go to their own Output_Positions file
+            # with the same records, as varbyte position gaps
+            positions_file_path = output_file_path.replace("Output_Batch_", "Output_Positions_")
+            with open(output_file_path, 'wb') as output_file, open(positions_file_path, 'wb') as positions_file:
+                write_header(output_file, self.codec)
+                write_header(positions_file, self.codec)
+                for term_id in term_ids:
+                    write_id_record(output_file, term_id, self.codec.encode(self._postings(main_index[term_id])))
+                    encoded_positions = bytearray()
+                    for positions in main_positions[term_id]:
+                        encode_positions(positions, encoded_positions)
+                    write_id_record(positions_file, term_id, encoded_positions)
+        else:
+            with open(output_file_path, 'wb') as output_file:
+                write_header(output_file, self.codec)
+                for term_id in term_ids:
+                    write_id_record(output_file, term_id, self.codec.encode(self._postings(main_index[term_id])))
+
+
+    def _checkpoint_paths(self):
+        return (os.path.join(self.outputDirectory, CHECKPOINT_FILE), os.path.join(self.outputDirectory, CHECKPOINT_LOG_FILE),
+                os.path.join(self.outputDirectory, TERMS_FILE))
+
+    def _batch_files(self, batches):
+        """
+        Returns the names of the batch files (and
+        positions files) of the first batches.
+        """
+        prefixes = ("Output_Batch_", "Output_Positions_") if self.positional else ("Output_Batch_",)
+        return [f"{prefix}{number}.bin" for number in range(1, batches + 1) for prefix in prefixes]
+
+    def _fingerprint_input(self, corpus):
+        """
+        Returns a digest of the files of the corpus (paths,
+        sizes and modification times) and of the settings
+        that change their docIds or postings, so a checkpoint
+        is only resumed by the same build.
+        """
+        digest = hashlib.blake2b(digest_size=16)
+        digest.update(repr((CHECKPOINT_VERSION, self.codec.name, self.positional, self.firstDocId,
+                            self.nearDuplicateDistance)).encode("utf-8"))
+        digest.update(repr(sorted(self.knownDocuments.items())).encode("utf-8"))
+        for json_file, (size, mtime_ns) in zip(corpus.get_files(), corpus.stat_files()):
+            digest.update(f"{json_file}\0{size}\0{mtime_ns}\n".encode("utf-8"))
+        return digest.hexdigest()
+
+    def _write_checkpoint(self, terms, records, num_terms, files_done, next_docId, batches):
+        """
+        Runs in the writer thread once a batch is on disk.
+        Appends the records of the files processed since
+        the last checkpoint to Build_Checkpoint_Files.jsonl
+        and the terms numbered since then to Terms.txt, then
+        atomically replaces Build_Checkpoint.json with how
+        far the build got, including the length of both files
+        (anything after it was appended by a later, unfinished
+        checkpoint). Everything is synced to disk first, so
+        the checkpoint never names data that is not there.
+        """
+        checkpoint_path, log_path, terms_path = self._checkpoint_paths()
+        with open(log_path, "ab") as log_file:
+            log_file.write("".join(json.dumps(record) + "\n" for record in records).encode("utf-8"))
+            log_file.flush()
+            os.fsync(log_file.fileno())
+            log_bytes = log_file.tell()
+        with open(terms_path, "ab") as terms_file:
+            terms_file.write("".join(term + "\n" for term in terms[self._checkpointed_terms:num_terms]).encode("utf-8"))
+            terms_file.flush()
+            os.fsync(terms_file.fileno())
+            terms_bytes = terms_file.tell()
+        self._checkpointed_terms = num_terms
+        batch_files = self._batch_files(batches)
+        for batch_file in batch_files[-2 if self.positional else -1:]: # the earlier ones were synced by earlier checkpoints
+            batch_fd = os.open(os.path.join(self.outputDirectory, batch_file), os.O_RDONLY)
+            try:
+                os.fsync(batch_fd)
+            finally:
+                os.close(batch_fd)
+        checkpoint = {
+            "version": CHECKPOINT_VERSION,
+            "input": self._input_fingerprint,
+            "files_done": files_done, # files in build order that no longer have to be processed
+            "next_docId": next_docId,
+            "batches": batches,
+            "batch_files": batch_files,
+            "log_bytes": log_bytes,
+            "terms": num_terms,
+            "terms_bytes": terms_bytes,
+        }
+        with open(checkpoint_path + ".tmp", "w", encoding="utf-8") as checkpoint_file:
+            json.dump(checkpoint, checkpoint_file, indent=2)
+            checkpoint_file.flush()
+            os.fsync(checkpoint_file.fileno())
+        os.replace(checkpoint_path + ".tmp", checkpoint_path)
+
+    def _load_checkpoint(self):
+        """
+        Returns the checkpoint left by an unfinished build
+        of the same files with the same settings, with its
+        log and Terms.txt cut back to the checkpoint, or
+        None after removing any checkpoint that can not be
+        resumed (a build then starts from the first file).
+        """
+        checkpoint_path, log_path, terms_path = self._checkpoint_paths()
+        checkpoint = None
+        if os.path.exists(checkpoint_path):
+            with open(checkpoint_path, "r", encoding="utf-8") as checkpoint_file:
+                checkpoint = json.load(checkpoint_file)
+            complete = (checkpoint.get("version") == CHECKPOINT_VERSION and checkpoint.get("input") == self._input_fingerprint
+                        and os.path.exists(log_path) and os.path.getsize(log_path) >= checkpoint["log_bytes"]
+                        and os.path.exists(terms_path) and os.path.getsize(terms_path) >= checkpoint["terms_bytes"]
+                        and all(os.path.exists(os.path.join(self.outputDirectory, file)) for file in checkpoint["batch_files"]))
+            if not complete:
+                checkpoint = None
+        if checkpoint is None:
+            self._remove_checkpoint()
+            if os.path.exists(terms_path):
+                os.remove(terms_path) # the checkpoints append to it
+            return None
+        os.truncate(log_path, checkpoint["log_bytes"])
+        os.truncate(terms_path, checkpoint["terms_bytes"])
+        return checkpoint
+
+    def _remove_checkpoint(self):
+        checkpoint_path, log_path, _ = self._checkpoint_paths()
+        for path in (checkpoint_path, checkpoint_path + ".tmp", log_path):
+            if os.path.exists(path):
+                os.remove(path)
+
+    @staticmethod
+    def _read_checkpoint_log(log_path):
+        with open(log_path, "r", encoding="utf-8") as log_file:
+            for line in log_file:
+                yield json.loads(line)
+
+    @staticmethod
+    def _postings(flat_postings):
+        """
+        Turns the flat docId, freq, docId, freq, ... array
+        of a term into the (docId, freq) list the postings
+        codec encodes. DocIDs are handed out in ascending
+        order, so the postings are already sorted by docID
+        """
+        return list(zip(flat_postings[0::2], flat_postings[1::2]))
+
+    @staticmethod
+    def _extract_text(html_content):
+        """
+        Parses the HTML content with beautiful soup and
+        returns its visible text, or None when the file
+        is XML parsed as HTML and should be skipped
+        """
+        with warnings.catch_warnings(record=True) as w: # catch the warning
+            warnings.simplefilter("always", XMLParsedAsHTMLWarning)
+            soup_obj = BeautifulSoup(html_content, "lxml")
+
+            if any(issubclass(warn.category, XMLParsedAsHTMLWarning) for warn in w):
+                return None
+
+        for comment in soup_obj.find_all(string = lambda string: isinstance(string, Comment)):
+            comment.extract()
+
+        # removes all <script> and <style> tags
+        for tag_element in soup_obj.find_all(['script', 'style']):  
+            tag_element.extract()
+        if(soup_obj.find('title')):
+            soup_obj.find('title').decompose() #remove title header, makes word count more accurate
+        # remove title from text data, analyze code. Many words are being mashed together. Axel
+
+        # gets the actual text inside the HTML file
+        raw_text = soup_obj.get_text(separator=" ", strip=True)
+        return " ".join(re.findall(r'[a-zA-Z0-9]+', raw_text))
 
-    def _sort_index(self, main_index):
+    @staticmethod
+    def canonicalize_url(url):
         """
-        Sorts the main index by 
-            - frequency of the words (primary)
-            - the docID (secondary)
+        Returns the canonical form of a url, so the same page
+        reached through different urls is indexed once:
+        lowercase scheme and host, no default port, no
+        fragment (#content) and no trailing slash on paths.
         """
-        # NOTE: x[1][1] is word frequency, x[1][0] is docID, '-' implies DESC order (highest first)
-        sorted_index = {word: sorted(entries, key=lambda x: (-x[1], -x[0])) 
-                        for word, entries in main_index.items()}
-        return sorted_index
+        if url is None:
+            return None
+        parts = urlsplit(url.strip())
+        scheme = parts.scheme.lower()
+        host = (parts.hostname or "").rstrip(".")
+        if parts.port is not None and (scheme, parts.port) not in (("http", 80), ("https", 443)):
+            host = f"{host}:{parts.port}"
+        path = parts.path.rstrip("/") or "/"
+        return urlunsplit((scheme, host, path, parts.query, ""))
+
+    @staticmethod
+    def _init_worker(metrics_enabled=False, profile_stages=(), profile_mode=None, profile_directory="."):
+        """
+        Runs once inside each worker process of a build,
+        so its term IDs start over with the new pool, and
+        sets up its metrics like the ones of the build.
+        The profiles of the worker are saved to the
+        profile directory when the worker exits.
+        """
+        global _worker_metrics
+        _worker_term_ids.clear()
+        _worker_metrics = Metrics(metrics_enabled, profile_stages, profile_mode) if metrics_enabled else NULL_METRICS
+        if _worker_metrics.profile_stages:
+            multiprocessing.util.Finalize(None, _worker_metrics.save_profiles, args=(profile_directory, os.getpid()),
+                                          exitpriority=10)
+
+    @staticmethod
+    def _process_file(raw_json, positional=False, fingerprint=False):
+        """
+        Runs inside the worker processes, doing the whole
+        decode -> parse -> extract -> tokenize -> stem
+        pipeline for the contents of one JSON file (read
+        ahead by the corpus reader, see CorpusReader.py).
+
+        Returns (worker, new terms, canonical url, frequencies,
+        positions, simhash, content hash, metrics) or None if
+        the file is skipped. Every worker numbers the stemmed
+        tokens it sees with its own term IDs, and only sends a
+        token string back once: new terms lists the tokens
+        numbered for this file, in term ID order. frequencies
+        is an array of (term ID, frequency) pairs, positions is
+        {term ID: [position, ...]} when positional is set and
+        None otherwise, simhash the SimHash fingerprint of the
+        page when fingerprint is set, content hash a digest of
+        its extracted text and metrics what the worker's metrics
+        gathered since its last result (None when they are off,
+        see Metrics.drain). DocIDs (and the term IDs of the
+        whole build) are assigned by the parent so they stay
+        deterministic regardless of which worker finishes first.
+        """
+        metrics = _worker_metrics
+        with metrics.timer("decode_json"):
+            data = json.loads(raw_json) # decodes the json file
+
+        with metrics.timer("parse_html"):
+            main_text = IndexBuilder._extract_text(data.get("content"))
+        if main_text is None:
+            # print(f"\t Skipping {data.get("url")}")
+            return None
 
-    def _process_file(self, main_text, docId, url):
-        temp_index = defaultdict(list) # temporary index to store the current batch's partial index
         # calls tokenizes and normalizes the words within the main text
-        current_tokenizer = Tokenizer()
-        tokens_list = current_tokenizer.tokenize(main_text)
-        current_tokenizer.compute_frequencies(tokens_list)
-        ordered_tokens = current_tokenizer.getTokens()
-
-        # updates the docID_dict to add the entry docId: url
-        temp_docId_to_url = dict()
-        temp_docId_to_url[docId] = url
-
-        # creates the posting for the inverted index entries 
-        # for the words present in the current file
-        for token, frequency in ordered_tokens.items():
-            stemmed_token = SnowballStemmer("english").stem(token) # stemming the token
-            current_entry = (docId, frequency)
-            temp_index[stemmed_token].append(current_entry)
-        
-        return temp_index, temp_docId_to_url
+        with metrics.timer("tokenize"):
+            current_tokenizer = Tokenizer(record_positions=positional)
+            tokens_list = current_tokenizer.tokenize(main_text)
+            current_tokenizer.compute_frequencies(tokens_list)
+            ordered_tokens = current_tokenizer.getTokens()
+
+        # adds up the frequencies (and positions) of the tokens that share
+        # the same stem, so every word has a single posting per document
+        with metrics.timer("stem"):
+            stemmed_frequencies = defaultdict(int)
+            stemmed_positions = defaultdict(list) if positional else None
+            for token, frequency in ordered_tokens.items():
+                stemmed_token = stem(token) # stemming the token, memoized per worker
+                stemmed_frequencies[stemmed_token] += frequency
+                if positional:
+                    stemmed_positions[stemmed_token] += current_tokenizer.getPositions()[token]
 
-    def build_index(self):
+        with metrics.timer("term_ids"):
+            new_terms = []
+            frequencies = []
+            for stemmed_token, frequency in stemmed_frequencies.items():
+                term_id = _worker_term_ids.get(stemmed_token)
+                if term_id is None:
+                    term_id = _worker_term_ids[stemmed_token] = len(_worker_term_ids)
+                    new_terms.append(stemmed_token)
+                frequencies.append(term_id)
+                frequencies.append(frequency)
+            # 2 bytes per number on the way back to the parent, unless a term ID or a frequency does not fit
+            frequencies = array('H' if max(frequencies, default=0) < 65536 else 'I', frequencies)
+            if positional:
+                stemmed_positions = {_worker_term_ids[word]: sorted(positions) for word, positions in stemmed_positions.items()}
+        with metrics.timer("fingerprint"):
+            fingerprint = simhash(stemmed_frequencies) if fingerprint else None
+            content_hash = hashlib.blake2b(main_text.encode("utf-8"), digest_size=16).digest()
+        url = IndexBuilder.canonicalize_url(data.get("url"))
+        metrics.observe("doc_tokens", len(tokens_list))
+        metrics.observe("doc_terms", len(stemmed_frequencies))
+        return os.getpid(), new_terms, url, frequencies, stemmed_positions, fingerprint, content_hash, metrics.drain()
+
+    def build_index(self, json_files=None):
         """
         takes in a folder path to access the folder that
         contains many folders that are made of json files
-        inside. 
+        inside, or the path of a corpus pack. A list of
+        json_files can be given instead to only index those
+        (new segments only index the new or changed files).
+
+        The files are read ahead of the workers by the corpus
+        reader (see CorpusReader.py): a pool of threads for
+        the loose files of a folder, or one memory-mapped file
+        for a corpus pack. The workers only decode them.
 
         Curently changing content format to:
             inverted_index = {
-                'word1': [(docId : int, freq1 : int), (docId, freq2)],
-                'word2': [(docId, freq3), (docId, freq4)],
+                term ID 1: array('I', [docId, freq1, docId, freq2]),
+                term ID 2: array('I', [docId, freq3, docId, freq4]),
                 ...
             }
-        """
-        processes = [] # list of all started processes
+        which takes 8 bytes per posting instead of a tuple each.
+        With positional set, the positions of the word inside
+        every posting are kept next to it:
+            {term ID 1: [[position, ...], [position, ...]], ...}
+        The term IDs are numbered in the order the terms are
+        first seen, and written to Terms.txt at the end.
+
+        Pages with the same canonical url or exactly the same
+        text as a page indexed before them share its docId
+        instead of getting their own, and pages whose SimHash
+        fingerprint is at most nearDuplicateDistance bits away
+        from an indexed page are dropped too (see simHashing.py),
+        both before their postings are added. The text and the
+        SimHash of the knownDocuments (the live pages of the
+        other segments) count as indexed pages too, their urls
+        do not since a re-crawled url replaces its old page.
+
+        After every batch is written, the build is checkpointed
+        (see _write_checkpoint): what became of every file so far
+        (its docId and url, or the page it duplicates) goes to
+        Build_Checkpoint_Files.jsonl, the new terms to Terms.txt
+        and the number of files done, the next docId and the
+        batches to Build_Checkpoint.json. A build of the same
+        files that finds the checkpoint (after a crash or a kill)
+        keeps its batches, replays the log to get back its docIds,
+        urls, duplicates and fingerprints, and carries on with
+        the first file after the checkpoint, so the index comes
+        out the same as if it had never stopped. The checkpoint
+        is removed once the build is done.
 
-        main_index = defaultdict(list) # Our main inverted index
+        With the metrics enabled (see Metrics.py), the time
+        spent in every stage of the workers, of this loop and
+        of the writer thread is summed up and written to
+        Build_Metrics.json at the end, along with the profile
+        of the stages listed in SEARCH_PROFILE.
+        """
+        main_index = defaultdict(partial(array, 'I')) # Our main inverted index
+        main_positions = defaultdict(list) if self.positional else None # positions of the postings of main_index
+        terms = [] # term ID -> stemmed term, over the whole build
+        term_ids = dict() # stemmed term -> term ID
+        worker_term_ids = defaultdict(list) # pid of a worker -> term ID of each of its own term IDs
         docId_to_url_builder = dict() # dictionary to store the docId to URL mapping
-        docId = 1 # unique identifier for each document, incremented by 1 for each file
-        batchSize = 10000 # number of files to process before writing to disk, could make bigger to reduce I/O overhead?? But we gotta consider memory usage (too big = bad, computer could go into coma)
-        skip = False # flag to skip the current file if it has an XMLParsedAsHTMLWarning
+        doc_lengths = array('I', [0]) # number of tokens of every docId from firstDocId on, slot 0 is unused
+        docId = self.firstDocId # unique identifier for each document, incremented by 1 for each file
+        # the budget is shared by the batch being built, the batches waiting in
+        # the writer queue and the batch the writer thread is writing
+        batch_budget = self.memoryBudget // (self.writerQueueSize + 2)
+        batch_bytes = 0 # estimated memory used by the current main index
+        docs_in_batch = 0 # number of documents added to the main index since the last batch was written
         batchCount = 0 # counter to keep track of the batch number
-        writer_thread_queue = queue.Queue() # Queue to store all started threads
+        # bounded, so put() blocks (backpressure) when the writer falls behind
+        writer_thread_queue = queue.Queue(maxsize=self.writerQueueSize)
 
         # Creating a single writer thread to write to disk
         writer_thread = threading.Thread(target=self._writer_thread_worker, args=(writer_thread_queue,), daemon=True)
         writer_thread.start()
-        ### MULTIPROCESSING IMPLEMENTATION ???? ###
+        ### MULTIPROCESSING IMPLEMENTATION ###
         # 1. Create a multiprocessing pool to manage the processes (instead of manually handling them)
-        # 2. Initialize task list, should contain all the files to process, resets every batchSize
-        # 3. Create a process for each file in the task list
-        # 4. Once batchSize reached --> retrieve all current tasks -->
-        #        update main_index with results --> sort and write to batch file
+        # 2. Hand the contents of every JSON file to the pool as the corpus reader reads them ahead,
+        #        the workers decode, parse, tokenize and stem it
+        # 3. Collect the results in file order (imap) and assign the docIds in that order,
+        #        dropping the pages that are near-duplicates (SimHash) of the ones before them
+        # 4. Once the memory budget (or batchSize) is reached --> hand the main_index to the writer,
+        #        blocking while the writer queue is full
         # 5. Repeat until all files are processed
         # 6. Catch stragglers, AKA remaining files that didn't make it to the last batch
         # 7. Join thread for writer, ensures all files are actually written to disk
         ####################################################################
-        with multiprocessing.Pool() as pool:
-            tasks_per_batch = []
-            # iterating through the directory/folder that contains all of the JSON files
-            for json_file in Path(self.filePath).rglob('*.json'): 
-                with open(json_file, 'r') as current_file:
-                    data = json.load(current_file) # loads the json file
-
-                    # using beautiful soup to parse the content
-                    html_content = data.get("content")
-                    with warnings.catch_warnings(record=True) as w: # catch the warning
-                        warnings.simplefilter("always", XMLParsedAsHTMLWarning)
-                        soup_obj = BeautifulSoup(html_content, "lxml")
-
-                        if any(issubclass(warn.category, XMLParsedAsHTMLWarning) for warn in w):
-                            skip = True
-                    if skip:
-                        # print(f"\t Skipping {data.get("url")}")
-                        skip = False
-                        continue
-
-                    for comment in soup_obj.find_all(string = lambda string: isinstance(string, Comment)):
-                        comment.extract()
-
-                    # removes all <script> and <style> tags
-                    for tag_element in soup_obj.find_all(['script', 'style']):  
-                        tag_element.extract()
-                    if(soup_obj.find('title')):
-                        soup_obj.find('title').decompose() #remove title header, makes word count more accurate
-                    # remove title from text data, analyze code. Many words are being mashed together. Axel
-                    
-                    # gets the actual text inside the HTML file
-                    raw_text = soup_obj.get_text(separator=" ", strip=True)
-                    main_text = " ".join(re.findall(r'[a-zA-Z0-9]+', raw_text))
-                    # print(f"this is the main text: {main_text}")
-
-                    # calls the process_file function, tokenizing the file's text and adding it to the main index
-                    task = pool.apply_async(self._process_file, args=(main_text, docId, data.get("url")))
-                    tasks_per_batch.append(task) # add task to the current batch
-
-                    # updates the docID_dict to add the entry docId: url
-                    # docId_dict[docId] = data.get("url")
+        # the files are listed up front, sorted so the docIds do not depend on the file system's listing order
+        corpus = open_corpus(self.filePath) if json_files is None else LooseCorpus(json_files)
+        json_files = corpus.get_files()
+        checkpoint = None
+        if self.checkpoint:
+            self._input_fingerprint = self._fingerprint_input(corpus)
+            checkpoint = self._load_checkpoint()
+        # batches left over from an earlier (bigger) build would otherwise be merged in too,
+        # only the ones written before the checkpoint are kept when resuming
+        kept_batches = set(checkpoint["batch_files"]) if checkpoint is not None else set()
+        for file in os.listdir(self.outputDirectory):
+            if file.startswith(("Output_Batch_", "Output_Positions_")) and file.endswith(".bin") and file not in kept_batches:
+                os.remove(os.path.join(self.outputDirectory, file))
+        # the shards and segments of an older index would be searched instead of this one
+        remove_stale_indexes(self.outputDirectory)
+        self.file_to_docId = dict()
+        self.near_duplicates = dict()
+        self.duplicates = dict()
+        self.doc_fingerprints = dict()
+        url_to_docId = dict() # canonical url -> docId, of the pages indexed by this build
+        content_to_docId = dict() # content hash -> docId
+        simhashing = Simhashing(self.nearDuplicateDistance) if self.nearDuplicateDistance is not None else None
+        for known_docId, (content_hash, fingerprint) in self.knownDocuments.items():
+            content_to_docId[bytes.fromhex(content_hash)] = known_docId
+            if simhashing is not None and fingerprint is not None:
+                simhashing.add(fingerprint, known_docId)
+        metrics = self.metrics
+        files_done = 0 # files handled so far, in json_files order
+        checkpoint_records = [] # what became of each file handled since the last batch, see _write_checkpoint
+        self._checkpointed_terms = 0
+        if checkpoint is not None:
+            # replays the files handled before the checkpoint, like the loop below would have
+            for record in self._read_checkpoint_log(os.path.join(self.outputDirectory, CHECKPOINT_LOG_FILE)):
+                kind, json_file = record[0], record[1]
+                self.file_to_docId[json_file] = None
+                if kind == "duplicate":
+                    _, _, url, duplicate = record
+                    self.duplicates.setdefault(url, duplicate)
+                elif kind == "near_duplicate":
+                    _, _, url, content_hash, near_duplicate = record
+                    url_to_docId[url] = near_duplicate
+                    content_to_docId[bytes.fromhex(content_hash)] = near_duplicate
+                    self.near_duplicates[url] = near_duplicate
+                elif kind == "indexed":
+                    _, _, url, content_hash, fingerprint, doc_length = record
+                    url_to_docId[url] = docId
+                    content_to_docId[bytes.fromhex(content_hash)] = docId
+                    if simhashing is not None:
+                        simhashing.add(fingerprint, docId)
+                    self.file_to_docId[json_file] = docId
+                    self.doc_fingerprints[docId] = [content_hash, fingerprint]
+                    docId_to_url_builder[docId] = url
+                    doc_lengths.append(doc_length)
                     docId += 1
-                    #
-
-                    # Check if batch limit has been reached, T -> etner the if block, F -> continue to next file
-                    if len(tasks_per_batch) % batchSize == 0:
-                        # retrieving the current batch of processed files
-                        for task in tasks_per_batch:
-                            partial_index, task_docId_mapping = task.get() # get the partial index from the task
-                            for word, postings in partial_index.items():
-                                main_index[word] += postings
-                            docId_to_url_builder.update(task_docId_mapping) # update the docId_to_url dictionary with the current task's docId to URL mapping (should be one mapping per task)
-                        batchCount += 1 # increment the batch count
-
-                        # Sort and Write the current batch to disk   
-                        main_index = self._sort_index(main_index)
-                        writer_thread_queue.put((main_index, f"Output_Batch_{batchCount}.txt"))
-                        
-                        main_index = defaultdict(list) # reset the main index
-                        tasks_per_batch = [] # reset the tasks list
-
-            # Process the remaining files if any
-            for task in tasks_per_batch:
-                partial_index, task_docId_mapping = task.get()
-                for word, postings in partial_index.items():
-                    main_index[word].extend(postings)
-                docId_to_url_builder.update(task_docId_mapping)
-
-            if main_index:
-                batchCount += 1
-                # Sort and Write remaining files to disk if any (Catch the stragglers)
-                main_index = self._sort_index(main_index)
-                writer_thread_queue.put((main_index, f"Output_Batch_{batchCount}.txt"))
-                # write_to_disk(main_index, f"Output_Batch_{batchCount}.txt")
-        
-        writer_thread_queue.put((docId_to_url_builder, "docID_to_URL.txt")) # gather all {docId : url} pairs and write to disk in ONE FILE, different from the batch files which write in batches
-        writer_thread_queue.join()
-        writer_thread_queue.put(None)
-        writer_thread.join()
+            files_done = checkpoint["files_done"]
+            batchCount = checkpoint["batches"]
+            if docId != checkpoint["next_docId"] or len(self.file_to_docId) != files_done:
+                raise ValueError(f"{CHECKPOINT_LOG_FILE} does not match {CHECKPOINT_FILE}, remove both to build from scratch")
+            terms = read_terms(os.path.join(self.outputDirectory, TERMS_FILE))
+            term_ids = {term: term_id for term_id, term in enumerate(terms)}
+            self._checkpointed_terms = len(terms)
+            metrics.count("files_resumed", files_done)
+            print(f"Resuming the build after {files_done} files and {batchCount} batches...")
+        chunksize = 16
+        worker_settings = (metrics.enabled, metrics.profile_stages, metrics.profile_mode, self.outputDirectory)
+        num_processes = os.cpu_count() or 1 # the pool's default, kept to size the in-flight window
+        with multiprocessing.Pool(processes=num_processes, initializer=IndexBuilder._init_worker,
+                                  initargs=worker_settings) as pool:
+            # limits the files handed to the workers but not yet consumed here, otherwise
+            # results keep piling up in memory while put() blocks on a full writer queue
+            in_flight = threading.Semaphore(chunksize * (2 * num_processes + 1))
+            process_file = partial(IndexBuilder._process_file, positional=self.positional, fingerprint=simhashing is not None)
+            remaining_files = json_files[files_done:]
+            results = pool.imap(process_file, self._bounded(corpus.read(files_done, metrics), in_flight), chunksize=chunksize)
+            # imap keeps the order of the files, the time spent waiting for the workers is a stage of its own
+            for json_file, result in zip(remaining_files, metrics.timed_iter("wait_for_workers", results)):
+                in_flight.release()
+                metrics.count("files")
+                files_done += 1
+                if result is None:
+                    metrics.count("files_skipped")
+                    self.file_to_docId[str(json_file)] = None
+                    checkpoint_records.append(("skipped", str(json_file)))
+                    continue # file was skipped by the worker
+
+                worker, new_terms, url, frequencies, positions, fingerprint, content_hash, worker_metrics = result
+                metrics.merge(worker_metrics)
+                # the new terms of a worker come back in the order it numbered them, since
+                # every worker handles its files in file order and imap keeps that order
+                to_term_id = worker_term_ids[worker]
+                for term in new_terms:
+                    term_id = term_ids.get(term)
+                    if term_id is None:
+                        term_id = term_ids[term] = len(terms)
+                        terms.append(term)
+                    to_term_id.append(term_id)
+                with metrics.timer("deduplicate"):
+                    duplicate = url_to_docId.get(url) if url is not None else None
+                    if duplicate is None:
+                        duplicate = content_to_docId.get(content_hash)
+                    if duplicate is None:
+                        near_duplicate = simhashing.computeHash(docId, fingerprint) if simhashing is not None else None
+                        # a dropped near-duplicate does not use up docId, its copies are duplicates of the page kept instead
+                        kept_docId = near_duplicate if near_duplicate is not None else docId
+                        url_to_docId[url] = kept_docId
+                        content_to_docId[content_hash] = kept_docId
+                if duplicate is not None:
+                    metrics.count("duplicates")
+                    self.duplicates.setdefault(url, duplicate)
+                    self.file_to_docId[str(json_file)] = None
+                    checkpoint_records.append(("duplicate", str(json_file), url, duplicate))
+                    continue # same page as one that is already indexed
+                if near_duplicate is not None:
+                    metrics.count("near_duplicates")
+                    self.near_duplicates[url] = near_duplicate
+                    self.file_to_docId[str(json_file)] = None
+                    checkpoint_records.append(("near_duplicate", str(json_file), url, content_hash.hex(), near_duplicate))
+                    continue # near-duplicate of a page that is already indexed
+
+                self.file_to_docId[str(json_file)] = docId
+                docId_to_url_builder[docId] = url # updates the docID_dict to add the entry docId: url
+                doc_lengths.append(sum(frequencies[1::2]))
+                checkpoint_records.append(("indexed", str(json_file), url, content_hash.hex(), fingerprint, doc_lengths[-1]))
+                self.doc_fingerprints[docId] = [content_hash.hex(), fingerprint]
+                with metrics.timer("add_postings"):
+                    for i in range(0, len(frequencies), 2):
+                        worker_term_id, frequency = frequencies[i], frequencies[i + 1]
+                        term_id = to_term_id[worker_term_id]
+                        if term_id not in main_index:
+                            batch_bytes += TERM_BYTES
+                        postings = main_index[term_id]
+                        postings.append(docId)
+                        postings.append(frequency)
+                        if self.positional:
+                            main_positions[term_id].append(positions[worker_term_id])
+                            batch_bytes += POSITIONS_LIST_BYTES + POSITION_BYTES * frequency
+                metrics.count("documents")
+                metrics.count("postings", len(frequencies) // 2)
+                batch_bytes += POSTING_BYTES * (len(frequencies) // 2)
+                docId += 1
+                docs_in_batch += 1
+
+                # Check if the memory budget (or the optional batchSize) has been reached, T -> enter the if block, F -> continue to next file
+                if batch_bytes >= batch_budget or docs_in_batch == self.batchSize:
+                    batchCount += 1 # increment the batch count
+                    metrics.observe("batch_documents", docs_in_batch)
+
+                    # Write the current batch to disk, waiting here is backpressure from the writer thread
+                    with metrics.timer("queue_batch"):
+                        writer_thread_queue.put((main_index, main_positions,
+                                                 os.path.join(self.outputDirectory, f"Output_Batch_{batchCount}.bin"), terms,
+                                                 (checkpoint_records, len(terms), files_done, docId, batchCount)))
+                    checkpoint_records = []
+
+                    main_index = defaultdict(partial(array, 'I')) # reset the main index
+                    main_positions = defaultdict(list) if self.positional else None
+                    batch_bytes = 0
+                    docs_in_batch = 0
+            # lets the workers exit on their own, so they save their profiles (see _init_worker)
+            pool.close()
+            pool.join()
+        corpus.close()
+
+        if main_index:
+            batchCount += 1
+            metrics.observe("batch_documents", docs_in_batch)
+            # Write remaining files to disk if any (Catch the stragglers)
+            writer_thread_queue.put((main_index, main_positions,
+                                     os.path.join(self.outputDirectory, f"Output_Batch_{batchCount}.bin"), terms,
+                                     (checkpoint_records, len(terms), files_done, docId, batchCount)))
+
+        with metrics.timer("wait_for_writer"):
+            writer_thread_queue.join()
+            writer_thread_queue.put(None)
+            writer_thread.join()
+        metrics.count("batches", batchCount)
+        metrics.count("terms", len(terms))
+        write_terms(os.path.join(self.outputDirectory, TERMS_FILE), terms) # used by IndexMerge to turn the term IDs back into terms
+        # gather all {docId : url} pairs and write to disk in ONE FILE, different from the batch files which write in batches
+        with open(os.path.join(self.outputDirectory, "docID_to_URL.txt"), 'w', encoding='utf-8') as output_file:
+            json.dump(docId_to_url_builder, output_file, indent=2)
+        # packed, memory-mappable copy used by the search side
+        DocStore.write(os.path.join(self.outputDirectory, DOCSTORE_FILE), docId_to_url_builder)
+        # used by IndexMerge for the collection statistics
+        write_doc_lengths(os.path.join(self.outputDirectory, DOC_LENGTHS_FILE), doc_lengths)
+        with open(os.path.join(self.outputDirectory, NEAR_DUPLICATES_FILE), 'w', encoding='utf-8') as output_file:
+            json.dump(self.near_duplicates, output_file, indent=2)
+        with open(os.path.join(self.outputDirectory, DUPLICATES_FILE), 'w', encoding='utf-8') as output_file:
+            json.dump(self.duplicates, output_file, indent=2)
+        if self.checkpoint:
+            self._remove_checkpoint() # the build is done, nothing is left to resume
         print("All files have been processed and written to disk...")
         print(f"Total docID to URL mappings: {len(docId_to_url_builder)}")
+        print(f"Duplicate pages (same url or text) dropped: {len(self.duplicates)}")
+        print(f"Near-duplicate pages dropped: {len(self.near_duplicates)}")
         print("-----------------------------------------------------")
+        if metrics.enabled:
+            self._write_metrics()
         
         self.docId_to_url = docId_to_url_builder # update the docId_to_url attribute with the final dictionary
 
+    def _write_metrics(self):
+        """
+        Adds the profiles saved by the workers to the
+        build's metrics, then writes their summary to
+        Build_Metrics.json and prints it.
+        """
+        if self.metrics.profile_stages:
+            self.metrics.load_profiles(self.outputDirectory)
+        with open(os.path.join(self.outputDirectory, BUILD_METRICS_FILE), 'w', encoding='utf-8') as output_file:
+            json.dump(self.metrics.summary(), output_file, indent=2)
+        print("\n".join(self.metrics.format_summary()))
+        print("-----------------------------------------------------")
+
     def get_docId_to_url(self):
         return self.docId_to_url
 
@@ -212,6 +708,12 @@ if __name__ == "__main__":
 
     print(f"Finished Index creation process in: {time_end - time_start} seconds...")
 
+    time_start = time.time() # start the timer for merging the partial indexes
+    IndexMerge('.').merge_index()
+    time_end = time.time() # end the timer for merging the partial indexes
+
+    print(f"Finished Index merging process in: {time_end - time_start} seconds...")
+
     # time_start_2 = time.time() # start the timer for creating report
     # report_creation('.')
     # time_end_2 = time.time() # end the timer for creating report
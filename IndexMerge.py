@@ -1,130 +1,531 @@
-from collections import defaultdict
-from multiprocessing import Process, Manager, Pool
 import os, json
 import heapq
+import shutil
+import mmap
+import struct
 import time
+from bisect import bisect_left
+from DocStore import DocStore, DOCSTORE_FILE, DOC_LENGTHS_FILE, read_doc_lengths
+from Scoring import Scoring
+from Lexicon import Lexicon, TERMS_FILE, read_terms
+from Metrics import Metrics
+from array import array
+from PostingsCodec import (DEFAULT_CODEC, DEFAULT_INDEX_CODEC, decode_varbyte, encode_varbyte, get_codec, read_id_records,
+                           read_records, write_header, write_record)
 
 
 """
-This class that analyzes through the newly created
-partial index inside the Output_Batch text files 
-inside the same directory to create a smaller index
-that may contain tokens that is scattered throughout
-the Output_Batch text files. 
-
-The smaller index only contains the tokens that are
-parsed only from the search query to minimize the 
-consumption of memory and allow for faster search. 
-
-The smaller index will have the format:
-    smaller_index = {
-        'word1': [(docId : int, freq1 : int), (docId, freq2)],
-        'word2': [(docId, freq3), (docId, freq4)],
+This class merges the partial indexes inside the
+Output_Batch files, created by IndexBuilder, into
+one final on-disk index so that search queries
+never have to load the batch files again.
+
+Every batch file stores one record per term in
+ascending term order (see PostingsCodec.py), which
+lets the batches be streamed through a k-way merge
+while only holding a single term of each batch in memory.
+The records of the batches name their term by its term
+ID, turned back into the term through Terms.txt.
+
+The merge creates two files:
+    Final_Index.bin = the encoded postings of every
+        term, sorted by docID, written back to back
+    Lexicon.bin = {
+        'word1': [offset : int, length : int, df : int, max_tfidf : float, max_bm25 : float, ...],
+        'word2': [offset, length, df, max_tfidf, max_bm25, ...],
         ...
-    }
+    } as a sorted, front-coded term list (see Lexicon.py)
+so the postings of a query term can be read with a
+single seek, see IndexReader. max_tfidf and max_bm25 are
+the highest score any single posting of the term adds to
+a document, which RankedRetrieval uses to skip documents
+that can not make it into the top k (MaxScore pruning).
+
+It also writes the collection statistics to Index_Stats.txt
+(number of documents and terms, average document length,
+...), the per-term df being in the lexicon and the per-doc
+lengths in Doc_Lengths.bin, so nothing has to scan the index
+to get them. With impact_bits set, the bm25 score of every
+posting is also quantized to an integer between 0 and
+2 ** impact_bits - 1 and stored in Impacts.bin (one varbyte
+per posting, in the same order as the postings).
+
+When the batches were built with positional=True, the
+Output_Positions files are merged into Positions.bin: per
+term, a table of (df + 1) uint32 offsets followed by the
+varbyte position gaps of every posting, so the positions
+of the i-th posting of a term can be read on their own.
+
+Terms with more than `champions` postings also get a champion
+list in Champions.bin: their champions postings with the highest
+bm25 score, sorted by docID, which RankedRetrieval can rank on
+its own as a first tier before falling back to the whole
+postings (see RankedRetrieval.search). Champions.bin layout:
+    header    = magic b"CHMP", champions : uint32,
+                number of lists : uint32
+    ordinals  = the lexicon ordinal (see Lexicon.find) of the
+                term of every list : uint32, ascending
+    offsets   = (number of lists + 1) * uint64, where list i
+                starts inside lists (the last one is the end)
+    lists     = per list: varbyte(length of the postings) +
+                the postings (vbyte codec, see PostingsCodec.py),
+                followed by their quantized impacts (one varbyte
+                each) when the index has impacts
+
+Every lexicon entry therefore has 9 values:
+    [offset, length, df, max_tfidf, max_bm25,
+     impact_offset, max_impact, positions_offset, max_freq]
+impact_offset, max_impact and positions_offset being None
+when the index has no impacts or no positions.
+
+merge_segments merges already merged indexes (the segments
+of IndexSegments.py) the same way, leaving out the postings
+of deleted documents, and merge_shard merges only one range
+of docIds of the batches into an index of its own (the shards
+of IndexShards.py).
+
+With SEARCH_METRICS=1 the time spent reading the batches,
+decoding and writing the postings, and writing the impacts
+and the lexicon is written to Merge_Metrics.json (see Metrics.py).
 """
+
+FINAL_INDEX_FILE = "Final_Index.bin"
+LEXICON_FILE = "Lexicon.bin"
+STATS_FILE = "Index_Stats.txt"
+IMPACTS_FILE = "Impacts.bin"
+POSITIONS_FILE = "Positions.bin"
+CHAMPIONS_FILE = "Champions.bin"
+DEFAULT_CHAMPIONS = 64 # postings per champion list, terms with fewer postings are their own champion list
+_CHAMPIONS_MAGIC = b"CHMP"
+_CHAMPIONS_HEADER = struct.Struct("<4sII")
+MERGE_METRICS_FILE = "Merge_Metrics.json" # summary of the merge's metrics, only written when they are enabled (see Metrics.py)
+SHARDS_FILE = "Shards.txt" # manifest of an index merged into shards, see IndexShards.py
+SEGMENTS_FILE = "Segments.txt" # manifest of an index built in segments, see IndexSegments.py
+_POSITIONS_OFFSET = struct.Struct("<I")
+
+
+def remove_stale_indexes(main_directory):
+    """
+    Removes the shards and the segments of an index
+    built before inside main_directory. The searchers
+    open them ahead of the merged index (see has_shards
+    and open_index), so a new build or merge would
+    otherwise keep serving the old documents.
+    """
+    for manifest_file in (SHARDS_FILE, SEGMENTS_FILE):
+        manifest_path = os.path.join(main_directory, manifest_file)
+        if os.path.exists(manifest_path):
+            os.remove(manifest_path) # first, so no searcher opens the old directories anymore
+            print(f"Removed {manifest_file} of the previous index inside {main_directory}...")
+    for file in os.listdir(main_directory):
+        if file.startswith(("Shard_", "Segment_")) and os.path.isdir(os.path.join(main_directory, file)):
+            shutil.rmtree(os.path.join(main_directory, file))
+
+
 class IndexMerge:
-    def __init__(self, query_tokens:list):
-        self.query_tokens = query_tokens
-        self.query_index = defaultdict(list)
+    def __init__(self, main_directory, codec=DEFAULT_INDEX_CODEC, num_docs=None, impact_bits=None, metrics=None,
+                 champions=DEFAULT_CHAMPIONS):
+        self.main_directory = main_directory
+        self.codec = get_codec(codec) # postings codec used for the final index, blocks with skip pointers by default
+        self.num_docs = num_docs # N for the score upper bounds, read from the docstore when not given
+        self.impact_bits = impact_bits # bits of the quantized bm25 impact scores, None to not store them
+        self.champions = champions # postings per champion list, None to not store them
+        self.scores = Scoring()
+        self.lexicon = dict()
+        self.doc_lengths = None
+        self.avg_doc_length = 0
+        self.impact_scale = 0
+        self.metrics = metrics if metrics is not None else Metrics() # per-stage metrics, off unless SEARCH_METRICS=1
 
     @staticmethod
-    def _process_files(file_list, query_tokens):
+    def _batch_number(file_name):
         """
-        A helper function that is called for each process 
-        that are being executed in parallel using the 
-        multiprocessing library. 
+        Returns the batch number of an Output_Batch
+        file name, used to keep the batches in the
+        order they were written in (ascending docIDs).
+        """
+        return int(file_name[len("Output_Batch_"):-len(".bin")])
 
-        It opens up Output_Batch text files to accumulate 
-        tokens that are going part of the search query. 
+    @staticmethod
+    def _read_batch(file_path, batch_number, terms):
         """
-        local_query_index = dict()
+        A generator that streams the records of one
+        Output_Batch file, along with the records of its
+        Output_Positions file if the batch has one.
 
-        # iterates only through a subset of the Output Batch files
-        for file_path in file_list:
+        Yields (term, batch_number, codec, payload, positions)
+        so that heapq.merge orders equal terms by batch,
+        terms being the ID -> term list of the build.
+        """
+        positions_file_path = file_path.replace("Output_Batch_", "Output_Positions_")
+        if not os.path.exists(positions_file_path):
+            for term_id, codec, payload in read_id_records(file_path):
+                yield terms[term_id], batch_number, codec, payload, None
+            return
+        # both files hold the same terms in the same order
+        for (term_id, codec, payload), (_, _, positions) in zip(read_id_records(file_path),
+                                                                read_id_records(positions_file_path)):
+            yield terms[term_id], batch_number, codec, payload, positions
+
+    @staticmethod
+    def _read_segment(segment_directory, segment_number):
+        """
+        A generator that streams the terms of a segment
+        (a directory holding a merged index, see IndexSegments)
+        in the same form as _read_batch, cutting the positions
+        of every term out of its Positions.bin.
+        """
+        lexicon = Lexicon(os.path.join(segment_directory, LEXICON_FILE))
+        positions_path = os.path.join(segment_directory, POSITIONS_FILE)
+        if not os.path.exists(positions_path) or not os.path.getsize(positions_path):
+            lexicon.close()
+            for term, codec, payload in read_records(os.path.join(segment_directory, FINAL_INDEX_FILE)):
+                yield term, segment_number, codec, payload, None
+            return
+        with open(positions_path, "rb") as positions_file:
+            mapped_positions = mmap.mmap(positions_file.fileno(), 0, access=mmap.ACCESS_READ)
             try:
-                with open(file_path, "r", encoding="utf-8") as current_file:
-                    content = json.load(current_file)
-                    # filter and accumulate tokens relevant to the query
-                    for q_token in query_tokens:
-                        # accesses the current and new postings to be combined
-                        current_posting = local_query_index.get(q_token, [])
-                        new_posting = content.get(q_token, [])
-                        if not new_posting:
-                            continue # skips to the next token if current token is not present
-                        combined_posting = current_posting + new_posting # postings are merged into one
-                        local_query_index[q_token] = sorted(combined_posting, key=lambda x: x[0])
-
-            except json.JSONDecodeError as e:
-                print(f"JSON decode error {e} in file {file_path}")
-            except Exception as e:
-                print(f"Unexpected error while processing {file_path}: {e}")
-
-        return local_query_index
-
-
-    def merge_index(self, main_directory):
-        """
-        Uses the multiprocessing library to create a 
-        Manager object and multiple processes to make 
-        searching and creating the smaller index more 
-        efficient through parallelism. 
-        
+                # the records and the lexicon are both in sorted term order
+                for (term, codec, payload), (_, entry) in zip(read_records(os.path.join(segment_directory, FINAL_INDEX_FILE)),
+                                                              lexicon.items()):
+                    table_offset, df = entry[7], entry[2]
+                    data_offset = table_offset + (df + 1) * _POSITIONS_OFFSET.size
+                    length, = _POSITIONS_OFFSET.unpack_from(mapped_positions, table_offset + df * _POSITIONS_OFFSET.size)
+                    yield term, segment_number, codec, payload, mapped_positions[data_offset:data_offset + length]
+            finally:
+                mapped_positions.close()
+                lexicon.close()
+
+    @staticmethod
+    def _list_batches(batch_directory):
+        """
+        Returns the (batch number, path) of every
+        Output_Batch file inside batch_directory, in
+        the order they were written in.
+        """
+        return sorted(
+            (IndexMerge._batch_number(file), os.path.join(batch_directory, file))
+            for file in os.listdir(batch_directory)
+            if file.startswith("Output_Batch_") and file.endswith(".bin")
+        )
+
+    @staticmethod
+    def _first_record_docId(file_path):
+        """
+        Returns the first docId of the first record (the
+        first term) of a batch file, or None if the batch
+        is empty. This is not the lowest docId of the batch,
+        only one of its docIds, but since every batch holds
+        higher docIds than the one before it, these docIds
+        keep the order of the batches' docID ranges.
+        """
+        records = read_id_records(file_path)
+        try:
+            for _, codec, payload in records:
+                for docId, _ in codec.decode(payload):
+                    return docId
+            return None
+        finally:
+            records.close()
+
+    def _merge_batches(self, batch_directory, batch_files, docId_range=None):
+        terms = read_terms(os.path.join(batch_directory, TERMS_FILE))
+        batch_streams = [self._read_batch(file_path, number, terms) for number, file_path in batch_files]
+        positional = any(file.startswith("Output_Positions_") for file in os.listdir(batch_directory))
+        self._merge(batch_streams, positional, docId_range=docId_range)
+
+    def merge_index(self):
+        """
         Merges all of the postings of the same tokens
         located in the various partial indexes, while
-        sorting them based on the docID, in ascending order. 
-        """
+        sorting them based on the docID, in ascending order.
 
+        Writes the merged postings to Final_Index.bin and the
+        byte offset, length and document frequency of every
+        term to Lexicon.bin
+
+        The shards and segments of an older index inside
+        main_directory are removed, see remove_stale_indexes.
+        """
+        remove_stale_indexes(self.main_directory)
         # compile all of the output batch files
-        files = [
-            os.path.join(main_directory, file)
-            for file in os.listdir(main_directory)
-            if file.startswith("Output") and file.endswith(".txt")
-        ]
-
-        # set the numbers of processes to do
-        num_processes = 6 
-        chunk_size = len(files) // num_processes + (len(files) % num_processes > 0)
-        file_chunks = [files[i:i + chunk_size] for i in range(0, len(files), chunk_size)]
-
-        # establish pools that holds all of the processes that have their
-        # own output batch files to handle and create even smaller indexes 
-        with Pool(processes=num_processes) as pool:
-            results = pool.starmap(self._process_files, [(chunk, self.query_tokens) for chunk in file_chunks])
-
-        # merge results from all workers
-        for partial_index in results:
-            for token, postings in partial_index.items():
-                current_posting = self.query_index.get(token, [])
-                combined_posting = current_posting + postings
-                # updating the main small index
-                self.query_index[token] = list(sorted(combined_posting, key=lambda x: x[0]))
-
-        # ## testing purposes
-        # with open("smaller_index.txt", "w") as smaller_index:
-        #     smaller_index.flush()
-        #     smaller_index.write(f"Main tokens: {list(self.query_index.keys())}\n")
-        #     smaller_index.write(f"--------------------------------------------\n")
-        #     for token in self.query_index:
-        #         smaller_index.write(f"Current token - {token} - has the the following entries: \n")
-        #         smaller_index.write(f"\t postings: {self.query_index[token]}\n")
-        #         for posting in self.query_index[token]:
-        #             smaller_index.write(f"\t {posting}\n")
-        #         smaller_index.write(f"--------------------------------------------\n")
-
-    def get_query_index(self):
-        """
-        Returns the query index to be used 
-        outside of the function or class. 
-        """
-
-        return self.query_index
+        self._merge_batches(self.main_directory, self._list_batches(self.main_directory))
+
+    def merge_shard(self, batch_directory, first_docId, last_docId):
+        """
+        Merges the postings of the docIds first_docId to
+        last_docId of the batches inside batch_directory
+        into an index of its own inside main_directory,
+        only reading the batches that can hold those docIds.
+
+        The docstore and the document lengths of the shard
+        have to be written to main_directory first.
+        """
+        batch_files = [(number, file_path, self._first_record_docId(file_path))
+                       for number, file_path in self._list_batches(batch_directory)]
+        batch_files = [batch_file for batch_file in batch_files if batch_file[2] is not None]
+        # every batch covers a higher docID range than the one before it, and the sampled docId of a batch lies
+        # inside its range: the batches before the last one sampled at or below first_docId only hold lower
+        # docIds, and the ones after the first one sampled above last_docId only hold higher docIds, so both
+        # are skipped (the batches at the edges may still be read for nothing, never left out)
+        start = max((i for i, (_, _, docId) in enumerate(batch_files) if docId <= first_docId), default=0)
+        end = next((i for i, (_, _, docId) in enumerate(batch_files) if docId > last_docId), len(batch_files) - 1)
+        self._merge_batches(batch_directory, [(number, file_path) for number, file_path, _ in batch_files[start:end + 1]],
+                            (first_docId, last_docId))
+
+    def merge_segments(self, segment_directories, deleted=frozenset()):
+        """
+        Merges the indexes of the given segments, in
+        ascending docID order, into one index inside
+        main_directory, dropping the postings (and
+        positions) of the deleted docIds.
+
+        The docstore and the document lengths of the merged
+        segment have to be written to main_directory first.
+        """
+        segment_streams = [self._read_segment(directory, number) for number, directory in enumerate(segment_directories)]
+        positional = all(self._read_stats(directory).get("positional") for directory in segment_directories)
+        self._merge(segment_streams, positional, deleted)
+
+    @staticmethod
+    def _read_stats(main_directory):
+        with open(os.path.join(main_directory, STATS_FILE), "r", encoding="utf-8") as stats_file:
+            return json.load(stats_file)
+
+    @staticmethod
+    def _drop_deleted(postings, positions, deleted):
+        """
+        Removes the postings of the deleted docIds, and
+        their positions if there are any (one varbyte
+        position gap per occurrence of the word).
+        """
+        if positions is None:
+            return [posting for posting in postings if posting[0] not in deleted], None
+        kept_postings = []
+        kept_positions = bytearray()
+        end = 0
+        for docId, freq in postings:
+            start = end
+            for _ in range(freq):
+                _, end = decode_varbyte(positions, end)
+            if docId not in deleted:
+                kept_postings.append((docId, freq))
+                kept_positions += positions[start:end]
+        return kept_postings, kept_positions
+
+    @staticmethod
+    def _slice_postings(postings, positions, first_docId, last_docId):
+        """
+        Keeps the postings of the docIds first_docId to
+        last_docId, and their positions if there are any.
+        """
+        postings = list(postings)
+        start = bisect_left(postings, (first_docId,))
+        end = bisect_left(postings, (last_docId + 1,))
+        if positions is None or (start == 0 and end == len(postings)):
+            return postings[start:end], positions
+        position = 0
+        for i, (_, freq) in enumerate(postings[:end]):
+            if i == start:
+                start_position = position
+            for _ in range(freq):
+                _, position = decode_varbyte(positions, position)
+        if start == end:
+            start_position = position
+        return postings[start:end], positions[start_position:position]
+
+    def _merge(self, streams, positional, deleted=frozenset(), docId_range=None):
+        doc_store = DocStore(os.path.join(self.main_directory, DOCSTORE_FILE))
+        if self.num_docs is None:
+            self.num_docs = len(doc_store)
+        first_docId = doc_store.first_docId
+        doc_store.close()
+        self.doc_lengths = read_doc_lengths(os.path.join(self.main_directory, DOC_LENGTHS_FILE), first_docId)
+        self.avg_doc_length = sum(self.doc_lengths) / self.num_docs if self.num_docs else 0
+
+        metrics = self.metrics
+        self.lexicon = dict()
+        current_term = None
+        current_postings = []
+        current_positions = bytearray()
+        total_postings = 0
+        positions_file = open(os.path.join(self.main_directory, POSITIONS_FILE), "wb") if positional else None
+        with open(os.path.join(self.main_directory, FINAL_INDEX_FILE), "wb") as index_file:
+            offset = write_header(index_file, self.codec)
+            # batches are ordered by term first and batch number second,
+            # so the postings of each term arrive together
+            for term, _, codec, payload, positions in metrics.timed_iter("read_batches", heapq.merge(*streams)):
+                if term != current_term:
+                    if current_postings: # every posting of a term can have been deleted
+                        with metrics.timer("write_postings"):
+                            offset += self._write_postings(index_file, current_term, current_postings, offset)
+                            self._write_positions(positions_file, current_term, current_postings, current_positions)
+                        total_postings += len(current_postings)
+                    current_term = term
+                    current_postings = []
+                    current_positions = bytearray()
+                with metrics.timer("decode"):
+                    postings = codec.decode(payload)
+                    if deleted:
+                        postings, positions = self._drop_deleted(postings, positions, deleted)
+                    if docId_range is not None:
+                        postings, positions = self._slice_postings(postings, positions, *docId_range)
+                current_postings.extend(postings)
+                if positions is not None:
+                    current_positions += positions
+
+            if current_postings: # catches the last term
+                offset += self._write_postings(index_file, current_term, current_postings, offset)
+                self._write_positions(positions_file, current_term, current_postings, current_positions)
+                total_postings += len(current_postings)
+        if positions_file is not None:
+            positions_file.close()
+
+        if self.impact_bits or self.champions:
+            with metrics.timer("write_impacts_and_champions"):
+                self._write_impacts_and_champions()
+
+        with metrics.timer("write_lexicon"):
+            Lexicon.write(os.path.join(self.main_directory, LEXICON_FILE), self.lexicon)
+
+        stats = {
+            "num_docs": self.num_docs,
+            "num_terms": len(self.lexicon),
+            "total_postings": total_postings,
+            "avg_doc_length": self.avg_doc_length,
+            "index_size_bytes": offset,
+            "first_docId": first_docId,
+            "doc_lengths_file": DOC_LENGTHS_FILE,
+            "impact_bits": self.impact_bits,
+            "impact_scale": self.impact_scale,
+            "champions": self.champions or None,
+            "positional": positional,
+            "generation": time.time_ns(), # changes on every merge, used to invalidate query caches
+        }
+        with open(os.path.join(self.main_directory, STATS_FILE), "w", encoding="utf-8") as stats_file:
+            json.dump(stats, stats_file, indent=2)
+        if metrics.enabled:
+            metrics.count("terms", len(self.lexicon))
+            metrics.count("postings", total_postings)
+            if metrics.profile_stages:
+                metrics.load_profiles(self.main_directory)
+            with open(os.path.join(self.main_directory, MERGE_METRICS_FILE), "w", encoding="utf-8") as metrics_file:
+                json.dump(metrics.summary(), metrics_file, indent=2)
+            print("\n".join(metrics.format_summary()))
+
+    def _write_postings(self, index_file, term, postings, offset):
+        """
+        Writes the postings of one term sorted by docID
+        and records where its encoded postings are in
+        the lexicon.
+
+        Returns the number of bytes that were written.
+        """
+        # every batch covers a higher docID range than the one before it,
+        # so postings concatenated in batch order are already sorted
+        payload = self.codec.encode(postings)
+        record_length, payload_offset = write_record(index_file, term, payload)
+        df = len(postings)
+        # tf-idf grows with the frequency, so the highest frequency gives its
+        # highest score, bm25 also depends on the length of each document
+        max_freq = max(freq for _, freq in postings)
+        max_tfidf = self.scores.tf_idf(max_freq, self.num_docs, df)
+        max_bm25 = max(self.scores.bm25(freq, self.num_docs, df, self.doc_lengths[docId], self.avg_doc_length)
+                       for docId, freq in postings)
+        self.lexicon[term] = [offset + payload_offset, len(payload), df, max_tfidf, max_bm25, None, None, None, max_freq]
+        return record_length
+
+    def _write_positions(self, positions_file, term, postings, encoded_positions):
+        """
+        Writes the positions of one term behind a table of
+        per-posting offsets, walking the varbyte gaps of
+        the batches with the frequency of every posting
+        (a word has one position per occurrence).
+        """
+        if positions_file is None:
+            return
+        offsets = bytearray()
+        position = 0
+        for _, freq in postings:
+            offsets += _POSITIONS_OFFSET.pack(position)
+            for _ in range(freq):
+                _, position = decode_varbyte(encoded_positions, position)
+        offsets += _POSITIONS_OFFSET.pack(position)
+
+        self.lexicon[term][7] = positions_file.tell()
+        positions_file.write(offsets)
+        positions_file.write(encoded_positions)
+
+    def _write_impacts_and_champions(self):
+        """
+        Second pass over the final index that scores every
+        posting with bm25. With impact_bits set, the scores
+        are quantized to 0 .. 2 ** impact_bits - 1, relative
+        to the highest bm25 score of the whole index, and
+        written to Impacts.bin. With champions set, the best
+        scored postings of every long postings list are
+        written to Champions.bin.
+        """
+        max_score = max((entry[4] for entry in self.lexicon.values()), default=0)
+        if self.impact_bits:
+            self.impact_scale = (max_score / (2 ** self.impact_bits - 1)) or 1
+        champions_codec = get_codec(DEFAULT_CODEC)
+        champion_ordinals = array("I")
+        champion_offsets = array("Q", [0])
+        champion_lists = bytearray()
+
+        impacts_file = open(os.path.join(self.main_directory, IMPACTS_FILE), "wb") if self.impact_bits else None
+        try:
+            records = read_records(os.path.join(self.main_directory, FINAL_INDEX_FILE))
+            for ordinal, (term, codec, payload) in enumerate(records): # in sorted term order, like the lexicon
+                entry = self.lexicon[term]
+                df = entry[2]
+                has_champions = self.champions and df > self.champions
+                if impacts_file is None and not has_champions:
+                    continue
+                postings = list(codec.decode(payload))
+                scores = [self.scores.bm25(freq, self.num_docs, df, self.doc_lengths[docId], self.avg_doc_length)
+                          for docId, freq in postings]
+                if impacts_file is not None:
+                    impacts = [round(score / self.impact_scale) for score in scores]
+                    encoded_impacts = bytearray()
+                    for impact in impacts:
+                        encode_varbyte(impact, encoded_impacts)
+                    entry[5], entry[6] = impacts_file.tell(), max(impacts)
+                    impacts_file.write(encoded_impacts)
+                if has_champions:
+                    best = sorted(heapq.nlargest(self.champions, range(df), key=scores.__getitem__)) # back in docID order
+                    encoded_postings = champions_codec.encode([postings[i] for i in best])
+                    encode_varbyte(len(encoded_postings), champion_lists)
+                    champion_lists += encoded_postings
+                    if impacts_file is not None:
+                        for i in best:
+                            encode_varbyte(impacts[i], champion_lists)
+                    champion_ordinals.append(ordinal)
+                    champion_offsets.append(len(champion_lists))
+        finally:
+            if impacts_file is not None:
+                impacts_file.close()
+
+        if self.champions:
+            with open(os.path.join(self.main_directory, CHAMPIONS_FILE), "wb") as champions_file:
+                champions_file.write(_CHAMPIONS_HEADER.pack(_CHAMPIONS_MAGIC, self.champions, len(champion_ordinals)))
+                champions_file.write(champion_ordinals.tobytes())
+                champions_file.write(champion_offsets.tobytes())
+                champions_file.write(champion_lists)
+
+    def get_lexicon(self):
+        """
+        Returns the lexicon to be used
+        outside of the function or class.
+        """
+
+        return self.lexicon
 
 if __name__ == "__main__":
-    query_tokens = ["crista lopes"]
-    small_index = IndexMerge(query_tokens)
-    time_start= time.time() # start the timer for creating report
-    small_index.merge_index(".")
-    time_end= time.time() # end the timer for creating report
+    index_merge = IndexMerge(".")
+    time_start= time.time() # start the timer for merging the index
+    index_merge.merge_index()
+    time_end= time.time() # end the timer for merging the index
 
-    print(f"Finished smaller index creation process in: {time_end - time_start} seconds...")
\ No newline at end of file
+    print(f"Finished index merging process in: {time_end - time_start} seconds...")
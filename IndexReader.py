@@ -0,0 +1,248 @@
+import os, json
+import heapq
+import mmap
+from array import array
+from bisect import bisect_left
+from IndexMerge import (FINAL_INDEX_FILE, LEXICON_FILE, STATS_FILE, IMPACTS_FILE, POSITIONS_FILE, CHAMPIONS_FILE,
+                        _POSITIONS_OFFSET, _CHAMPIONS_HEADER, _CHAMPIONS_MAGIC)
+from DocStore import read_doc_lengths
+from Lexicon import Lexicon
+from PostingsCodec import DEFAULT_CODEC, decode_positions, decode_varbyte, get_codec, read_header
+
+
+"""
+This class gives the search side access to the final
+index created by IndexMerge. The lexicon and the
+postings stay on disk (memory-mapped), a term is
+looked up with a binary search over the front-coded
+lexicon (see Lexicon.py) and only the slice of postings
+belonging to a query term is decoded, so the I/O of a
+query only depends on the postings it actually touches.
+
+The collection statistics (Index_Stats.txt) and the
+document lengths are loaded alongside the lexicon, and
+the quantized impacts, positions and champion lists are
+mapped too if the index has them.
+"""
+
+class IndexReader:
+    def __init__(self, main_directory):
+        self.main_directory = main_directory
+        self.lexicon = Lexicon(os.path.join(main_directory, LEXICON_FILE))
+        self.index_file = open(os.path.join(main_directory, FINAL_INDEX_FILE), "rb")
+        self.mapped_index = mmap.mmap(self.index_file.fileno(), 0, access=mmap.ACCESS_READ)
+        self.codec, _ = read_header(self.mapped_index)
+        self.hot_payloads = dict() # postings of the terms kept in memory by warm()
+
+        self.stats = self.read_stats(main_directory)
+        self.doc_lengths = read_doc_lengths(os.path.join(main_directory, self.stats["doc_lengths_file"]),
+                                            self.stats.get("first_docId", 1))
+        self.deleted = frozenset() # docIds to leave out of the results, only segments have deletions (see SegmentReader)
+        self.impacts_file = None
+        self.mapped_impacts = None
+        if self.stats["impact_bits"] and self.stats["total_postings"]:
+            self.impacts_file = open(os.path.join(main_directory, IMPACTS_FILE), "rb")
+            self.mapped_impacts = mmap.mmap(self.impacts_file.fileno(), 0, access=mmap.ACCESS_READ)
+        self.positions_file = None
+        self.mapped_positions = None
+        if self.stats.get("positional") and self.stats["total_postings"]:
+            self.positions_file = open(os.path.join(main_directory, POSITIONS_FILE), "rb")
+            self.mapped_positions = mmap.mmap(self.positions_file.fileno(), 0, access=mmap.ACCESS_READ)
+        self.champions_file = None
+        self.mapped_champions = None
+        if self.stats.get("champions") and self.stats["total_postings"]:
+            self._open_champions()
+
+    def _open_champions(self):
+        self.champions_file = open(os.path.join(self.main_directory, CHAMPIONS_FILE), "rb")
+        self.mapped_champions = mmap.mmap(self.champions_file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, _, num_lists = _CHAMPIONS_HEADER.unpack_from(self.mapped_champions, 0)
+        if magic != _CHAMPIONS_MAGIC:
+            raise ValueError(f"{CHAMPIONS_FILE} is not a champion lists file")
+        offsets_start = _CHAMPIONS_HEADER.size + 4 * num_lists
+        self.champions_start = offsets_start + 8 * (num_lists + 1)
+        self.champion_ordinals = array("I") # lexicon ordinal of the term of every champion list, ascending
+        self.champion_ordinals.frombytes(self.mapped_champions[_CHAMPIONS_HEADER.size:offsets_start])
+        self.champion_offsets = array("Q")
+        self.champion_offsets.frombytes(self.mapped_champions[offsets_start:self.champions_start])
+        self.champions_codec = get_codec(DEFAULT_CODEC)
+
+    @staticmethod
+    def read_stats(main_directory):
+        """
+        Reads the collection statistics of an index
+        without opening the rest of it.
+        """
+        with open(os.path.join(main_directory, STATS_FILE), "r", encoding="utf-8") as stats_file:
+            return json.load(stats_file)
+
+    def get_generation(self):
+        return self.stats["generation"]
+
+    def get_num_docs(self):
+        return self.stats["num_docs"]
+
+    def get_avg_doc_length(self):
+        return self.stats["avg_doc_length"]
+
+    def has_impacts(self):
+        return self.mapped_impacts is not None
+
+    def has_positions(self):
+        return self.mapped_positions is not None
+
+    def has_champions(self):
+        return self.mapped_champions is not None
+
+    def _champion_list(self, term):
+        """
+        Returns where the postings and the impacts of the
+        champion list of the term are inside Champions.bin,
+        or None if the term has none (it is not in the index,
+        or short enough to be its own champion list).
+        """
+        ordinal = self.lexicon.find(term)
+        i = bisect_left(self.champion_ordinals, ordinal)
+        if ordinal < 0 or i == len(self.champion_ordinals) or self.champion_ordinals[i] != ordinal:
+            return None
+        length, start = decode_varbyte(self.mapped_champions, self.champions_start + self.champion_offsets[i])
+        return start, start + length
+
+    def iter_champions(self, term):
+        """
+        An iterator over the champion list of the term as
+        (docId, freq) sorted by docID: the postings with the
+        highest bm25 scores, or all of them for the terms
+        that have no more postings than a champion list.
+        """
+        champion_list = self._champion_list(term)
+        if champion_list is None:
+            return self.iter_postings(term)
+        start, end = champion_list
+        return self.champions_codec.decode(self.mapped_champions[start:end])
+
+    def iter_champion_impacts(self, term):
+        """
+        A generator that decodes the quantized impacts of
+        the champion list of the term, in the order of
+        iter_champions.
+        """
+        champion_list = self._champion_list(term)
+        if champion_list is None:
+            yield from self.iter_impacts(term)
+            return
+        position = champion_list[1]
+        for _ in range(min(self.get_df(term), self.stats["champions"])):
+            impact, position = decode_varbyte(self.mapped_champions, position)
+            yield impact
+
+    def get_positions(self, term, ordinal):
+        """
+        Returns the positions of the term inside the
+        document of its ordinal-th posting (0 based),
+        reading only that posting's positions.
+        """
+        table_offset = self.lexicon[term][7]
+        start, = _POSITIONS_OFFSET.unpack_from(self.mapped_positions, table_offset + ordinal * _POSITIONS_OFFSET.size)
+        end, = _POSITIONS_OFFSET.unpack_from(self.mapped_positions, table_offset + (ordinal + 1) * _POSITIONS_OFFSET.size)
+        data_offset = table_offset + (self.lexicon[term][2] + 1) * _POSITIONS_OFFSET.size
+        return decode_positions(self.mapped_positions, data_offset + start, data_offset + end)
+
+    def __contains__(self, term):
+        return term in self.lexicon
+
+    def hot_terms(self, num_terms):
+        """
+        Returns the num_terms terms with the highest
+        document frequency, the most frequent first.
+        """
+        return [term for term, _ in heapq.nlargest(num_terms, self.lexicon.items(), key=lambda item: item[1][2])]
+
+    def warm(self, num_terms):
+        """
+        Copies the encoded postings of the num_terms terms
+        with the highest document frequency into memory,
+        so the hottest postings never wait on the disk.
+        """
+        for term in self.hot_terms(num_terms):
+            offset, length = self.lexicon[term][0], self.lexicon[term][1]
+            self.hot_payloads[term] = self.mapped_index[offset:offset + length]
+
+    def get_payload(self, term):
+        """
+        Returns the encoded postings of the given term,
+        or None if the term is not inside the index.
+        """
+        hot_payload = self.hot_payloads.get(term)
+        if hot_payload is not None:
+            return hot_payload
+        entry = self.lexicon.get(term)
+        if entry is None:
+            return None
+        offset, length = entry[0], entry[1]
+        return self.mapped_index[offset:offset + length]
+
+    def get_df(self, term):
+        """
+        Returns the document frequency of the given
+        term, 0 if the term is not inside the index.
+        """
+        entry = self.lexicon.get(term)
+        return entry[2] if entry is not None else 0
+
+    def get_max_score(self, term, scoring_method="tf-idf"):
+        """
+        Returns the highest score a single posting of the
+        term contributes under the given scoring method.
+        """
+        entry = self.lexicon.get(term)
+        if entry is None:
+            return 0
+        if scoring_method == "impact":
+            return entry[6]
+        return entry[4] if scoring_method == "bm25" else entry[3]
+
+    def iter_impacts(self, term):
+        """
+        A generator that decodes the quantized impacts
+        of the given term, in the order of its postings.
+        """
+        entry = self.lexicon.get(term)
+        if entry is None:
+            return
+        position = entry[5]
+        for _ in range(entry[2]):
+            impact, position = decode_varbyte(self.mapped_impacts, position)
+            yield impact
+
+    def iter_postings(self, term):
+        """
+        A generator that decodes the postings of the
+        given term as (docId, freq), sorted by docID.
+        """
+        payload = self.get_payload(term)
+        if payload is None:
+            return iter(())
+        return self.codec.decode(payload)
+
+    def get_postings(self, term):
+        """
+        Returns the postings of the given term as a
+        list of (docId, freq) sorted by docID, or an
+        empty list if the term is not inside the index.
+        """
+        return list(self.iter_postings(term))
+
+    def close(self):
+        self.lexicon.close()
+        self.mapped_index.close()
+        self.index_file.close()
+        if self.mapped_impacts is not None:
+            self.mapped_impacts.close()
+            self.impacts_file.close()
+        if self.mapped_positions is not None:
+            self.mapped_positions.close()
+            self.positions_file.close()
+        if self.mapped_champions is not None:
+            self.mapped_champions.close()
+            self.champions_file.close()
@@ -0,0 +1,345 @@
+import os, json
+import shutil
+import sys
+import threading
+import time
+from array import array
+from pathlib import Path
+from IndexBuilder import IndexBuilder
+from IndexMerge import IndexMerge, SEGMENTS_FILE
+from Lexicon import TERMS_FILE
+from DocStore import DocStore, DOCSTORE_FILE, DOC_LENGTHS_FILE, read_doc_lengths, write_doc_lengths
+
+
+"""
+Incremental indexing, so that adding (or re-crawling) a
+handful of JSON files does not mean building the whole
+index again.
+
+Every append indexes only the files that are new or changed
+since the last one into a new immutable segment: a
+Segment_N directory holding a complete merged index
+(Final_Index.bin, Lexicon.bin, DocStore.bin, ...) whose
+docIds continue after the ones of the segment before it.
+Segments are never changed once written, they are only
+replaced as a whole by merging them.
+
+The content hash and SimHash fingerprint of every live
+document are kept in the manifest and handed to the builder
+of every new segment, so a page that is a copy or a near-
+duplicate of a page inside an earlier segment is dropped
+like it would be by a full build (see IndexBuilder.build_index).
+
+Changed, removed and re-crawled (same URL) documents are
+not rewritten, their old docIds are recorded as tombstones
+in the manifest instead, and SegmentReader leaves them out
+of the results until a merge drops their postings.
+
+Tiered merging: every segment is in a tier by its number of
+live documents (tier t holds segments of fewer than
+min_segment_docs * merge_factor ** (t + 1) documents), and as soon as merge_factor
+neighbouring segments are in the same tier they are merged into
+one segment of the next tier. Segments with mostly tombstones
+are merged on their own to reclaim the space. This keeps the
+number of segments logarithmic in the number of documents, while
+every document is only merged again once per tier.
+
+Segments.txt = {
+    "segments": [{"name": "Segment_1", "first_docId": 1, "last_docId": 500, "num_docs": 500}, ...],
+    "next_docId": 501, "next_segment": 2,
+    "files": {json file path: [mtime_ns, size, docId, url]},
+    "urls": {url: docId of its live document},
+    "deleted": [docIds of the tombstoned documents],
+    "fingerprints": {docId: [content hash, SimHash] of its live document},
+    "generation": changes on every update, used to invalidate query caches
+}
+"""
+
+
+def read_manifest(main_directory):
+    """
+    Reads the segments manifest of main_directory,
+    or returns an empty one if there is none yet.
+    """
+    manifest_path = os.path.join(main_directory, SEGMENTS_FILE)
+    if not os.path.exists(manifest_path):
+        return {"segments": [], "next_docId": 1, "next_segment": 1, "files": {}, "urls": {}, "deleted": [], "fingerprints": {},
+                "generation": 0}
+    with open(manifest_path, "r", encoding="utf-8") as manifest_file:
+        return json.load(manifest_file)
+
+
+class SegmentManager:
+    def __init__(self, main_directory=".", merge_factor=10, min_segment_docs=1000, positional=False, memoryBudgetMB=512):
+        self.main_directory = main_directory
+        self.merge_factor = merge_factor # neighbouring segments of the same tier that get merged together
+        self.min_segment_docs = min_segment_docs # every segment below this size is in the lowest tier
+        self.positional = positional # every segment has to be built the same way for phrase queries
+        self.memoryBudgetMB = memoryBudgetMB
+        self.manifest_lock = threading.Lock() # held while the manifest is read, changed and written back
+        self.merge_lock = threading.Lock() # only one merge at a time
+        self.append_lock = threading.Lock() # only one append at a time, each one takes the next docIds
+
+    def _write_manifest(self, manifest):
+        """
+        Writes the manifest under a new generation, through
+        a temporary file so readers never see half of it.
+        """
+        manifest["generation"] = time.time_ns()
+        manifest_path = os.path.join(self.main_directory, SEGMENTS_FILE)
+        with open(manifest_path + ".tmp", "w", encoding="utf-8") as manifest_file:
+            json.dump(manifest, manifest_file)
+        os.replace(manifest_path + ".tmp", manifest_path)
+
+    @staticmethod
+    def _delete_document(manifest, deleted, url, docId):
+        """
+        Tombstones the document if it is still the live
+        document of its URL (live documents are exactly
+        the ones inside manifest["urls"]).
+        """
+        if url is not None and docId is not None and manifest["urls"].get(url) == docId:
+            del manifest["urls"][url]
+            deleted.add(docId)
+
+    def append(self, json_directory, merge=True):
+        """
+        Indexes the JSON files under json_directory that are
+        new or changed since the last append into a new
+        segment, and tombstones the documents of the changed
+        and removed files. Returns the name of the new segment,
+        or None if there was nothing new to index.
+
+        Tiered merges run afterwards when merge is set.
+        """
+        with self.append_lock:
+            segment_name = self._append(json_directory)
+        if merge:
+            self.merge()
+        return segment_name
+
+    def _append(self, json_directory):
+        with self.manifest_lock:
+            manifest = read_manifest(self.main_directory)
+            segment_name = f"Segment_{manifest['next_segment']}"
+            first_docId = manifest["next_docId"]
+            manifest["next_segment"] += 1
+            os.makedirs(os.path.join(self.main_directory, segment_name))
+            self._write_manifest(manifest)
+
+        # only the files whose modification time or size changed are indexed again
+        file_stats = dict()
+        changed_files = []
+        for json_file in sorted(Path(json_directory).rglob('*.json')):
+            stat = json_file.stat()
+            file_stats[str(json_file)] = [stat.st_mtime_ns, stat.st_size]
+            entry = manifest["files"].get(str(json_file))
+            if entry is None or entry[:2] != file_stats[str(json_file)]:
+                changed_files.append(json_file)
+        removed_files = [file for file in manifest["files"]
+                         if file not in file_stats and Path(file).is_relative_to(json_directory)]
+
+        # the live pages of the other segments count for the duplicates, except the ones about to be replaced
+        replaced = {manifest["files"][file][2] for file in removed_files}
+        replaced.update(manifest["files"][str(json_file)][2] for json_file in changed_files if str(json_file) in manifest["files"])
+        live = set(manifest["urls"].values()) - replaced
+        known_documents = {int(docId): entry for docId, entry in manifest.get("fingerprints", {}).items() if int(docId) in live}
+
+        segment_directory = os.path.join(self.main_directory, segment_name)
+        index_builder = IndexBuilder(json_directory, memoryBudgetMB=self.memoryBudgetMB, positional=self.positional,
+                                     outputDirectory=segment_directory, firstDocId=first_docId, knownDocuments=known_documents)
+        if changed_files:
+            index_builder.build_index(changed_files)
+        docId_to_url = index_builder.get_docId_to_url()
+        if docId_to_url:
+            IndexMerge(segment_directory).merge_index()
+            # the batches are only needed for the merge, the segment is immutable from now on
+            for file in os.listdir(segment_directory):
+                if file.startswith(("Output_Batch_", "Output_Positions_")) or file == TERMS_FILE:
+                    os.remove(os.path.join(segment_directory, file))
+        else:
+            shutil.rmtree(segment_directory)
+
+        with self.manifest_lock:
+            manifest = read_manifest(self.main_directory) # a merge may have run in the meantime
+            deleted = set(manifest["deleted"])
+            for file in removed_files:
+                _, _, docId, url = manifest["files"].pop(file)
+                self._delete_document(manifest, deleted, url, docId)
+            for json_file in changed_files:
+                entry = manifest["files"].get(str(json_file))
+                if entry is not None:
+                    self._delete_document(manifest, deleted, entry[3], entry[2])
+                docId = index_builder.file_to_docId.get(str(json_file))
+                url = docId_to_url.get(docId)
+                if url is not None:
+                    # the document of a re-crawled URL replaces the one indexed before
+                    self._delete_document(manifest, deleted, url, manifest["urls"].get(url))
+                    manifest["urls"][url] = docId
+                manifest["files"][str(json_file)] = file_stats[str(json_file)] + [docId, url]
+            if docId_to_url:
+                last_docId = max(docId_to_url)
+                manifest["segments"].append({"name": segment_name, "first_docId": first_docId,
+                                             "last_docId": last_docId, "num_docs": len(docId_to_url)})
+                manifest["next_docId"] = last_docId + 1
+            manifest["deleted"] = sorted(deleted)
+            fingerprints = manifest.get("fingerprints", {})
+            fingerprints.update((str(docId), entry) for docId, entry in index_builder.doc_fingerprints.items())
+            live = set(manifest["urls"].values())
+            manifest["fingerprints"] = {docId: entry for docId, entry in fingerprints.items() if int(docId) in live}
+            self._write_manifest(manifest)
+
+        print(f"Indexed {len(changed_files)} new or changed files, {len(removed_files)} removed...")
+        return segment_name if docId_to_url else None
+
+    def delete_urls(self, urls):
+        """
+        Tombstones the live documents of the given URLs.
+        """
+        with self.manifest_lock:
+            manifest = read_manifest(self.main_directory)
+            deleted = set(manifest["deleted"])
+            for url in map(IndexBuilder.canonicalize_url, urls): # the manifest holds canonical urls
+                self._delete_document(manifest, deleted, url, manifest["urls"].get(url))
+            manifest["deleted"] = sorted(deleted)
+            self._write_manifest(manifest)
+
+    def _tier(self, live_docs):
+        """
+        Returns the tier of a segment with live_docs live
+        documents: tier t holds the segments of fewer than
+        min_segment_docs * merge_factor ** (t + 1) documents.
+        Counted with integers, a float log truncates exact
+        powers into the tier below them.
+        """
+        tier = 0
+        bound = self.min_segment_docs * self.merge_factor
+        while live_docs >= bound:
+            bound *= self.merge_factor
+            tier += 1
+        return tier
+
+    def find_merge(self, manifest):
+        """
+        Returns the names of the next segments to merge
+        (neighbours, so the merged docId range stays
+        contiguous), or None if no merge is needed.
+        """
+        deleted = manifest["deleted"]
+        run = []
+        run_tier = None
+        for segment in manifest["segments"]:
+            tombstones = sum(1 for docId in deleted if segment["first_docId"] <= docId <= segment["last_docId"])
+            if tombstones * 2 >= segment["num_docs"]:
+                return [segment["name"]] # mostly deleted, rewriting it on its own reclaims the space
+            tier = self._tier(segment["num_docs"] - tombstones)
+            if tier != run_tier:
+                run, run_tier = [], tier
+            run.append(segment["name"])
+            if len(run) == self.merge_factor:
+                return run
+        return None
+
+    def _merge_segments(self, segment_names, manifest):
+        """
+        Merges the given neighbouring segments into a new
+        segment without their tombstoned documents, and
+        swaps it in for them inside the manifest.
+        """
+        segments = [segment for segment in manifest["segments"] if segment["name"] in segment_names]
+        first_docId, last_docId = segments[0]["first_docId"], segments[-1]["last_docId"]
+        # tombstones added while merging stay in the manifest, the ones known now are dropped by the merge
+        purged = frozenset(docId for docId in manifest["deleted"] if first_docId <= docId <= last_docId)
+
+        with self.manifest_lock:
+            current = read_manifest(self.main_directory)
+            merged_name = f"Segment_{current['next_segment']}"
+            current["next_segment"] += 1
+            self._write_manifest(current)
+        merged_directory = os.path.join(self.main_directory, merged_name)
+        os.makedirs(merged_directory)
+
+        segment_directories = [os.path.join(self.main_directory, segment["name"]) for segment in segments]
+        docId_to_url = dict()
+        doc_lengths = array('I', [0])
+        for segment, directory in zip(segments, segment_directories):
+            doc_store = DocStore(os.path.join(directory, DOCSTORE_FILE))
+            lengths = read_doc_lengths(os.path.join(directory, DOC_LENGTHS_FILE), doc_store.first_docId)
+            for docId in range(segment["first_docId"], segment["last_docId"] + 1):
+                url = doc_store.get(docId)
+                if url is not None and docId not in purged:
+                    docId_to_url[docId] = url
+                    doc_lengths.append(lengths[docId])
+                else:
+                    doc_lengths.append(0)
+            doc_store.close()
+
+        if docId_to_url:
+            DocStore.write(os.path.join(merged_directory, DOCSTORE_FILE), docId_to_url)
+            # the docstore starts at the first live docId, the document lengths have to as well
+            first_live = min(docId_to_url)
+            write_doc_lengths(os.path.join(merged_directory, DOC_LENGTHS_FILE),
+                              array('I', [0]) + doc_lengths[first_live - first_docId + 1:])
+            IndexMerge(merged_directory).merge_segments(segment_directories, purged)
+        else:
+            shutil.rmtree(merged_directory)
+
+        with self.manifest_lock:
+            current = read_manifest(self.main_directory)
+            names = [segment["name"] for segment in current["segments"]]
+            start = names.index(segment_names[0])
+            merged = [{"name": merged_name, "first_docId": first_docId, "last_docId": last_docId,
+                       "num_docs": len(docId_to_url)}] if docId_to_url else []
+            current["segments"][start:start + len(segment_names)] = merged
+            current["deleted"] = [docId for docId in current["deleted"] if docId not in purged]
+            self._write_manifest(current)
+
+        # open readers keep their memory maps of the old files until they are closed
+        for directory in segment_directories:
+            shutil.rmtree(directory, ignore_errors=True)
+        print(f"Merged {', '.join(segment_names)} into {merged_name}...")
+
+    def merge(self):
+        """
+        Runs tiered merges until no tier has merge_factor
+        neighbouring segments left, returning how many
+        merges were done.
+        """
+        merges = 0
+        with self.merge_lock:
+            while True:
+                with self.manifest_lock:
+                    manifest = read_manifest(self.main_directory)
+                segment_names = self.find_merge(manifest)
+                if segment_names is None:
+                    return merges
+                self._merge_segments(segment_names, manifest)
+                merges += 1
+
+    def merge_in_background(self):
+        """
+        Starts merge() on a background thread, so appends
+        and searches carry on while the segments are merged.
+        """
+        merge_thread = threading.Thread(target=self.merge)
+        merge_thread.start()
+        return merge_thread
+
+
+if __name__ == "__main__":
+    # python IndexSegments.py append DEV | merge | delete url ...
+    command = sys.argv[1] if len(sys.argv) > 1 else "append"
+    segment_manager = SegmentManager(".")
+
+    time_start = time.time()
+    if command == "append":
+        segment_manager.append(sys.argv[2] if len(sys.argv) > 2 else "DEV")
+    elif command == "merge":
+        segment_manager.merge()
+    elif command == "delete":
+        segment_manager.delete_urls(sys.argv[2:])
+    time_end = time.time()
+
+    manifest = read_manifest(".")
+    print(f"{len(manifest['segments'])} segments, {len(manifest['urls'])} live documents, {len(manifest['deleted'])} tombstones")
+    print(f"Finished {command} in: {time_end - time_start} seconds...")
@@ -0,0 +1,331 @@
+import os, json
+import sys
+import heapq
+import shutil
+import time
+import multiprocessing
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+from IndexMerge import IndexMerge, DEFAULT_CHAMPIONS, LEXICON_FILE, SHARDS_FILE
+from IndexReader import IndexReader
+from DocStore import DocStore, DOCSTORE_FILE, DOC_LENGTHS_FILE, read_doc_lengths, write_doc_lengths
+from Lexicon import Lexicon
+from PostingsCodec import DEFAULT_INDEX_CODEC
+from QueryCache import QueryCache
+from RankedRetrieval import RankedRetrieval
+from Scoring import Scoring
+from Metrics import NULL_METRICS
+
+
+"""
+Document-partitioned index shards, so one query is ranked
+by several processes at once instead of one process
+walking every posting of its terms.
+
+merge_shards splits the documents of a build into num_shards
+ranges of neighbouring docIds holding about the same number
+of tokens, and merges the postings of every range out of the
+Output_Batch files into a Shard_N directory holding a complete
+index of its own (Final_Index.bin, Lexicon.bin, DocStore.bin,
+...), one process per shard. A shard only reads the batches
+that can hold its docIds, since every batch covers a higher
+docId range than the one before it.
+
+Shards.txt = {
+    "shards": [{"name": "Shard_1", "first_docId": 1, "last_docId": 13502, "num_docs": 13502}, ...],
+    "num_docs": N, "total_length": number of tokens of all documents,
+    "avg_doc_length": total_length / N,
+    "generation": changes on every merge_shards, used to invalidate query caches
+}
+
+ShardedSearch starts one persistent worker process per shard
+which ranks every query against its shard only (scatter), and
+then merges the k best results of every shard into the k best
+overall (gather), so only k (docId, score) pairs per shard
+cross between the processes. The workers score with the
+collection statistics of all shards (N, df, average document
+length, see ShardReader), so the scores, and therefore the
+merged results, are the ones of a single merged index.
+
+The docIds stay the ones of the build, so the DocStore.bin of
+the main directory still maps them back to urls.
+"""
+
+DEFAULT_SHARDS = os.cpu_count() or 1
+
+
+def read_shards_manifest(main_directory):
+    """
+    Reads the shards manifest of main_directory.
+    """
+    with open(os.path.join(main_directory, SHARDS_FILE), "r", encoding="utf-8") as manifest_file:
+        return json.load(manifest_file)
+
+
+def has_shards(main_directory):
+    return os.path.exists(os.path.join(main_directory, SHARDS_FILE))
+
+
+def _merge_shard(main_directory, shard, codec, champions):
+    """
+    Runs inside a worker process, merging the postings
+    of one shard out of the batches of main_directory.
+    """
+    shard_directory = os.path.join(main_directory, shard["name"])
+    IndexMerge(shard_directory, codec=codec, champions=champions).merge_shard(main_directory, shard["first_docId"],
+                                                                             shard["last_docId"])
+
+
+def merge_shards(main_directory=".", num_shards=DEFAULT_SHARDS, codec=DEFAULT_INDEX_CODEC, champions=DEFAULT_CHAMPIONS):
+    """
+    Merges the batches of the build inside main_directory
+    into num_shards shards (fewer if there are fewer
+    documents), replacing the shards of an earlier merge.
+    Returns the manifest.
+
+    Impact scores are not written, every shard would
+    quantize against its own highest score.
+    """
+    doc_store = DocStore(os.path.join(main_directory, DOCSTORE_FILE))
+    doc_lengths = read_doc_lengths(os.path.join(main_directory, DOC_LENGTHS_FILE), doc_store.first_docId)
+    docIds = [docId for docId in range(doc_store.first_docId, doc_store.first_docId + doc_store.num_slots)
+              if doc_store.get(docId) is not None]
+    total_length = sum(doc_lengths[docId] for docId in docIds)
+
+    # neighbouring docIds go to the same shard until it holds its share of the tokens
+    num_shards = max(1, min(num_shards, len(docIds)))
+    shard_docIds = [[] for _ in range(num_shards)]
+    length_before = 0
+    for i, docId in enumerate(docIds):
+        shard = (length_before * num_shards // total_length) if total_length else (i * num_shards // len(docIds))
+        shard_docIds[shard].append(docId)
+        length_before += doc_lengths[docId]
+
+    for file in os.listdir(main_directory):
+        if file.startswith("Shard_") and os.path.isdir(os.path.join(main_directory, file)):
+            shutil.rmtree(os.path.join(main_directory, file))
+    shards = []
+    for docIds_of_shard in shard_docIds:
+        if not docIds_of_shard:
+            continue
+        first_docId, last_docId = docIds_of_shard[0], docIds_of_shard[-1]
+        shard = {"name": f"Shard_{len(shards) + 1}", "first_docId": first_docId, "last_docId": last_docId,
+                 "num_docs": len(docIds_of_shard)}
+        shard_directory = os.path.join(main_directory, shard["name"])
+        os.makedirs(shard_directory)
+        DocStore.write(os.path.join(shard_directory, DOCSTORE_FILE),
+                       {docId: doc_store.get(docId) for docId in docIds_of_shard})
+        # the docstore of the shard starts at its first docId, the document lengths have to as well
+        write_doc_lengths(os.path.join(shard_directory, DOC_LENGTHS_FILE),
+                          array("I", [0]) + doc_lengths[first_docId:last_docId + 1])
+        shards.append(shard)
+    doc_store.close()
+
+    with multiprocessing.Pool(processes=max(1, min(len(shards), os.cpu_count() or 1))) as pool:
+        pool.starmap(_merge_shard, [(main_directory, shard, codec, champions) for shard in shards])
+
+    manifest = {
+        "shards": shards,
+        "num_docs": len(docIds),
+        "total_length": total_length,
+        "avg_doc_length": total_length / len(docIds) if docIds else 0,
+        "generation": time.time_ns(),
+    }
+    manifest_path = os.path.join(main_directory, SHARDS_FILE)
+    with open(manifest_path + ".tmp", "w", encoding="utf-8") as manifest_file:
+        json.dump(manifest, manifest_file, indent=2)
+    os.replace(manifest_path + ".tmp", manifest_path)
+    return manifest
+
+
+class ShardReader:
+    def __init__(self, main_directory, shard_name, manifest=None):
+        """
+        Opens one shard with the same methods as IndexReader,
+        except that the collection statistics (N, df, the
+        average document length) are the ones of all shards,
+        read from their lexicons and the manifest.
+        """
+        manifest = manifest if manifest is not None else read_shards_manifest(main_directory)
+        self.reader = IndexReader(os.path.join(main_directory, shard_name))
+        self.lexicons = [Lexicon(os.path.join(main_directory, shard["name"], LEXICON_FILE))
+                         for shard in manifest["shards"] if shard["name"] != shard_name]
+        self.doc_lengths = self.reader.doc_lengths
+        self.deleted = self.reader.deleted
+        self.scores = Scoring()
+        self.stats = {
+            **self.reader.stats,
+            "num_docs": manifest["num_docs"],
+            "avg_doc_length": manifest["avg_doc_length"],
+            "impact_bits": None,
+            "impact_scale": 0,
+            "generation": manifest["generation"],
+        }
+
+    def get_generation(self):
+        return self.stats["generation"]
+
+    def get_num_docs(self):
+        return self.stats["num_docs"]
+
+    def get_avg_doc_length(self):
+        return self.stats["avg_doc_length"]
+
+    def has_impacts(self):
+        return False # every shard quantizes against its own highest score, so impacts do not add up
+
+    def has_positions(self):
+        return self.reader.has_positions()
+
+    def has_champions(self):
+        return self.reader.has_champions()
+
+    def __contains__(self, term):
+        return term in self.reader
+
+    def warm(self, num_terms):
+        self.reader.warm(num_terms)
+
+    def hot_terms(self, num_terms):
+        return self.reader.hot_terms(num_terms)
+
+    def get_df(self, term):
+        """
+        Returns the document frequency of the term
+        over all shards.
+        """
+        df = self.reader.get_df(term)
+        for lexicon in self.lexicons:
+            entry = lexicon.get(term)
+            if entry is not None:
+                df += entry[2]
+        return df
+
+    def get_max_score(self, term, scoring_method="tf-idf"):
+        """
+        Returns an upper bound of the score a single posting
+        of the term adds inside this shard, from its highest
+        frequency in the shard and the statistics of all of
+        them. bm25 takes the shortest possible document, since
+        the bound of the shard used its own average length.
+        """
+        entry = self.reader.lexicon.get(term)
+        if entry is None:
+            return 0
+        df = self.get_df(term)
+        if scoring_method == "bm25":
+            return self.scores.bm25(entry[8], self.get_num_docs(), df, 0, self.get_avg_doc_length())
+        return self.scores.tf_idf(entry[8], self.get_num_docs(), df)
+
+    def get_positions(self, term, ordinal):
+        return self.reader.get_positions(term, ordinal)
+
+    def iter_postings(self, term):
+        return self.reader.iter_postings(term)
+
+    def get_postings(self, term):
+        return self.reader.get_postings(term)
+
+    def iter_champions(self, term):
+        return self.reader.iter_champions(term)
+
+    def close(self):
+        self.reader.close()
+        for lexicon in self.lexicons:
+            lexicon.close()
+
+
+# set inside every shard worker process by _init_shard_worker
+shard_ranked_retrieval = None
+
+
+def _init_shard_worker(main_directory, shard_name, scoring_method, hot_terms, cache):
+    """
+    Runs once inside the worker process of a shard,
+    opening the shard it ranks every query against.
+    """
+    global shard_ranked_retrieval
+    shard_reader = ShardReader(main_directory, shard_name)
+    shard_reader.warm(hot_terms)
+    shard_ranked_retrieval = RankedRetrieval(shard_reader, scoring_method=scoring_method,
+                                             cache=QueryCache() if cache else None)
+
+
+def _shard_search(query_tokens, k, conjunctive, phrases, champions):
+    """
+    Ranks one query against the shard of this worker,
+    only its k best (docId, score) go back.
+    """
+    if not shard_ranked_retrieval.index_reader.has_positions():
+        phrases = None # the words of the phrases are still required as plain tokens
+    return shard_ranked_retrieval.search(query_tokens, k, conjunctive, phrases=phrases, champions=champions)
+
+
+class ShardedSearch:
+    def __init__(self, main_directory=".", scoring_method="tf-idf", hot_terms=1000, cache=True):
+        """
+        Starts one worker process per shard of the index
+        inside main_directory, each opening its shard once
+        and keeping the postings of its hot_terms most common
+        terms in memory, and a QueryCache if cache is set.
+        """
+        self.manifest = read_shards_manifest(main_directory)
+        self.executors = [ProcessPoolExecutor(max_workers=1, initializer=_init_shard_worker,
+                                              initargs=(main_directory, shard["name"], scoring_method, hot_terms, cache))
+                          for shard in self.manifest["shards"]]
+        self.positional = all(IndexReader.read_stats(os.path.join(main_directory, shard["name"])).get("positional")
+                              for shard in self.manifest["shards"])
+
+    def get_generation(self):
+        return self.manifest["generation"]
+
+    def get_num_shards(self):
+        return len(self.executors)
+
+    def has_positions(self):
+        return self.positional
+
+    def submit(self, query_tokens, k=10, conjunctive=True, phrases=None, champions=False):
+        """
+        Sends the query to every shard, returning the
+        futures of their top k.
+        """
+        return [executor.submit(_shard_search, query_tokens, k, conjunctive, phrases, champions)
+                for executor in self.executors]
+
+    @staticmethod
+    def merge_results(shard_results, k):
+        """
+        Merges the top k lists of the shards, each sorted by
+        descending score, into the k best overall (ties go to
+        the lower docId, like inside RankedRetrieval).
+        """
+        return list(islice(heapq.merge(*shard_results, key=lambda result: (-result[1], result[0])), k))
+
+    def search(self, query_tokens, k=10, conjunctive=True, phrases=None, metrics=None, champions=False):
+        """
+        Returns the k best [(docId, score)] for the query
+        tokens over all shards, sorted by descending score,
+        with the same options as RankedRetrieval.search.
+        """
+        metrics = metrics if metrics is not None else NULL_METRICS
+        with metrics.timer("wait_for_shards"):
+            shard_results = [future.result() for future in self.submit(query_tokens, k, conjunctive, phrases, champions)]
+        with metrics.timer("merge_shard_results"):
+            return self.merge_results(shard_results, k)
+
+    def close(self):
+        for executor in self.executors:
+            executor.shutdown()
+
+
+if __name__ == "__main__":
+    # python IndexShards.py [num_shards] merges the batches in "." into shards
+    num_shards = int(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_SHARDS
+    time_start = time.time()
+    manifest = merge_shards(".", num_shards)
+    time_end = time.time()
+    for shard in manifest["shards"]:
+        print(f"{shard['name']}: docIds {shard['first_docId']} - {shard['last_docId']}, {shard['num_docs']} documents")
+    print(f"Finished merging {len(manifest['shards'])} shards in: {time_end - time_start} seconds...")
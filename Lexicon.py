@@ -0,0 +1,262 @@
+import mmap
+import struct
+import time
+from bisect import bisect_right
+from PostingsCodec import decode_varbyte, encode_varbyte
+
+
+"""
+The term dictionaries of the index.
+
+While the batches are built, IndexBuilder gives every
+stemmed term a compact integer term ID (in the order the
+terms are first seen), so the batches in memory, the
+Output_Batch files and the results sent back by the worker
+processes hold ints instead of repeating the term strings.
+The ID -> term list is written to Terms.txt (one term per
+line, line i being term ID i), which IndexMerge reads to
+turn the IDs back into terms while merging.
+
+The lexicon of a merged index is written to Lexicon.bin as
+a sorted, front-coded term list with fixed-width entries,
+which is searched in place instead of being loaded into a
+dictionary like the old Lexicon.txt.
+
+Lexicon.bin layout (little-endian):
+    header  = magic b"LEXI", number of terms : uint32,
+              terms per block : uint32, number of blocks : uint32
+    entries = one entry per term in sorted term order:
+              offset : uint64, length : uint32, df : uint32,
+              max_tfidf : float64, max_bm25 : float64,
+              impact_offset : uint64, max_impact : uint32,
+              positions_offset : uint64, max_freq : uint32
+              (all ones standing for None, see IndexMerge)
+    blocks  = number of blocks * uint64, where block i starts
+              inside terms
+    terms   = the sorted terms in blocks of BLOCK_TERMS, the first
+              term of a block stored whole as varbyte(length) + term,
+              every other one as varbyte(length of the prefix shared
+              with the term before) + varbyte(length of the rest) + rest
+
+Looking up a term is a binary search over the first terms
+of the blocks (kept in memory, one per BLOCK_TERMS terms),
+then a scan of at most BLOCK_TERMS terms of a single block.
+"""
+
+TERMS_FILE = "Terms.txt"
+BLOCK_TERMS = 16
+CACHE_SIZE = 65536 # entries of the most recently looked up terms kept decoded
+_MAGIC = b"LEXI"
+_HEADER = struct.Struct("<4sIII")
+_ENTRY = struct.Struct("<QIIddQIQI")
+_BLOCK_OFFSET = struct.Struct("<Q")
+_NONE_64 = 2 ** 64 - 1
+_NONE_32 = 2 ** 32 - 1
+_NONE_SLOTS = ((5, _NONE_64), (6, _NONE_32), (7, _NONE_64)) # entry slots that can be None
+
+
+def write_terms(file_path, terms):
+    """
+    Writes the ID -> term list of a build, one
+    term per line.
+    """
+    with open(file_path, "w", encoding="utf-8") as terms_file:
+        for term in terms:
+            terms_file.write(term)
+            terms_file.write("\n")
+
+
+def read_terms(file_path):
+    """
+    Reads the list written by write_terms back,
+    indexed by term ID.
+    """
+    with open(file_path, "r", encoding="utf-8") as terms_file:
+        return terms_file.read().split("\n")[:-1]
+
+
+class Lexicon:
+    def __init__(self, file_path):
+        self.file_path = file_path
+        self.lexicon_file = open(file_path, "rb")
+        self.mapped_lexicon = mmap.mmap(self.lexicon_file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.num_terms, self.block_terms, num_blocks = _HEADER.unpack_from(self.mapped_lexicon, 0)
+        if magic != _MAGIC:
+            raise ValueError(f"{file_path} is not a lexicon file")
+        self.entries_start = _HEADER.size
+        blocks_start = self.entries_start + self.num_terms * _ENTRY.size
+        self.terms_start = blocks_start + num_blocks * _BLOCK_OFFSET.size
+        self.block_offsets = [self.terms_start + offset
+                              for offset, in _BLOCK_OFFSET.iter_unpack(self.mapped_lexicon[blocks_start:self.terms_start])]
+        self.block_heads = [] # first term of every block, as UTF-8 bytes
+        for offset in self.block_offsets:
+            length, position = decode_varbyte(self.mapped_lexicon, offset)
+            self.block_heads.append(self.mapped_lexicon[position:position + length])
+        self.cache = dict() # term -> entry
+
+    @staticmethod
+    def write(file_path, lexicon):
+        """
+        Writes a {term : entry} dictionary (see IndexMerge)
+        into a lexicon file. Terms are sorted as str, which
+        is the same order as their UTF-8 bytes.
+        """
+        terms = sorted(lexicon)
+        entries = bytearray()
+        block_offsets = bytearray()
+        encoded_terms = bytearray()
+        previous = b""
+        for ordinal, term in enumerate(terms):
+            entry = list(lexicon[term])
+            for slot, none in _NONE_SLOTS:
+                if entry[slot] is None:
+                    entry[slot] = none
+            entries += _ENTRY.pack(*entry)
+
+            encoded = term.encode("utf-8")
+            if ordinal % BLOCK_TERMS == 0:
+                block_offsets += _BLOCK_OFFSET.pack(len(encoded_terms))
+                encode_varbyte(len(encoded), encoded_terms)
+                encoded_terms += encoded
+            else:
+                shared = 0
+                limit = min(len(previous), len(encoded))
+                while shared < limit and previous[shared] == encoded[shared]:
+                    shared += 1
+                encode_varbyte(shared, encoded_terms)
+                encode_varbyte(len(encoded) - shared, encoded_terms)
+                encoded_terms += encoded[shared:]
+            previous = encoded
+
+        with open(file_path, "wb") as lexicon_file:
+            lexicon_file.write(_HEADER.pack(_MAGIC, len(terms), BLOCK_TERMS, len(block_offsets) // _BLOCK_OFFSET.size))
+            lexicon_file.write(entries)
+            lexicon_file.write(block_offsets)
+            lexicon_file.write(encoded_terms)
+
+    def _entry(self, ordinal):
+        entry = list(_ENTRY.unpack_from(self.mapped_lexicon, self.entries_start + ordinal * _ENTRY.size))
+        for slot, none in _NONE_SLOTS:
+            if entry[slot] == none:
+                entry[slot] = None
+        return entry
+
+    def _iter_block(self, block):
+        """
+        A generator that decodes the terms of one
+        block as UTF-8 bytes, in sorted order.
+        """
+        mapped = self.mapped_lexicon
+        length, position = decode_varbyte(mapped, self.block_offsets[block])
+        term = mapped[position:position + length]
+        yield term
+        position += length
+        for _ in range(min(self.block_terms, self.num_terms - block * self.block_terms) - 1):
+            shared, position = decode_varbyte(mapped, position)
+            length, position = decode_varbyte(mapped, position)
+            term = term[:shared] + mapped[position:position + length]
+            position += length
+            yield term
+
+    def find(self, term):
+        """
+        Returns the ordinal of the term in sorted order
+        (its term ID inside the merged index), or -1 if
+        the term is not inside the lexicon.
+        """
+        encoded = term.encode("utf-8")
+        block = bisect_right(self.block_heads, encoded) - 1
+        if block < 0:
+            return -1
+        for ordinal, other in enumerate(self._iter_block(block), block * self.block_terms):
+            if other >= encoded:
+                return ordinal if other == encoded else -1
+        return -1
+
+    def get(self, term, default=None):
+        """
+        Returns the entry of the given term, or the
+        default if the term is not inside the lexicon.
+        """
+        entry = self.cache.get(term)
+        if entry is not None:
+            return entry
+        ordinal = self.find(term)
+        if ordinal < 0:
+            return default
+        entry = self._entry(ordinal)
+        if len(self.cache) >= CACHE_SIZE:
+            self.cache.clear()
+        self.cache[term] = entry
+        return entry
+
+    def __getitem__(self, term):
+        entry = self.get(term)
+        if entry is None:
+            raise KeyError(term)
+        return entry
+
+    def __contains__(self, term):
+        return self.get(term) is not None
+
+    def __len__(self):
+        return self.num_terms
+
+    def __iter__(self):
+        for block in range(len(self.block_offsets)):
+            for term in self._iter_block(block):
+                yield term.decode("utf-8")
+
+    def items(self):
+        """
+        A generator that yields (term, entry) for
+        every term, in sorted term order.
+        """
+        for ordinal, term in enumerate(self):
+            yield term, self._entry(ordinal)
+
+    def close(self):
+        self.mapped_lexicon.close()
+        self.lexicon_file.close()
+
+
+if __name__ == "__main__":
+    # round trips a synthetic lexicon and compares the lookups with a dictionary
+    import json
+    import random
+    import os
+    import tempfile
+
+    rng = random.Random(1)
+    words = {"".join(rng.choices("abcdefghijklmnopqrstuvwxyz0123456789", k=rng.randint(1, 12))) for _ in range(200000)}
+    lexicon = {word: [i * 10, i, i % 50 + 1, 1.5, 2.5, None if i % 3 else i, None if i % 3 else 7, None, i % 9 + 1]
+               for i, word in enumerate(words)}
+    with tempfile.TemporaryDirectory() as directory:
+        lexicon_path = os.path.join(directory, "Lexicon.bin")
+        json_path = os.path.join(directory, "Lexicon.txt")
+        Lexicon.write(lexicon_path, lexicon)
+        with open(json_path, "w", encoding="utf-8") as json_file:
+            json.dump(lexicon, json_file)
+        print(f"{len(lexicon)} terms: Lexicon.bin {os.path.getsize(lexicon_path)} bytes, "
+              f"JSON {os.path.getsize(json_path)} bytes")
+
+        time_start = time.time()
+        with open(json_path, "r", encoding="utf-8") as json_file:
+            json.load(json_file)
+        time_end = time.time()
+        print(f"loading the JSON lexicon: {time_end - time_start:.3f} seconds")
+
+        time_start = time.time()
+        front_coded = Lexicon(lexicon_path)
+        time_end = time.time()
+        print(f"opening Lexicon.bin: {time_end - time_start:.3f} seconds")
+
+        assert list(front_coded) == sorted(lexicon)
+        queries = rng.sample(sorted(words), 20000) + ["missing", "zzzzzzzzzzzzz", "", "0"]
+        time_start = time.time()
+        for word in queries:
+            front_coded.find(word)
+        time_end = time.time()
+        print(f"{len(queries)} uncached lookups: {(time_end - time_start) / len(queries) * 1e6:.1f} us per lookup")
+        assert all(front_coded.get(word) == lexicon.get(word) for word in queries)
+        front_coded.close()
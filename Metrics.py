@@ -0,0 +1,432 @@
+import os, json
+import sys
+import atexit
+import math
+import time
+import signal
+import cProfile
+import pstats
+import threading
+import warnings
+from collections import Counter
+
+
+"""
+Lightweight per-stage metrics for the build and the
+query pipelines, so a slow build or query can be traced
+back to the stage it spends its time in.
+
+A Metrics object keeps:
+    counters   = metrics.count("files_skipped") -> running total
+    timers     = with metrics.timer("parse"): ... -> calls,
+                 total seconds and slowest call of every stage
+    histograms = metrics.observe("doc_tokens", 532) -> count,
+                 mean, min, max and power-of-two buckets
+and summary() returns all of them as one JSON-serializable
+dictionary. Worker processes send their metrics to the parent
+with drain() and merge(), see IndexBuilder.
+
+Metrics are off unless SEARCH_METRICS=1 is set (or enabled=True
+is given): every method then returns right away and timer()
+hands out one shared do-nothing context manager, so the
+instrumented code only pays a method call per stage.
+
+SEARCH_PROFILE=parse,stem also profiles the listed stages (timer
+names) while they run, with cProfile (SEARCH_PROFILE_MODE=cprofile,
+the default) or with a sampling profiler (SEARCH_PROFILE_MODE=sample,
+Unix only) that records the stack of every thread inside a profiled
+stage every SAMPLE_INTERVAL seconds of CPU time, which slows the
+stage down much less than cProfile. The summary then lists the
+functions every profiled stage spends the most time in.
+"""
+
+METRICS_ENV = "SEARCH_METRICS"
+PROFILE_ENV = "SEARCH_PROFILE"
+PROFILE_MODE_ENV = "SEARCH_PROFILE_MODE"
+PROFILE_MODES = ("cprofile", "sample")
+SAMPLE_INTERVAL = 0.001 # seconds of CPU time between two samples, rounded up to the kernel's clock tick
+TOP_FUNCTIONS = 15 # functions listed per profiled stage in the summary
+_MAX_STACK_DEPTH = 64
+_TIMER_FUNCTIONS = {(os.path.basename(__file__), "__exit__"), (os.path.basename(__file__), "_stop_profile"),
+                    ("~", "<method 'disable' of '_lsprof.Profiler' objects>")}
+
+
+class _NullTimer:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+
+_NULL_TIMER = _NullTimer()
+_profiling = threading.local() # stage being profiled by cProfile in the current thread, one at a time
+
+
+class _Timer:
+    __slots__ = ("metrics", "stage", "start", "profiling")
+
+    def __init__(self, metrics, stage):
+        self.metrics = metrics
+        self.stage = stage
+        self.profiling = False
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        if self.stage in self.metrics.profile_stages:
+            self.profiling = self.metrics._start_profile(self.stage)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if self.profiling:
+            self.metrics._stop_profile(self.stage)
+        self.metrics.add_time(self.stage, time.perf_counter() - self.start)
+        return False
+
+
+class _Sampler:
+    """
+    Process-wide sampling profiler: a SIGPROF timer fires
+    every SAMPLE_INTERVAL seconds of CPU time, and the
+    handler records the stack of every thread that is
+    inside a profiled stage at that moment. The timer keeps
+    running between the stages (re-arming it on every stage
+    would reset its countdown, and stages shorter than the
+    interval would never be sampled) and is stopped at exit.
+    """
+    active = dict() # thread id -> (self samples, cumulative samples) of the stage it is in
+    installed = False
+
+    @classmethod
+    def install(cls):
+        if cls.installed:
+            return True
+        if not hasattr(signal, "SIGPROF") or threading.current_thread() is not threading.main_thread():
+            warnings.warn("The sampling profiler needs SIGPROF and the main thread, the stages are not profiled")
+            return False
+        signal.signal(signal.SIGPROF, cls._sample)
+        cls.installed = True
+        atexit.register(cls.stop)
+        return True
+
+    @classmethod
+    def stop(cls):
+        # the default action of SIGPROF ends the process, once the handler is gone while shutting down
+        signal.setitimer(signal.ITIMER_PROF, 0)
+
+    @classmethod
+    def enter(cls, samples):
+        if signal.getitimer(signal.ITIMER_PROF)[0] == 0: # not running yet, or not inherited by a forked worker
+            signal.setitimer(signal.ITIMER_PROF, SAMPLE_INTERVAL, SAMPLE_INTERVAL)
+        cls.active[threading.get_ident()] = samples
+
+    @classmethod
+    def exit(cls):
+        cls.active.pop(threading.get_ident(), None)
+
+    @classmethod
+    def _sample(cls, signal_number, interrupted_frame):
+        if not cls.active:
+            return
+        frames = sys._current_frames()
+        frames[threading.get_ident()] = interrupted_frame # not the frame of this handler
+        for thread_id, (self_samples, cumulative_samples) in list(cls.active.items()):
+            frame = frames.get(thread_id)
+            if frame is None:
+                continue
+            self_samples[_function_name(frame.f_code)] += 1
+            seen = set()
+            for _ in range(_MAX_STACK_DEPTH):
+                if frame is None:
+                    break
+                seen.add(_function_name(frame.f_code))
+                frame = frame.f_back
+            cumulative_samples.update(seen)
+
+
+def _function_name(code):
+    return f"{os.path.basename(code.co_filename)}:{code.co_firstlineno}({code.co_name})"
+
+
+def _enabled_from_environment():
+    return os.environ.get(METRICS_ENV, "") not in ("", "0")
+
+
+def _profile_stages_from_environment():
+    return frozenset(stage.strip() for stage in os.environ.get(PROFILE_ENV, "").split(",") if stage.strip())
+
+
+def percentile(values, percent):
+    """
+    Returns the given percentile (nearest rank)
+    of a list of numbers, 0 if the list is empty.
+    """
+    if not values:
+        return 0
+    ordered = sorted(values)
+    rank = max(1, round(percent / 100 * len(ordered)))
+    return ordered[min(rank, len(ordered)) - 1]
+
+
+class Metrics:
+    def __init__(self, enabled=None, profile_stages=None, profile_mode=None):
+        # profiling a stage also turns the metrics on, the defaults come from the environment
+        self.profile_stages = frozenset(profile_stages if profile_stages is not None else _profile_stages_from_environment())
+        self.enabled = bool(self.profile_stages) or (enabled if enabled is not None else _enabled_from_environment())
+        self.profile_mode = profile_mode or os.environ.get(PROFILE_MODE_ENV, "cprofile")
+        if self.profile_mode not in PROFILE_MODES:
+            raise ValueError(f"Unknown profile mode {self.profile_mode!r}, expected one of {PROFILE_MODES}")
+        self.counters = dict() # name -> total
+        self.timers = dict() # stage -> [calls, total seconds, slowest call in seconds]
+        self.histograms = dict() # name -> [count, sum, min, max, {power of two bucket: count}]
+        self.profilers = dict() # stage -> cProfile.Profile
+        self.samples = dict() # stage -> (self samples, cumulative samples) Counters of the sampling profiler
+        self.profile_stats = dict() # stage -> pstats.Stats loaded from other processes, see load_profiles
+        if self.profile_stages and self.profile_mode == "sample" and not _Sampler.install():
+            self.profile_stages = frozenset()
+
+    def timer(self, stage):
+        """
+        Returns a context manager that adds the time spent
+        inside it to the stage (and profiles it if the stage
+        is in profile_stages).
+        """
+        if not self.enabled:
+            return _NULL_TIMER
+        return _Timer(self, stage)
+
+    def timed_iter(self, stage, iterable):
+        """
+        Wraps an iterable so the time spent waiting for each
+        of its items is added to the stage, or returns the
+        iterable itself when the metrics are off.
+        """
+        if not self.enabled:
+            return iterable
+        return self._timed_iter(stage, iter(iterable))
+
+    def _timed_iter(self, stage, iterator):
+        while True:
+            with self.timer(stage):
+                item = next(iterator, _NULL_TIMER)
+            if item is _NULL_TIMER:
+                return
+            yield item
+
+    def add_time(self, stage, seconds, calls=1):
+        if not self.enabled:
+            return
+        timer = self.timers.get(stage)
+        if timer is None:
+            self.timers[stage] = [calls, seconds, seconds]
+        else:
+            timer[0] += calls
+            timer[1] += seconds
+            if seconds > timer[2]:
+                timer[2] = seconds
+
+    def count(self, name, amount=1):
+        if not self.enabled:
+            return
+        self.counters[name] = self.counters.get(name, 0) + amount
+
+    def observe(self, name, value):
+        if not self.enabled:
+            return
+        histogram = self.histograms.get(name)
+        if histogram is None:
+            histogram = self.histograms[name] = [0, 0, value, value, dict()]
+        histogram[0] += 1
+        histogram[1] += value
+        histogram[2] = min(histogram[2], value)
+        histogram[3] = max(histogram[3], value)
+        bucket = math.frexp(value)[1] if value > 0 else 0 # value <= 2 ** bucket
+        histogram[4][bucket] = histogram[4].get(bucket, 0) + 1
+
+    def _start_profile(self, stage):
+        if self.profile_mode == "sample":
+            samples = self.samples.get(stage)
+            if samples is None:
+                samples = self.samples[stage] = (Counter(), Counter())
+            _Sampler.enter(samples)
+            return True
+        if getattr(_profiling, "stage", None) is not None:
+            return False # cProfile can only profile one stage of a thread at a time
+        profiler = self.profilers.get(stage)
+        if profiler is None:
+            profiler = self.profilers[stage] = cProfile.Profile()
+        _profiling.stage = stage
+        profiler.enable()
+        return True
+
+    def _stop_profile(self, stage):
+        if self.profile_mode == "sample":
+            _Sampler.exit()
+            return
+        self.profilers[stage].disable()
+        _profiling.stage = None
+
+    def drain(self):
+        """
+        Returns the counters, timers and histograms gathered
+        since the last drain() (in the form merge() takes) and
+        starts over, None when there is nothing to send.
+        """
+        if not self.enabled or not (self.counters or self.timers or self.histograms):
+            return None
+        drained = (self.counters, self.timers, self.histograms)
+        self.counters = dict()
+        self.timers = dict()
+        self.histograms = dict()
+        return drained
+
+    def merge(self, drained):
+        """
+        Adds the metrics drained from another Metrics
+        (usually inside a worker process) to these.
+        """
+        if drained is None or not self.enabled:
+            return
+        counters, timers, histograms = drained
+        for name, amount in counters.items():
+            self.count(name, amount)
+        for stage, (calls, seconds, slowest) in timers.items():
+            self.add_time(stage, seconds, calls)
+            self.timers[stage][2] = max(self.timers[stage][2], slowest)
+        for name, (count, total, minimum, maximum, buckets) in histograms.items():
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                self.histograms[name] = [count, total, minimum, maximum, dict(buckets)]
+                continue
+            histogram[0] += count
+            histogram[1] += total
+            histogram[2] = min(histogram[2], minimum)
+            histogram[3] = max(histogram[3], maximum)
+            for bucket, bucket_count in buckets.items():
+                histogram[4][bucket] = histogram[4].get(bucket, 0) + bucket_count
+
+    def save_profiles(self, directory, suffix):
+        """
+        Writes the profiles of this process to directory, so
+        the process that started it can load_profiles them.
+        """
+        for stage, profiler in self.profilers.items():
+            profiler.dump_stats(os.path.join(directory, f"Profile_{stage}.{suffix}.prof"))
+        for stage, (self_samples, cumulative_samples) in self.samples.items():
+            with open(os.path.join(directory, f"Profile_{stage}.{suffix}.samples"), "w", encoding="utf-8") as samples_file:
+                json.dump([self_samples, cumulative_samples], samples_file)
+
+    def load_profiles(self, directory):
+        """
+        Adds the profiles saved by other processes in directory
+        to these, deleting their files, and writes the profile
+        of every cProfile stage (from every process) to
+        Profile_<stage>.prof for pstats or snakeviz.
+        """
+        for file in sorted(os.listdir(directory)):
+            parts = file.split(".") # Profile_<stage>.<suffix>.prof, not the merged Profile_<stage>.prof
+            if not file.startswith("Profile_") or len(parts) != 3:
+                continue
+            path = os.path.join(directory, file)
+            stage = parts[0][len("Profile_"):]
+            if parts[2] == "prof":
+                if stage in self.profile_stats:
+                    self.profile_stats[stage].add(path)
+                else:
+                    self.profile_stats[stage] = pstats.Stats(path)
+            elif parts[2] == "samples":
+                with open(path, "r", encoding="utf-8") as samples_file:
+                    self_samples, cumulative_samples = json.load(samples_file)
+                samples = self.samples.setdefault(stage, (Counter(), Counter()))
+                samples[0].update(self_samples)
+                samples[1].update(cumulative_samples)
+            else:
+                continue
+            os.remove(path)
+        for stage, profiler in self.profilers.items():
+            if stage in self.profile_stats:
+                self.profile_stats[stage].add(profiler)
+            else:
+                self.profile_stats[stage] = pstats.Stats(profiler)
+        self.profilers = dict()
+        for stage, stats in self.profile_stats.items():
+            stats.dump_stats(os.path.join(directory, f"Profile_{stage}.prof"))
+
+    def _top_functions(self, stage):
+        if stage in self.samples:
+            self_samples, cumulative_samples = self.samples[stage]
+            return [{"function": function, "self_samples": self_samples.get(function, 0), "cumulative_samples": samples}
+                    for function, samples in sorted(cumulative_samples.items(), key=lambda item: (-self_samples.get(item[0], 0), -item[1]))[:TOP_FUNCTIONS]]
+        stats = self.profile_stats.get(stage) or pstats.Stats(self.profilers[stage])
+        # leaves out the timer stopping the profiler, which cProfile sees as part of the stage
+        entries = [(key, entry) for key, entry in stats.stats.items()
+                   if (os.path.basename(key[0]), key[2]) not in _TIMER_FUNCTIONS]
+        entries = sorted(entries, key=lambda item: item[1][2], reverse=True)[:TOP_FUNCTIONS]
+        return [{"function": f"{os.path.basename(file)}:{line}({function})", "calls": calls,
+                 "self_s": round(self_time, 6), "cumulative_s": round(cumulative_time, 6)}
+                for (file, line, function), (_, calls, self_time, cumulative_time, _) in entries]
+
+    def summary(self):
+        """
+        Returns every counter, timer, histogram and profile
+        as a JSON-serializable dictionary.
+        """
+        summary = {
+            "counters": dict(sorted(self.counters.items())),
+            "timers": {stage: {"calls": calls, "total_s": round(total, 6), "mean_ms": round(total / calls * 1000, 6),
+                               "max_ms": round(slowest * 1000, 6)}
+                       for stage, (calls, total, slowest) in sorted(self.timers.items(), key=lambda item: -item[1][1])},
+            "histograms": {name: {"count": count, "mean": total / count, "min": minimum, "max": maximum,
+                                  "buckets": {f"<={2 ** bucket}": bucket_count for bucket, bucket_count in sorted(buckets.items())}}
+                           for name, (count, total, minimum, maximum, buckets) in sorted(self.histograms.items())},
+        }
+        profiled = set(self.profilers) | set(self.samples) | set(self.profile_stats)
+        if profiled:
+            summary["profiles"] = {stage: self._top_functions(stage) for stage in sorted(profiled)}
+        return summary
+
+    def format_summary(self):
+        """
+        Returns the timers and counters of the summary
+        as lines of text, slowest stage first.
+        """
+        summary = self.summary()
+        lines = [f"{'stage':24} {'calls':>10} {'total s':>10} {'mean ms':>10} {'max ms':>10}"]
+        for stage, timer in summary["timers"].items():
+            lines.append(f"{stage:24} {timer['calls']:>10} {timer['total_s']:>10.3f} {timer['mean_ms']:>10.3f} {timer['max_ms']:>10.3f}")
+        for name, value in summary["counters"].items():
+            lines.append(f"{name:24} {value:>10}")
+        for stage, functions in summary.get("profiles", dict()).items():
+            lines.append(f"profile of {stage}:")
+            lines.extend(f"    {json.dumps(function)}" for function in functions[:5])
+        return lines
+
+
+NULL_METRICS = Metrics(enabled=False, profile_stages=()) # shared by the code that is not given any metrics
+
+
+if __name__ == "__main__":
+    # overhead of the instrumentation per timed stage, off and on
+    iterations = 1000000
+    for metrics in (Metrics(enabled=False, profile_stages=()), Metrics(enabled=True, profile_stages=())):
+        time_start = time.perf_counter()
+        for _ in range(iterations):
+            with metrics.timer("stage"):
+                pass
+        time_end = time.perf_counter()
+        print(f"enabled={metrics.enabled}: {(time_end - time_start) / iterations * 1e9:.0f} ns per timed stage")
+
+    # both profilers find the function a stage spends its time in
+    def busy_function():
+        return sum(i * i for i in range(200000))
+
+    for profile_mode in PROFILE_MODES:
+        metrics = Metrics(profile_stages={"busy"}, profile_mode=profile_mode)
+        for _ in range(20):
+            with metrics.timer("busy"):
+                busy_function()
+            with metrics.timer("idle"):
+                time.sleep(0.001)
+        top_functions = [function["function"] for function in metrics.summary()["profiles"]["busy"][:3]]
+        print(f"{profile_mode}: busiest functions of the busy stage {top_functions}")
+        assert any("busy_function" in function or "genexpr" in function for function in top_functions), top_functions
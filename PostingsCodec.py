@@ -0,0 +1,438 @@
+import json
+import mmap
+import random
+import struct
+import time
+
+
+"""
+Pluggable codecs for the postings lists that are written
+to the Output_Batch files and the final merged index.
+
+Every codec turns a docID-ascending list of postings
+    [(docId : int, freq : int), (docId, freq), ...]
+into bytes and back. The default VarByteCodec stores the
+gap between consecutive docIDs (instead of the docID itself)
+followed by the frequency, each as a variable-byte integer:
+7 bits of the number per byte, with the high bit set on every
+byte except the last one of a number. Small gaps and
+frequencies, which are by far the most common, take 1 byte.
+
+The BlockVarByteCodec, used for the final index, cuts the
+same varbyte pairs into blocks of BLOCK_SIZE postings and puts
+a fixed-width skip table in front of them:
+    varbyte(number of blocks)
+    skip table = per block (last docId : uint64, end of the block : uint32)
+    blocks = varbyte (gap, freq) pairs, the first gap of a block
+             being relative to the last docId of the block before
+so BlockPostingsIterator.advance_to can gallop over the skip
+table and only decode the one block that holds its target.
+
+Postings files (batches and the final index) share one layout:
+    header = varbyte(len(codec name)) + codec name
+    record = varbyte(len(term)) + term + varbyte(len(payload)) + payload
+with the records in ascending term order, so readers know
+which codec decodes the payloads without any extra files.
+The batch files written by IndexBuilder hold the integer ID
+of the term instead of the term itself (see Lexicon.py):
+    record = varbyte(term ID) + varbyte(len(payload)) + payload
+"""
+
+def encode_varbyte(number, output):
+    """
+    Appends the variable-byte encoding of a
+    non-negative integer to the output bytearray.
+    """
+    while number >= 0x80:
+        output.append((number & 0x7F) | 0x80)
+        number >>= 7
+    output.append(number)
+
+
+def decode_varbyte(buffer, position):
+    """
+    Decodes the variable-byte integer starting at
+    the given position of a bytes/memoryview.
+
+    Returns (number, position after the number).
+    """
+    number = 0
+    shift = 0
+    while True:
+        byte = buffer[position]
+        position += 1
+        number |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return number, position
+        shift += 7
+
+
+class VarByteCodec:
+    name = "vbyte"
+
+    def encode(self, postings):
+        """
+        Encodes docID-ascending postings as
+        varbyte (docID gap, freq) pairs.
+        """
+        output = bytearray()
+        previous_docId = 0
+        for docId, freq in postings:
+            encode_varbyte(docId - previous_docId, output)
+            encode_varbyte(freq, output)
+            previous_docId = docId
+        return bytes(output)
+
+    def decode(self, buffer):
+        """
+        A generator that yields (docId, freq) straight
+        from a bytes/memoryview slice, without building
+        an intermediate list of the postings.
+        """
+        position = 0
+        end = len(buffer)
+        docId = 0
+        while position < end:
+            # inlined decode_varbyte for the gap, most gaps are a single byte
+            byte = buffer[position]
+            position += 1
+            gap = byte & 0x7F
+            shift = 7
+            while byte >= 0x80:
+                byte = buffer[position]
+                position += 1
+                gap |= (byte & 0x7F) << shift
+                shift += 7
+            docId += gap
+
+            byte = buffer[position]
+            position += 1
+            freq = byte & 0x7F
+            shift = 7
+            while byte >= 0x80:
+                byte = buffer[position]
+                position += 1
+                freq |= (byte & 0x7F) << shift
+                shift += 7
+            yield docId, freq
+
+
+def encode_positions(positions, output):
+    """
+    Appends the ascending positions of a term inside
+    one document as varbyte gaps to the output bytearray.
+    """
+    previous_position = 0
+    for position in positions:
+        encode_varbyte(position - previous_position, output)
+        previous_position = position
+
+
+def decode_positions(buffer, start, end):
+    """
+    Decodes the varbyte position gaps between start
+    and end of a bytes/mmap back into positions.
+    """
+    positions = []
+    position = 0
+    while start < end:
+        gap, start = decode_varbyte(buffer, start)
+        position += gap
+        positions.append(position)
+    return positions
+
+
+BLOCK_SIZE = 128 # postings per block of the BlockVarByteCodec
+_SKIP_ENTRY = struct.Struct("<QI")
+
+
+class BlockPostingsIterator:
+    def __init__(self, buffer):
+        self.buffer = buffer
+        self.num_blocks, self.table_start = decode_varbyte(buffer, 0) if len(buffer) else (0, 0)
+        self.blocks_start = self.table_start + self.num_blocks * _SKIP_ENTRY.size
+        self.block = -1 # block being decoded
+        self.position = self.blocks_start
+        self.block_end = self.blocks_start
+        self.docId = 0 # last docId decoded
+        self.ordinal = -1 # number of postings before the last one decoded
+
+    def _skip_entry(self, block):
+        """
+        Returns (last docId, end offset) of a block
+        straight from the fixed-width skip table.
+        """
+        return _SKIP_ENTRY.unpack_from(self.buffer, self.table_start + block * _SKIP_ENTRY.size)
+
+    def _enter_block(self, block):
+        """
+        Moves to the start of the given block, the
+        docIds of its postings restart from the last
+        docId of the block before it.
+        """
+        if block == 0:
+            self.docId, start = 0, 0
+        else:
+            self.docId, start = self._skip_entry(block - 1)
+        self.block = block
+        self.ordinal = block * BLOCK_SIZE - 1
+        self.position = self.blocks_start + start
+        self.block_end = self.blocks_start + self._skip_entry(block)[1]
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self.position >= self.block_end:
+            if self.block + 1 >= self.num_blocks:
+                raise StopIteration
+            self._enter_block(self.block + 1)
+        buffer = self.buffer
+        position = self.position
+        # single byte gaps and frequencies are the common case, decode_varbyte handles the rest
+        gap = buffer[position]
+        if gap < 0x80:
+            position += 1
+        else:
+            gap, position = decode_varbyte(buffer, position)
+        freq = buffer[position]
+        if freq < 0x80:
+            position += 1
+        else:
+            freq, position = decode_varbyte(buffer, position)
+        self.position = position
+        self.ordinal += 1
+        self.docId += gap
+        return self.docId, freq
+
+    def advance_to(self, target_docId):
+        """
+        Returns the next posting whose docId is greater
+        than or equal to target_docId (or None if there is
+        none), galloping over the skip table from the current
+        block so whole blocks are skipped without decoding.
+        """
+        # gallop: probes the current block, then 1, 2, 4, ... blocks ahead
+        low = max(self.block, 0)
+        if low >= self.num_blocks:
+            return None
+        step = 1
+        high = low
+        while self._skip_entry(high)[0] < target_docId:
+            low = high + 1
+            high = low + step - 1
+            step *= 2
+            if low >= self.num_blocks:
+                return None
+            if high >= self.num_blocks:
+                high = self.num_blocks - 1
+                if self._skip_entry(high)[0] < target_docId:
+                    return None
+                break
+        # binary search for the first block in [low, high] whose last docId >= target
+        while low < high:
+            middle = (low + high) // 2
+            if self._skip_entry(middle)[0] < target_docId:
+                low = middle + 1
+            else:
+                high = middle
+        if low != self.block:
+            self._enter_block(low)
+
+        # decodes the block only up to the target
+        for docId, freq in self:
+            if docId >= target_docId:
+                return docId, freq
+        return None
+
+
+class BlockVarByteCodec:
+    name = "vbyte-blocks"
+
+    def encode(self, postings):
+        """
+        Encodes docID-ascending postings as blocks of
+        varbyte (docID gap, freq) pairs behind a skip table.
+        """
+        skip_table = bytearray()
+        blocks = bytearray()
+        previous_docId = 0
+        for start in range(0, len(postings), BLOCK_SIZE):
+            for docId, freq in postings[start:start + BLOCK_SIZE]:
+                encode_varbyte(docId - previous_docId, blocks)
+                encode_varbyte(freq, blocks)
+                previous_docId = docId
+            skip_table += _SKIP_ENTRY.pack(previous_docId, len(blocks))
+
+        output = bytearray()
+        encode_varbyte(len(skip_table) // _SKIP_ENTRY.size, output)
+        return bytes(output + skip_table + blocks)
+
+    def decode(self, buffer):
+        """
+        Returns an iterator of (docId, freq) over a bytes/mmap
+        slice, which also supports advance_to for skipping.
+        """
+        return BlockPostingsIterator(buffer)
+
+
+class JsonCodec:
+    name = "json"
+
+    def encode(self, postings):
+        """
+        Encodes the postings as a compact JSON list,
+        kept for debugging and comparisons.
+        """
+        return json.dumps(postings, separators=(",", ":")).encode("utf-8")
+
+    def decode(self, buffer):
+        for docId, freq in json.loads(bytes(buffer)):
+            yield docId, freq
+
+
+CODECS = {codec.name: codec for codec in (VarByteCodec, BlockVarByteCodec, JsonCodec)}
+DEFAULT_CODEC = VarByteCodec.name # batches, always read front to back
+DEFAULT_INDEX_CODEC = BlockVarByteCodec.name # final index, skipped through by the queries
+
+
+def get_codec(name):
+    """
+    Returns an instance of the codec registered under
+    the given name, raising a ValueError for unknown codecs.
+    """
+    if name not in CODECS:
+        raise ValueError(f"Unknown postings codec {name!r}, expected one of {sorted(CODECS)}")
+    return CODECS[name]()
+
+
+def write_header(output_file, codec):
+    """
+    Writes the header naming the codec used by
+    the records of a postings file.
+
+    Returns the number of bytes that were written.
+    """
+    header = bytearray()
+    name = codec.name.encode("utf-8")
+    encode_varbyte(len(name), header)
+    header += name
+    output_file.write(header)
+    return len(header)
+
+
+def write_record(output_file, term, payload):
+    """
+    Writes one term and its encoded postings to a
+    postings file.
+
+    Returns (bytes written, offset of the payload
+    relative to the start of the record).
+    """
+    record = bytearray()
+    encoded_term = term.encode("utf-8")
+    encode_varbyte(len(encoded_term), record)
+    record += encoded_term
+    encode_varbyte(len(payload), record)
+    payload_offset = len(record)
+    record += payload
+    output_file.write(record)
+    return len(record), payload_offset
+
+
+def write_id_record(output_file, term_id, payload):
+    """
+    Writes one term ID and its encoded postings to
+    a batch file.
+    """
+    record = bytearray()
+    encode_varbyte(term_id, record)
+    encode_varbyte(len(payload), record)
+    record += payload
+    output_file.write(record)
+
+
+def read_header(buffer):
+    """
+    Reads the header of a postings file.
+
+    Returns (codec, position of the first record).
+    """
+    name_length, position = decode_varbyte(buffer, 0)
+    name = bytes(buffer[position:position + name_length]).decode("utf-8")
+    return get_codec(name), position + name_length
+
+
+def read_records(file_path):
+    """
+    A generator that streams the records of a postings
+    file through mmap, yielding (term, codec, payload)
+    where payload holds the encoded postings of the term.
+    """
+    with open(file_path, "rb") as postings_file:
+        if postings_file.seek(0, 2) == 0:
+            return # empty file, nothing to read
+        with mmap.mmap(postings_file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            codec, position = read_header(mapped)
+            end = len(mapped)
+            while position < end:
+                term_length, position = decode_varbyte(mapped, position)
+                term = mapped[position:position + term_length].decode("utf-8")
+                position += term_length
+                payload_length, position = decode_varbyte(mapped, position)
+                payload = mapped[position:position + payload_length]
+                position += payload_length
+                yield term, codec, payload
+
+
+def read_id_records(file_path):
+    """
+    Same as read_records for the files written with
+    write_id_record, yielding (term ID, codec, payload).
+    """
+    with open(file_path, "rb") as postings_file:
+        if postings_file.seek(0, 2) == 0:
+            return # empty file, nothing to read
+        with mmap.mmap(postings_file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            codec, position = read_header(mapped)
+            end = len(mapped)
+            while position < end:
+                term_id, position = decode_varbyte(mapped, position)
+                payload_length, position = decode_varbyte(mapped, position)
+                payload = mapped[position:position + payload_length]
+                position += payload_length
+                yield term_id, codec, payload
+
+
+if __name__ == "__main__":
+    # the round trip and skip checks are in test_PostingsCodec.py (python -m pytest test_PostingsCodec.py)
+    # compares the old pretty-printed JSON batches against the codecs,
+    # using a Zipf-like spread of postings list lengths
+    random.seed(0)
+    num_docs = 50000
+    index = dict()
+    for term_number in range(1, 5001):
+        df = max(1, num_docs // (term_number * 2))
+        docIds = sorted(random.sample(range(1, num_docs + 1), df))
+        index[f"term{term_number}"] = [[docId, random.randint(1, 20)] for docId in docIds]
+    total_postings = sum(len(postings) for postings in index.values())
+
+    old_batch = json.dumps(index, indent=2).encode("utf-8")
+    time_start = time.time()
+    for postings in json.loads(old_batch).values():
+        for docId, freq in postings:
+            pass
+    time_end = time.time()
+    print(f"\n{total_postings} postings over {len(index)} terms")
+    print(f"json (indent=2 batch): {len(old_batch) / 1000:.2f} KB, decoded in {time_end - time_start:.3f} seconds")
+
+    for codec_class in CODECS.values():
+        codec = codec_class()
+        payloads = [memoryview(codec.encode(postings)) for postings in index.values()]
+        time_start = time.time()
+        for payload in payloads:
+            for docId, freq in codec.decode(payload):
+                pass
+        time_end = time.time()
+        total_size = sum(len(payload) for payload in payloads)
+        print(f"{codec.name}: {total_size / 1000:.2f} KB, decoded in {time_end - time_start:.3f} seconds")
@@ -0,0 +1,301 @@
+from bisect import bisect_left
+from collections import OrderedDict
+from array import array
+from multiprocessing.shared_memory import SharedMemory
+
+
+"""
+Two-level cache for the query side, since the same
+queries (professor names, "machine learning", ...) keep
+coming back:
+
+    results = the top k results of a query, keyed by the
+        sorted, stemmed tokens of SearchQuery.tokenize_query
+        and the search options
+    postings = the decoded postings of the requested terms,
+        bounded by the total number of postings kept
+
+Both levels evict the least recently used entries once
+they are full, count their hits and misses, and are
+cleared when the generation of the index changes (the
+index was merged again), so no stale result survives.
+
+Worker processes searching the same index can also share
+one read-only level in front of the postings: SharedPostings,
+the decoded postings of the hottest terms, decoded once by
+the parent process into one block of shared memory and read
+by every worker without copying it, so adding workers does
+not add copies of the most used postings.
+"""
+
+class LRUCache:
+    def __init__(self, max_size, size_of=None):
+        self.max_size = max_size # maximum total size of the entries
+        self.size_of = size_of # size of one value, every entry counts as 1 when None
+        self.entries = OrderedDict()
+        self.current_size = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        """
+        Returns the cached value of the key and marks it
+        as most recently used, or None on a miss.
+        """
+        value = self.entries.get(key)
+        if value is None:
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def put(self, key, value):
+        """
+        Caches the value, evicting the least recently
+        used entries until it fits. Values bigger than
+        the whole cache are not cached.
+        """
+        size = self.size_of(value) if self.size_of else 1
+        if size > self.max_size:
+            return
+        if key in self.entries:
+            self.current_size -= self.size_of(self.entries[key]) if self.size_of else 1
+            del self.entries[key]
+        while self.entries and self.current_size + size > self.max_size:
+            _, evicted = self.entries.popitem(last=False)
+            self.current_size -= self.size_of(evicted) if self.size_of else 1
+        self.entries[key] = value
+        self.current_size += size
+
+    def clear(self):
+        self.entries.clear()
+        self.current_size = 0
+
+    def hit_rate(self):
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0
+
+    def get_stats(self):
+        return {
+            "entries": len(self.entries),
+            "size": self.current_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hit_rate(),
+        }
+
+
+class DecodedPostings:
+    def __init__(self, postings):
+        self.docIds = array("q")
+        self.freqs = array("q")
+        for docId, freq in postings:
+            self.docIds.append(docId)
+            self.freqs.append(freq)
+
+    def __len__(self):
+        return len(self.docIds)
+
+    def iterator(self):
+        return DecodedPostingsIterator(self.docIds, self.freqs)
+
+
+class DecodedPostingsIterator:
+    def __init__(self, docIds, freqs):
+        self.docIds = docIds # array or memoryview of the docIds, sorted
+        self.freqs = freqs
+        self.position = 0
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self.position >= len(self.docIds):
+            raise StopIteration
+        posting = self.docIds[self.position], self.freqs[self.position]
+        self.position += 1
+        return posting
+
+    @property
+    def ordinal(self):
+        # number of postings before the last one returned
+        return self.position - 1
+
+    def advance_to(self, target_docId):
+        """
+        Returns the next posting whose docId is greater than
+        or equal to target_docId (or None), binary searching
+        the decoded docIds instead of walking them.
+        """
+        self.position = bisect_left(self.docIds, target_docId, self.position)
+        return next(self, None)
+
+
+class SharedPostings:
+    def __init__(self, shared_memory, terms, generation):
+        """
+        Reads the postings of the terms out of a shared memory
+        block laid out as two uint32 arrays, every docId of
+        the terms followed by every frequency.
+        """
+        self.shared_memory = shared_memory
+        self.terms = terms # term -> (first posting, number of postings)
+        self.generation = generation # of the index the postings were decoded from
+        num_postings = sum(length for _, length in terms.values())
+        self.view = shared_memory.buf[:8 * num_postings].cast("I")
+        self.docIds = self.view[:num_postings]
+        self.freqs = self.view[num_postings:]
+
+    @classmethod
+    def create(cls, index_reader, num_terms, max_postings):
+        """
+        Decodes the postings of the num_terms terms with the
+        highest document frequency into a new block of shared
+        memory, leaving out the terms that would take it over
+        max_postings postings. The block lives until unlink().
+        """
+        return cls.create_for_terms(index_reader, index_reader.hot_terms(num_terms), max_postings)
+
+    @classmethod
+    def create_for_terms(cls, index_reader, terms_to_share, max_postings):
+        """
+        Same as create, for the given terms in their order
+        (see BatchSearch.py), skipping the terms that are
+        not inside the index.
+        """
+        terms = dict()
+        docIds = array("I")
+        freqs = array("I")
+        for term in terms_to_share:
+            df = index_reader.get_df(term)
+            if not df or term in terms or len(docIds) + df > max_postings:
+                continue
+            start = len(docIds)
+            for docId, freq in index_reader.iter_postings(term):
+                docIds.append(docId)
+                freqs.append(freq)
+            terms[term] = (start, len(docIds) - start)
+        num_postings = len(docIds)
+        shared_memory = SharedMemory(create=True, size=max(8 * num_postings, 1))
+        view = shared_memory.buf[:8 * num_postings].cast("I")
+        view[:num_postings] = docIds
+        view[num_postings:] = freqs
+        view.release()
+        return cls(shared_memory, terms, index_reader.get_generation())
+
+    @classmethod
+    def attach(cls, name, terms, generation):
+        """
+        Opens the shared postings created by another process
+        from what get_attach_arguments returned there.
+        """
+        return cls(SharedMemory(name=name), terms, generation)
+
+    def get_attach_arguments(self):
+        return self.shared_memory.name, self.terms, self.generation
+
+    def get_num_postings(self):
+        return len(self.docIds)
+
+    def iterator(self, term):
+        """
+        Returns an iterator over the shared postings of
+        the term, or None if the term is not shared.
+        """
+        location = self.terms.get(term)
+        if location is None:
+            return None
+        start, length = location
+        return DecodedPostingsIterator(self.docIds[start:start + length], self.freqs[start:start + length])
+
+    def close(self):
+        """
+        Closes this process's view of the shared postings,
+        once none of its iterators are in use anymore.
+        """
+        self.docIds.release()
+        self.freqs.release()
+        self.view.release()
+        self.shared_memory.close()
+
+    def unlink(self):
+        """
+        Frees the shared memory block, once every
+        process using it has closed it.
+        """
+        self.shared_memory.unlink()
+
+
+class QueryCache:
+    def __init__(self, max_results=10000, max_postings=5000000, min_term_requests=2, shared_postings=None):
+        self.results = LRUCache(max_results)
+        self.postings = LRUCache(max_postings, size_of=len) # bounded by the number of decoded postings
+        self.term_requests = LRUCache(max_results) # how often the recently requested terms were asked for
+        self.min_term_requests = min_term_requests
+        self.shared_postings = shared_postings # optional SharedPostings of the hottest terms
+        self.shared_hits = 0
+        self.generation = None
+
+    @staticmethod
+    def result_key(query_tokens, *options):
+        """
+        Normalizes the stemmed query tokens (order and
+        repeats do not change the results) into a key.
+        """
+        return tuple(sorted(set(query_tokens))), options
+
+    def set_generation(self, generation):
+        """
+        Clears both levels when the index generation
+        is not the one the cached entries came from.
+        """
+        if generation != self.generation:
+            self.results.clear()
+            self.postings.clear()
+            self.term_requests.clear()
+            self.generation = generation
+            if self.shared_postings is not None and self.shared_postings.generation != generation:
+                self.shared_postings.close() # decoded from another version of the index
+                self.shared_postings = None
+
+    def get_result(self, key):
+        return self.results.get(key)
+
+    def put_result(self, key, result):
+        self.results.put(key, result)
+
+    def get_postings(self, term, index_reader):
+        """
+        Returns an iterator over the postings of the term.
+        Terms requested at least min_term_requests times are
+        decoded once and cached, the others are read from
+        the index (keeping its skip pointers).
+        """
+        if self.shared_postings is not None:
+            shared_postings = self.shared_postings.iterator(term)
+            if shared_postings is not None:
+                self.shared_hits += 1
+                return shared_postings
+        decoded_postings = self.postings.get(term)
+        if decoded_postings is not None:
+            return decoded_postings.iterator()
+
+        requests = (self.term_requests.get(term) or 0) + 1
+        self.term_requests.put(term, requests)
+        if requests < self.min_term_requests:
+            return index_reader.iter_postings(term)
+        decoded_postings = DecodedPostings(index_reader.iter_postings(term))
+        self.postings.put(term, decoded_postings)
+        return decoded_postings.iterator()
+
+    def get_stats(self):
+        return {
+            "generation": self.generation,
+            "results": self.results.get_stats(),
+            "postings": self.postings.get_stats(),
+            "shared_postings": {
+                "terms": len(self.shared_postings.terms) if self.shared_postings is not None else 0,
+                "hits": self.shared_hits,
+            },
+        }
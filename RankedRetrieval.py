@@ -0,0 +1,422 @@
+import sys
+import heapq
+from bisect import bisect_right
+from Scoring import Scoring
+from Metrics import NULL_METRICS
+
+
+"""
+Ranked top-k retrieval over the merged index, scoring
+documents at a time (DAAT).
+
+The docID-sorted postings of every query term are walked
+in lockstep through PostingsCursor objects, so a document
+is scored as soon as all of its postings line up, and only
+a min-heap of the best k (score, docId) pairs is kept
+instead of materializing and sorting every candidate.
+
+    conjunctive (AND): only documents containing every
+        query term are scored, driven by the rarest term and
+        skipping through the longer postings lists
+    disjunctive (OR): every document containing at least
+        one query term is scored, or with pruning only the ones
+        that can still make it into the top k (MaxScore)
+
+MaxScore uses the per-term score upper bounds stored in the
+lexicon: once the heap is full, the terms whose upper bounds
+add up to less than the k-th best score can not put a document
+into the top k on their own, so only the other ("essential")
+terms produce candidates, and the non-essential terms are only
+looked at while the candidate can still beat the k-th score.
+
+Phrases (lists of stemmed tokens that must appear next to each
+other, in order) need an index built with positional=True. A
+phrase query is evaluated as an AND of all its tokens, and the
+positions are only read for the documents that survive the
+intersection, so most candidates are never checked at all.
+
+Champion lists (see IndexMerge.py) give a faster, approximate
+first tier: with champions=True a query is first ranked over
+the few best scored postings of every term only, and the full
+postings are only walked when fewer than k documents qualify
+that way. The scores use the df of the whole postings, so the
+results of the first tier are scored like any other.
+
+Scoring methods:
+    tf-idf = (1 + log(tf)) * log(N / df)
+    bm25 = bm25 with the document lengths of the index
+    impact = the bm25 scores quantized at merge time (needs an
+        index merged with impact_bits), so scoring a posting
+        is a single integer add instead of log10 calls
+"""
+
+END_OF_POSTINGS = sys.maxsize # docId of a cursor that ran out of postings
+
+
+class PostingsCursor:
+    def __init__(self, term, postings, df, max_score=0):
+        self.term = term
+        self.df = df # document frequency, length of the postings list
+        self.max_score = max_score # upper bound of the score of a single posting
+        self.postings = postings # iterator of (docId, freq) sorted by docID, freq is the impact in impact mode
+        self.docId = 0
+        self.freq = 0
+        self.ordinal = -1 # number of postings before the current one, locates its positions
+        self.next()
+
+    def next(self):
+        """
+        Moves the cursor to the next posting, setting
+        docId to END_OF_POSTINGS once the list runs out.
+        """
+        posting = next(self.postings, None)
+        if posting is None:
+            self.docId, self.freq = END_OF_POSTINGS, 0
+        else:
+            self.docId, self.freq = posting
+            self.ordinal += 1
+
+    def advance_to(self, target_docId):
+        """
+        Moves the cursor to the first posting whose
+        docId is greater than or equal to target_docId,
+        skipping whole blocks when the postings carry
+        skip pointers (see BlockPostingsIterator).
+        """
+        if self.docId >= target_docId:
+            return
+        if hasattr(self.postings, "advance_to"):
+            posting = self.postings.advance_to(target_docId)
+            if posting is None:
+                self.docId, self.freq = END_OF_POSTINGS, 0
+            else:
+                self.docId, self.freq = posting
+                self.ordinal = self.postings.ordinal
+            return
+        while self.docId < target_docId:
+            self.next()
+
+
+class RankedRetrieval:
+    def __init__(self, index_reader, num_docs=None, scoring_method="tf-idf", doc_lengths=None, avg_doc_length=None, cache=None):
+        if scoring_method not in ("tf-idf", "bm25", "impact"):
+            raise ValueError(f"Unknown scoring method {scoring_method!r}, expected 'tf-idf', 'bm25' or 'impact'")
+        if scoring_method == "impact" and not index_reader.has_impacts():
+            raise ValueError("The index was merged without impact scores, merge it again with impact_bits set")
+        self.index_reader = index_reader
+        # N and the document lengths default to the collection statistics of the index
+        self.num_docs = num_docs if num_docs is not None else index_reader.get_num_docs()
+        self.scoring_method = scoring_method
+        self.doc_lengths = doc_lengths if doc_lengths is not None else index_reader.doc_lengths # docId -> number of tokens, only used by bm25
+        self.avg_doc_length = avg_doc_length if avg_doc_length is not None else index_reader.get_avg_doc_length()
+        self.scores = Scoring()
+        self.cache = cache # optional QueryCache for the results and the decoded postings of hot terms
+        self.deleted = index_reader.deleted # docIds whose postings are still in the index but must not be returned
+        self.postings_scored = 0 # number of postings scored by the last search
+
+    def has_positions(self):
+        return self.index_reader.has_positions()
+
+    def _score(self, cursor):
+        """
+        Returns the score contribution of the
+        posting the cursor is currently on.
+        """
+        self.postings_scored += 1
+        if self.scoring_method == "impact":
+            return cursor.freq # the quantized score was stored in place of the frequency
+        if self.scoring_method == "bm25":
+            return self.scores.bm25(cursor.freq, self.num_docs, cursor.df, self.doc_lengths[cursor.docId], self.avg_doc_length)
+        return self.scores.tf_idf(cursor.freq, self.num_docs, cursor.df)
+
+    def _open_cursors(self, query_tokens, champions=False):
+        """
+        Opens one cursor per unique query token that is
+        inside the index, returning None if a token is
+        missing (no document can match all of them).
+        With champions set, the cursors only walk the
+        champion list of every token.
+        """
+        cursors = []
+        for token in dict.fromkeys(query_tokens): # unique tokens, in query order
+            df = self.index_reader.get_df(token)
+            if df == 0:
+                return None
+            max_score = self.index_reader.get_max_score(token, self.scoring_method)
+            if champions:
+                postings = self.index_reader.iter_champions(token)
+            elif self.cache is not None:
+                postings = self.cache.get_postings(token, self.index_reader)
+            else:
+                postings = self.index_reader.iter_postings(token)
+            if self.scoring_method == "impact":
+                # pairs every docId with its impact instead of its frequency
+                impacts = self.index_reader.iter_champion_impacts(token) if champions else self.index_reader.iter_impacts(token)
+                postings = zip((docId for docId, _ in postings), impacts)
+            cursors.append(PostingsCursor(token, postings, df, max_score))
+        return cursors
+
+    def _push(self, top_k, k, score, docId):
+        """
+        Keeps the k best (score, -docId) pairs inside the
+        min-heap, ties go to the lower docId. Deleted
+        documents never make it into the heap.
+        """
+        if docId in self.deleted:
+            return
+        entry = (score, -docId)
+        if len(top_k) < k:
+            heapq.heappush(top_k, entry)
+        elif entry > top_k[0]:
+            heapq.heapreplace(top_k, entry)
+
+    def search(self, query_tokens, k=10, conjunctive=True, pruning=True, phrases=None, slop=0, metrics=None, champions=False):
+        """
+        Returns the k best [(docId, score)] for the query
+        tokens, sorted by descending score. Pruning only
+        changes how disjunctive queries are evaluated,
+        never their results.
+
+        Every phrase must also appear inside the documents,
+        its tokens in order with at most slop other tokens
+        between two of them (0 = exactly next to each other),
+        which makes the query conjunctive.
+
+        With champions set (and an index that has champion
+        lists), the query is first ranked over the champion
+        lists only, falling back to the full postings when
+        that gives fewer than k results. Phrase queries
+        always use the full postings, since the positions
+        are found through the ordinal of every posting.
+
+        The time spent opening the cursors and ranking, the
+        postings scored and the cache hits are added to the
+        given metrics (see Metrics.py), if any. A k below 1
+        asks for no documents, so the result is empty.
+        """
+        if k < 1:
+            return []
+        metrics = metrics if metrics is not None else NULL_METRICS
+        self.postings_scored = 0
+        phrases = [phrase for phrase in phrases or () if phrase]
+        if phrases and not self.index_reader.has_positions():
+            raise ValueError("The index was built without positions, build it again with positional=True")
+        champions = champions and not phrases and self._use_champions(query_tokens, k, conjunctive)
+        if self.cache is not None:
+            self.cache.set_generation(self.index_reader.get_generation())
+            key = self.cache.result_key(query_tokens, k, conjunctive, self.scoring_method, tuple(map(tuple, phrases)), slop,
+                                        champions)
+            cached_result = self.cache.get_result(key)
+            if cached_result is not None:
+                metrics.count("result_cache_hits")
+                return cached_result
+
+        top_k = None
+        if champions:
+            top_k = self._rank(query_tokens, k, conjunctive, pruning, phrases, slop, metrics, champions=True)
+            if len(top_k) < k:
+                metrics.count("champion_fallbacks")
+                top_k = None
+        if top_k is None:
+            top_k = self._rank(query_tokens, k, conjunctive, pruning, phrases, slop, metrics)
+        metrics.count("postings_scored", self.postings_scored)
+
+        # impacts are summed as integers and only scaled back to bm25 for the results
+        scale = self.index_reader.stats["impact_scale"] if self.scoring_method == "impact" else 1
+        result = [(-negative_docId, score * scale) for score, negative_docId in sorted(top_k, reverse=True)]
+        if self.cache is not None:
+            self.cache.put_result(key, result)
+        return result
+
+    def _use_champions(self, query_tokens, k, conjunctive):
+        """
+        Returns whether ranking the champion lists first can
+        pay off: a token must have a champion list shorter
+        than its postings (otherwise the first tier is the
+        full search), and enough documents must be able to
+        match for the first tier to find k of them.
+        """
+        if not self.index_reader.has_champions():
+            return False
+        dfs = [self.index_reader.get_df(token) for token in dict.fromkeys(query_tokens)]
+        if not any(df > self.index_reader.stats["champions"] for df in dfs):
+            return False
+        return (min(dfs) if conjunctive else sum(dfs)) >= k
+
+    def _rank(self, query_tokens, k, conjunctive, pruning, phrases, slop, metrics, champions=False):
+        """
+        Returns the min-heap of the k best (score, -docId)
+        pairs, ranked over the full postings or over the
+        champion lists only.
+        """
+        top_k = []
+        stage = "_champions" if champions else ""
+        with metrics.timer("open_cursors" + stage):
+            if phrases:
+                cursors = self._open_cursors(list(query_tokens) + [token for phrase in phrases for token in phrase])
+            elif conjunctive:
+                cursors = self._open_cursors(query_tokens, champions)
+            else:
+                cursors = self._open_cursors([token for token in query_tokens if self.index_reader.get_df(token)], champions)
+        with metrics.timer("rank" + stage):
+            if not cursors:
+                pass
+            elif phrases:
+                self._search_conjunctive(cursors, top_k, k, phrases, slop)
+            elif conjunctive:
+                self._search_conjunctive(cursors, top_k, k)
+            elif pruning:
+                self._search_maxscore(cursors, top_k, k)
+            else:
+                self._search_disjunctive(cursors, top_k, k)
+        return top_k
+
+    @staticmethod
+    def _intersect(cursors):
+        """
+        A generator over the docIds every cursor has, with
+        all cursors positioned on each docId it yields.
+
+        Starts from the shortest postings list and only
+        advances the longer ones to its candidates, which
+        gallops over their skip tables instead of decoding
+        the postings in between.
+        """
+        cursors.sort(key=lambda cursor: cursor.df)
+        lead, others = cursors[0], cursors[1:]
+        while lead.docId != END_OF_POSTINGS:
+            target = lead.docId
+            for cursor in others:
+                cursor.advance_to(target)
+                if cursor.docId != target:
+                    target = cursor.docId
+                    break
+            else:
+                # every cursor is on the same document
+                yield target
+                lead.next()
+                continue
+            if target == END_OF_POSTINGS:
+                break
+            lead.advance_to(target)
+
+    def intersect(self, query_tokens):
+        """
+        Returns the docIds of the documents that contain
+        every query token (AND), without scoring them.
+        """
+        cursors = self._open_cursors(query_tokens)
+        if not cursors:
+            return []
+        return [docId for docId in self._intersect(cursors) if docId not in self.deleted]
+
+    def _matches_phrase(self, cursors_by_term, phrase, slop):
+        """
+        Checks if the document all cursors are on contains
+        the phrase, following every occurrence of its first
+        token through the positions of the next tokens.
+        """
+        def positions_of(term):
+            cursor = cursors_by_term[term]
+            return self.index_reader.get_positions(term, cursor.ordinal)
+
+        occurrences = positions_of(phrase[0]) # positions of the last token of the phrase matched so far
+        for term in phrase[1:]:
+            positions = positions_of(term)
+            next_occurrences = set()
+            for position in occurrences:
+                i = bisect_right(positions, position)
+                while i < len(positions) and positions[i] - position <= slop + 1:
+                    next_occurrences.add(positions[i])
+                    i += 1
+            if not next_occurrences:
+                return False
+            occurrences = sorted(next_occurrences)
+        return True
+
+    def _search_conjunctive(self, cursors, top_k, k, phrases=(), slop=0):
+        cursors_by_term = {cursor.term: cursor for cursor in cursors}
+        for docId in self._intersect(cursors):
+            if phrases and not all(self._matches_phrase(cursors_by_term, phrase, slop) for phrase in phrases):
+                continue
+            score = sum(self._score(cursor) for cursor in cursors)
+            self._push(top_k, k, score, docId)
+
+    def _search_disjunctive(self, cursors, top_k, k):
+        while True:
+            docId = min(cursor.docId for cursor in cursors)
+            if docId == END_OF_POSTINGS:
+                break
+            score = 0
+            for cursor in cursors:
+                if cursor.docId == docId:
+                    score += self._score(cursor)
+                    cursor.next()
+            self._push(top_k, k, score, docId)
+
+    def _search_maxscore(self, cursors, top_k, k):
+        # cursors sorted by upper bound, upper_bounds[i] adds up the bounds of cursors[0..i]
+        cursors.sort(key=lambda cursor: cursor.max_score)
+        upper_bounds = []
+        total = 0
+        for cursor in cursors:
+            total += cursor.max_score
+            upper_bounds.append(total)
+
+        threshold = -1 # k-th best score so far, -1 until the heap is full
+        first_essential = 0 # cursors[:first_essential] are the non-essential terms
+        while True:
+            docId = min(cursors[i].docId for i in range(first_essential, len(cursors)))
+            if docId == END_OF_POSTINGS:
+                break
+
+            score = 0
+            for cursor in cursors[first_essential:]:
+                if cursor.docId == docId:
+                    score += self._score(cursor)
+                    cursor.next()
+
+            # adds the non-essential terms, highest bound first, while the document can still beat the threshold
+            for i in range(first_essential - 1, -1, -1):
+                if score + upper_bounds[i] < threshold:
+                    break
+                cursor = cursors[i]
+                cursor.advance_to(docId)
+                if cursor.docId == docId:
+                    score += self._score(cursor)
+            else:
+                self._push(top_k, k, score, docId)
+                if len(top_k) == k and top_k[0][0] > threshold:
+                    threshold = top_k[0][0]
+                    while first_essential < len(cursors) and upper_bounds[first_essential] < threshold:
+                        first_essential += 1
+                    if first_essential == len(cursors):
+                        break # no document can beat the current top k anymore
+
+
+if __name__ == "__main__":
+    import time
+    from IndexReader import IndexReader
+    from DocStore import DocStore, DOCSTORE_FILE
+
+    # compares disjunctive (OR) evaluation with and without MaxScore pruning on the index in "."
+    queries = sys.argv[1:] or ["cristina lopes", "machine learning", "ACM", "master of software engineering"]
+    index_reader = IndexReader(".")
+    doc_store = DocStore(DOCSTORE_FILE)
+    from SearchQuery import SearchQuery
+
+    scoring_methods = ("tf-idf", "bm25", "impact") if index_reader.has_impacts() else ("tf-idf", "bm25")
+    for scoring_method in scoring_methods:
+        ranked_retrieval = RankedRetrieval(index_reader, len(doc_store), scoring_method)
+        print(f"\n{scoring_method}, top 10, OR queries")
+        for query_text in queries:
+            search = SearchQuery(query_text)
+            search.tokenize_query()
+            results = dict()
+            for pruning in (False, True):
+                time_start = time.time()
+                results[pruning] = ranked_retrieval.search(search.get_query_tokens(), 10, conjunctive=False, pruning=pruning)
+                time_end = time.time()
+                print(f"  {query_text!r:35} pruning={pruning!s:5} postings scored: {ranked_retrieval.postings_scored:8}  latency: {(time_end - time_start) * 1000:.2f} ms")
+            # same top k scores, docIds may only differ between documents tied up to float rounding
+            assert all(abs(a[1] - b[1]) < 1e-9 for a, b in zip(results[False], results[True]))
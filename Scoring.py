@@ -18,4 +18,18 @@ class Scoring:
     
     def tf_idf(self, tf, N, DF): # afterward creating index
         # 1 + log(TF) * log(N / DF)
-        return self.term_frequency(tf) * self.inverse_document_frequency(N, DF)
\ No newline at end of file
+        return self.term_frequency(tf) * self.inverse_document_frequency(N, DF)
+
+    # BM25 = idf * (tf * (k1 + 1)) / (tf + k1 * (1 - b + b * (doc length / average doc length)))
+    # idf = log((N - DF + 0.5) / (DF + 0.5) + 1), always positive unlike the tf-idf one
+
+    def bm25_idf(self, N, DF):
+        return math.log10((N - DF + 0.5) / (DF + 0.5) + 1)
+
+    def bm25(self, tf, N, DF, doc_length=None, avg_doc_length=None, k1=1.2, b=0.75):
+        # without document lengths every document is treated as average length
+        if doc_length is None or not avg_doc_length:
+            length_norm = 1
+        else:
+            length_norm = 1 - b + b * (doc_length / avg_doc_length)
+        return self.bm25_idf(N, DF) * (tf * (k1 + 1)) / (tf + k1 * length_norm)
@@ -1,10 +1,17 @@
+import os, json
 import re
 import time
 from collections import defaultdict
-from IndexMerge import IndexMerge
+from IndexMerge import IndexMerge, FINAL_INDEX_FILE, LEXICON_FILE, STATS_FILE
+from DocStore import DOCSTORE_FILE
+from SegmentReader import open_index, open_doc_store
+from IndexSegments import SEGMENTS_FILE
 from IndexBuilder import IndexBuilder
 from nltk.stem import SnowballStemmer
-from Scoring import Scoring
+from RankedRetrieval import RankedRetrieval
+from QueryCache import QueryCache
+from Metrics import Metrics
+from IndexShards import SHARDS_FILE, ShardedSearch, has_shards
 
 
 """
@@ -15,15 +22,23 @@ to stem and tokenize the words to be matched to
 the index terms that are inside the inverted index. 
 
 Once it matches the tokens inside the inverted index, 
-it execute the AND boolean logic for each token to 
-get the top 5 results of documents that has the tokens
-or words inside it.
+it ranks the documents that contain every token (AND
+boolean logic) with RankedRetrieval to get the top 5
+results of documents that has the tokens or words inside it.
+
+With SEARCH_METRICS=1, the time every stage of the query
+took (tokenizing, opening the postings, ranking, looking up
+the urls) is printed as one line of JSON per query, along
+with the profile of the stages listed in SEARCH_PROFILE
+(see Metrics.py).
 """
 
 class SearchQuery:
-    def __init__(self, query_text):
+    def __init__(self, query_text, metrics=None):
         self.query_text = query_text
+        self.metrics = metrics if metrics is not None else Metrics() # per-stage metrics of this query
         self.query_tokens = list()
+        self.phrases = list() # stemmed tokens of every "quoted phrase" of the query
         self.smaller_index = defaultdict(list)
         self.query_results = list()
 
@@ -38,7 +53,15 @@ class SearchQuery:
         Updates the query_tokens attribute with
         a list of valid tokens that can be used
         with the inverted index. 
+
+        The words inside double quotes are also kept
+        together in self.phrases, to be matched as a
+        phrase on a positional index.
         """
+        with self.metrics.timer("tokenize_query"):
+            self._tokenize_query()
+
+    def _tokenize_query(self):
         # initializes the stemmer
         stemmer = SnowballStemmer("english")
 
@@ -47,6 +70,14 @@ class SearchQuery:
         # updates and assigns the attribute self.query_tokens
         self.query_tokens = [stemmer.stem(token.lower()) for token in tokens_list if len(token) >= 3]
 
+        # the quoted phrases, with the same tokens as above
+        self.phrases = list()
+        for phrase_text in re.findall(r'"([^"]*)"', self.query_text):
+            phrase_tokens = re.findall(r'\b[a-zA-Z0-9]+\b', phrase_text)
+            phrase = [stemmer.stem(token.lower()) for token in phrase_tokens if len(token) >= 3]
+            if len(phrase) > 1:
+                self.phrases.append(phrase)
+
     def get_query_tokens(self):
         """
         Returns the updated query_tokens to be used
@@ -54,21 +85,25 @@ class SearchQuery:
         """
 
         return self.query_tokens
+
+    def get_phrases(self):
+        return self.phrases
     
-    def create_smaller_index(self):
+    def create_smaller_index(self, index_reader):
         """
-        Uses the imported IndexMerge class from the
-        IndexMerge.py to create a smaller index that
-        only contains the tokens from the search query. 
+        Uses the IndexReader of the merged index to
+        create a smaller index that only contains the
+        tokens from the search query, seeking straight
+        to the postings of each token.
         """
         start_time = time.time()
         query_tokens = self.get_query_tokens()
-        # instantiates an IndexMerge object 
-        indexMerge = IndexMerge(query_tokens)
-        # creates an smaller index
-        indexMerge.merge_index('.')
-        # assigns/updates attribute to be used in another function
-        self.smaller_index = indexMerge.get_query_index()
+        # seeks to the postings of every token, skipping the ones not in the index
+        self.smaller_index = defaultdict(list)
+        for token in query_tokens:
+            postings = index_reader.get_postings(token)
+            if postings:
+                self.smaller_index[token] = postings
         end_time = time.time()
         print(f"Finished create_smaller_index in: {end_time - start_time} seconds...")
 
@@ -80,55 +115,45 @@ class SearchQuery:
 
         return self.smaller_index
 
-    def match_search_query(self, docId_dict): 
+    def match_search_query(self, docId_dict, ranked_retrieval, k=10, conjunctive=True, fast=False):
         """
-        Matches the search query tokens with the tokens
-        inside the smaller index to get the top 5 results
-        or documents based on tf-idf score that is assigned
-        with each posting in the inverted index. 
+        Matches the search query tokens with the merged
+        index through the RankedRetrieval engine to get
+        the top k documents, ranked by their tf-idf (or
+        bm25) score, and maps them back to their urls.
+
+        Quoted phrases are only matched as phrases when the
+        index has positions, otherwise their words are just
+        required like the other tokens.
+
+        The fast mode answers from the champion lists of the
+        tokens (see RankedRetrieval.search), which only reads
+        the best postings of every token, and only walks the
+        full postings when too few documents qualify.
+
+        A ShardedSearch (see IndexShards.py) can be given
+        instead of the RankedRetrieval, to rank the query on
+        every shard of the index at once.
         """
         start_time = time.time()
-        ### this to make report for M2
-        smaller_index = self.get_smaller_index()
-        # compiles all of the postings into one list
-        postings_list = [smaller_index[key] for key in smaller_index]
-        # this is to collect the sets of docID each token has
-        docID_sets = [set(docID for docID, freq in posting) for posting in postings_list]
-        # finds the intersectiong docID
-        common_docIDs = set.intersection(*docID_sets)
-        # filters the postings_list to only the entries that have the common docIDs
-        filtered_lists = [
-            [(docID, freq) for docID, freq in lst if docID in common_docIDs]
-            for lst in postings_list
-        ]
-        # sorts them by freq descending
-        sorted_filtered_lists = [
-            sorted(lst, key=lambda x: x[1], reverse=True)
-            for lst in filtered_lists
-        ]
-        # iterates the sorted_filtered_list to assign the url to each docID
-        list_of_urls = list() # accumulate the urls 
-        for posting_list in sorted_filtered_lists:
-            for entry in posting_list:
-                current_docID = entry[0]
-                current_url = docId_dict.get(current_docID)
-                list_of_urls.append(current_url)
-
-        self.query_results = list_of_urls
+        phrases = self.get_phrases() if ranked_retrieval.has_positions() else None
+        top_k = ranked_retrieval.search(self.get_query_tokens(), k, conjunctive, phrases=phrases, metrics=self.metrics,
+                                        champions=fast)
+        # iterates the ranked docIDs to assign the url to each docID
+        with self.metrics.timer("lookup_urls"):
+            self.query_results = [docId_dict.get(docID) for docID, score in top_k]
+        end_time = time.time()
+        print(f"Finished match_search_query in: {end_time - start_time} seconds...")
+        if self.metrics.enabled:
+            self.metrics.count("results", len(self.query_results))
+            print(json.dumps({"query": self.query_text, **self.metrics.summary()}))
 
 
     def get_top5_urls(self):
-        # prints the top 5 urls that matches to the search query
-        discovered_urls = set()
-        count = 0
-        index = 0
-        for url in self.query_results:
-            if url not in discovered_urls:
-                print(self.query_results[index])
-                discovered_urls.add(url)
-                count += 1
-            index += 1
-            if count >= 10: break
+        # prints the top urls that match the search query, the urls are
+        # canonical and deduplicated by IndexBuilder so no two are the same page
+        for url in self.query_results[:10]:
+            print(url)
 
 
 if __name__ == "__main__":
@@ -137,48 +162,34 @@ if __name__ == "__main__":
 
     time_start = time.time()
 
-    # instantiates an IndexBuilder object and creates the inverted index
-    indexBuilder = IndexBuilder(mac_path)
-    indexBuilder.build_index()
-    docId_dict = indexBuilder.get_docId_to_url() # retrieves the docId_dict to be used in for searching
-    
+    # only builds and merges the inverted index when it is not already on disk (merged, in segments or in shards)
+    if not os.path.exists(SEGMENTS_FILE) and not os.path.exists(SHARDS_FILE) and not all(os.path.exists(file) for file in (DOCSTORE_FILE, FINAL_INDEX_FILE, LEXICON_FILE, STATS_FILE)):
+        indexBuilder = IndexBuilder(mac_path)
+        indexBuilder.build_index()
+        IndexMerge('.').merge_index()
+
+    # opens the memory-mapped docstore and the merged index (or one worker process per shard) for searching
+    docId_dict = open_doc_store('.')
+    if has_shards('.'):
+        ranked_retrieval = ShardedSearch('.')
+    else:
+        index_reader = open_index('.')
+        # repeated queries are answered from the cache, hot terms are decoded only once
+        ranked_retrieval = RankedRetrieval(index_reader, len(docId_dict), cache=QueryCache())
+
     time_end = time.time()
 
-    print(f"Finished Index creation process in: {time_end - time_start} seconds...")
-    scores = Scoring()
-    
+    print(f"Finished loading the index in: {time_end - time_start} seconds...")
+
     while True:
         query_text = input("What would you like to search for: ")
         time_start_2 = time.time()
         search = SearchQuery(query_text) # initializes SearchQuery object
         search.tokenize_query()  # # stems search query words. ex: lopes --> lope
-        search.create_smaller_index() # 
-        search.match_search_query(docId_dict)
+        # walks the postings of each token and keeps the top k, SEARCH_FAST=1 starts from the champion lists
+        search.match_search_query(docId_dict, ranked_retrieval, fast=os.environ.get("SEARCH_FAST", "") not in ("", "0"))
         print("Here are the top 5 results: ")
-
-        #new dictionary --> {docID: tf-idf}
-        #smaller index formatted in --> dictionary{query: list[[docID: count of word in doc]]}
-        #tf-idf =  1 + log()
-
-
-        # search.get_top5_urls()
-        # # print(search.get_smaller_index())
-        # sortedTFIDF = {}
-
-        # # print(search.get_smaller_index().keys())
-        # # {"cristina": [["docID", "tf]"]}
-        
-        # for key, value in search.get_smaller_index().items():
-        #     # print(len(search.get_smaller_index()[key])) # this is DF(Document Frequency)
-        #     # print("this is the size of smaller_index: ", search.get_smaller_index()[key].values())
-        #     for pair in value:
-
-        #         sortedTFIDF[pair[0]] = scores.tf_idf(pair[1], len(docId_dict), len(search.get_smaller_index()[key]))
-
-            
-        # sortedTFIDF = dict(sorted(sortedTFIDF.items(), key=lambda item: item[1], reverse=True))
-        # for key, value in sortedTFIDF.items():
-        #     print(f"{key}: {value}")
+        search.get_top5_urls()
 
         time_end_2 = time.time()
         print(f"Finished Query Search process in: {time_end_2 - time_start_2} seconds...")
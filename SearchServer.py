@@ -0,0 +1,199 @@
+import os
+import sys
+import json
+import time
+import asyncio
+import urllib.parse
+import urllib.request
+from collections import deque
+from contextlib import asynccontextmanager
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from fastapi import FastAPI, Query
+from RankedRetrieval import RankedRetrieval
+from QueryCache import QueryCache, SharedPostings
+from SegmentReader import open_index, open_doc_store
+from SearchQuery import SearchQuery
+from IndexShards import ShardedSearch, has_shards
+from Metrics import percentile
+
+
+"""
+A long-lived HTTP search service, so the index is opened
+once instead of on every search like the input() loop
+inside SearchQuery.py.
+
+On startup the service opens the lexicon, the docstore
+and the merged index, decodes the postings of the HOT_TERMS
+most common terms once into shared memory (SharedPostings,
+see QueryCache.py), and starts a persistent pool of worker
+processes that each open the same index once. The index
+files are memory-mapped and the hot postings are shared, so
+every worker reads the same pages instead of its own copy,
+and only the query tokens and the (docId, score) results
+are sent between the processes. Every /search?q= request is tokenized on
+the event loop, ranked by one of the workers (the CPU heavy
+part), and its docIds are mapped back to urls here, so many
+requests can be served concurrently. Repeated queries are
+answered from a QueryCache of results here, while every worker
+keeps its own cache of the decoded postings of hot terms.
+
+When the index was merged into shards (see IndexShards.py), every
+shard gets one worker process of its own instead, each request is
+ranked by all of them at once and only their top k are merged here.
+
+    GET /search?q=...&k=10 = the top k urls and their scores
+        (k from 1 to MAX_K, anything else is answered with a 422)
+        ("quoted phrases" are matched as phrases on a positional index,
+        &fast=true answers from the champion lists first)
+    GET /stats = p50/p99 latency of the recent requests and the cache hit rates
+
+Run the service with:       python SearchServer.py
+Run a load test against it: python SearchServer.py load [concurrency] [requests]
+"""
+
+INDEX_DIRECTORY = os.environ.get("SEARCH_INDEX_DIRECTORY", ".")
+SCORING_METHOD = os.environ.get("SEARCH_SCORING_METHOD", "tf-idf")
+NUM_WORKERS = int(os.environ.get("SEARCH_WORKERS", os.cpu_count() or 1))
+HOT_TERMS = 1000 # number of highest df terms whose postings are kept in memory
+SHARED_POSTINGS = 5000000 # most postings of the hot terms decoded into shared memory
+WORKER_CACHE_POSTINGS = 500000 # most decoded postings every worker caches on its own
+LATENCY_WINDOW = 10000 # number of recent request latencies kept for /stats
+MAX_K = 1000 # most results a single /search may ask for
+
+# set inside every worker process by _init_worker
+worker_ranked_retrieval = None
+
+
+def _init_worker(main_directory, scoring_method, shared_postings_arguments=None):
+    """
+    Runs once inside each worker process, opening
+    the index it will rank every query against and
+    the shared postings of the hot terms, if any.
+    """
+    global worker_ranked_retrieval
+    index_reader = open_index(main_directory) # merged once or built in segments (see IndexSegments.py)
+    shared_postings = None
+    if shared_postings_arguments is not None:
+        shared_postings = SharedPostings.attach(*shared_postings_arguments)
+    else:
+        index_reader.warm(HOT_TERMS)
+    cache = QueryCache(max_postings=WORKER_CACHE_POSTINGS, shared_postings=shared_postings)
+    worker_ranked_retrieval = RankedRetrieval(index_reader, scoring_method=scoring_method, cache=cache)
+
+
+def _worker_search(query_tokens, k, conjunctive, phrases, fast=False):
+    """
+    Ranks one query inside a worker process, only the
+    small list of (docId, score) goes back to the service.
+    """
+    if not worker_ranked_retrieval.index_reader.has_positions():
+        phrases = None # the words of the phrases are still required as plain tokens
+    return worker_ranked_retrieval.search(query_tokens, k, conjunctive, phrases=phrases, champions=fast)
+
+
+@asynccontextmanager
+async def lifespan(app):
+    app.state.doc_store = open_doc_store(INDEX_DIRECTORY)
+    app.state.latencies = deque(maxlen=LATENCY_WINDOW)
+    app.state.result_cache = QueryCache()
+    if has_shards(INDEX_DIRECTORY):
+        app.state.executor = None
+        app.state.sharded_search = ShardedSearch(INDEX_DIRECTORY, SCORING_METHOD, HOT_TERMS)
+        app.state.result_cache.set_generation(app.state.sharded_search.get_generation())
+    else:
+        app.state.sharded_search = None
+        index_reader = open_index(INDEX_DIRECTORY)
+        app.state.shared_postings = SharedPostings.create(index_reader, HOT_TERMS, SHARED_POSTINGS)
+        app.state.result_cache.set_generation(index_reader.get_generation())
+        index_reader.close()
+        app.state.executor = ProcessPoolExecutor(max_workers=NUM_WORKERS, initializer=_init_worker,
+                                                 initargs=(INDEX_DIRECTORY, SCORING_METHOD,
+                                                           app.state.shared_postings.get_attach_arguments()))
+    yield
+    if app.state.sharded_search is not None:
+        app.state.sharded_search.close()
+    else:
+        app.state.executor.shutdown()
+        app.state.shared_postings.close()
+        app.state.shared_postings.unlink()
+    app.state.doc_store.close()
+
+
+app = FastAPI(lifespan=lifespan)
+
+
+@app.get("/search")
+async def search(q: str, k: int = Query(10, ge=1, le=MAX_K), conjunctive: bool = True, fast: bool = False):
+    start_time = time.perf_counter()
+    search_query = SearchQuery(q)
+    search_query.tokenize_query()
+    query_tokens = search_query.get_query_tokens()
+    phrases = search_query.get_phrases()
+
+    key = app.state.result_cache.result_key(query_tokens, k, conjunctive, SCORING_METHOD, tuple(map(tuple, phrases)), fast)
+    top_k = app.state.result_cache.get_result(key)
+    if top_k is None:
+        top_k = []
+        if query_tokens and app.state.sharded_search is not None:
+            # scatters the query to every shard and gathers their top k
+            futures = app.state.sharded_search.submit(query_tokens, k, conjunctive, phrases, fast)
+            shard_results = await asyncio.gather(*map(asyncio.wrap_future, futures))
+            top_k = ShardedSearch.merge_results(shard_results, k)
+        elif query_tokens:
+            loop = asyncio.get_running_loop()
+            top_k = await loop.run_in_executor(app.state.executor, _worker_search, query_tokens, k, conjunctive, phrases, fast)
+        app.state.result_cache.put_result(key, top_k)
+
+    results = [{"url": app.state.doc_store.get(docId), "score": score} for docId, score in top_k]
+    latency_ms = (time.perf_counter() - start_time) * 1000
+    app.state.latencies.append(latency_ms)
+    return {"query": q, "tokens": query_tokens, "results": results, "latency_ms": latency_ms}
+
+
+@app.get("/stats")
+async def stats():
+    latencies = list(app.state.latencies)
+    return {
+        "requests": len(latencies),
+        "p50_ms": percentile(latencies, 50),
+        "p99_ms": percentile(latencies, 99),
+        "workers": app.state.sharded_search.get_num_shards() if app.state.sharded_search is not None else NUM_WORKERS,
+        "result_cache": app.state.result_cache.get_stats()["results"],
+        "shared_postings": app.state.shared_postings.get_num_postings() if app.state.sharded_search is None else 0,
+    }
+
+
+def load_test(base_url, queries, concurrency, num_requests):
+    """
+    Sends num_requests searches to a running service
+    from concurrency threads at once, then prints the
+    client side p50/p99 latency and the queries/sec.
+    """
+    def send(request_number):
+        query_text = queries[request_number % len(queries)]
+        start_time = time.perf_counter()
+        with urllib.request.urlopen(f"{base_url}/search?q={urllib.parse.quote(query_text)}") as response:
+            response.read()
+        return (time.perf_counter() - start_time) * 1000
+
+    time_start = time.time()
+    with ThreadPoolExecutor(max_workers=concurrency) as threads:
+        latencies = list(threads.map(send, range(num_requests)))
+    time_end = time.time()
+
+    print(f"{num_requests} requests, {concurrency} concurrent clients")
+    print(f"client p50: {percentile(latencies, 50):.2f} ms, p99: {percentile(latencies, 99):.2f} ms")
+    print(f"throughput: {num_requests / (time_end - time_start):.1f} queries/sec")
+    with urllib.request.urlopen(f"{base_url}/stats") as response:
+        print(f"server stats: {json.loads(response.read())}")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "load":
+        concurrency = int(sys.argv[2]) if len(sys.argv) > 2 else 16
+        num_requests = int(sys.argv[3]) if len(sys.argv) > 3 else 1000
+        queries = ["cristina lopes", "machine learning", "ACM", "master of software engineering"]
+        load_test("http://127.0.0.1:8000", queries, concurrency, num_requests)
+    else:
+        import uvicorn
+        uvicorn.run(app, host="127.0.0.1", port=8000)
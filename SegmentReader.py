@@ -0,0 +1,279 @@
+import os
+import heapq
+import itertools
+from bisect import bisect_right
+from array import array
+from IndexReader import IndexReader
+from DocStore import DocStore, DOCSTORE_FILE
+from Scoring import Scoring
+from IndexSegments import SEGMENTS_FILE, read_manifest
+
+
+"""
+Gives the search side one view over all the segments
+of an incrementally built index (see IndexSegments.py),
+with the same methods as IndexReader so RankedRetrieval,
+QueryCache and the search service can use either.
+
+Every segment covers its own range of docIds and the
+segments are kept in ascending docId order, so the
+postings of a term are the postings of every segment
+chained one after the other, still sorted by docID.
+The collection statistics (N, df, average document
+length) are added up over the segments so the scores do
+not depend on how the documents were split into segments.
+
+Deleted documents (tombstones) keep their postings until
+their segment is merged again, RankedRetrieval leaves
+them out of the results through the deleted attribute.
+"""
+
+class SegmentPostingsIterator:
+    def __init__(self, segment_postings):
+        self.segment_postings = segment_postings # [(iterator, last docId of the segment, postings before it)]
+        self.segment = 0 # segment being decoded
+        self.local_ordinal = -1 # ordinal inside the segment, when its iterator does not keep one
+        self.ordinal = -1 # number of postings before the last one returned, over all segments
+
+    def __iter__(self):
+        return self
+
+    def _next_segment(self):
+        self.segment += 1
+        self.local_ordinal = -1
+
+    def _set_ordinal(self):
+        postings, _, postings_before = self.segment_postings[self.segment]
+        self.ordinal = postings_before + getattr(postings, "ordinal", self.local_ordinal)
+
+    def __next__(self):
+        while self.segment < len(self.segment_postings):
+            postings = self.segment_postings[self.segment][0]
+            posting = next(postings, None)
+            if posting is not None:
+                self.local_ordinal += 1
+                self._set_ordinal()
+                return posting
+            self._next_segment()
+        raise StopIteration
+
+    def advance_to(self, target_docId):
+        """
+        Returns the next posting whose docId is greater than
+        or equal to target_docId (or None), skipping the
+        segments that end before the target entirely.
+        """
+        while self.segment < len(self.segment_postings) and self.segment_postings[self.segment][1] < target_docId:
+            self._next_segment()
+        if self.segment >= len(self.segment_postings):
+            return None
+        postings = self.segment_postings[self.segment][0]
+        if hasattr(postings, "advance_to"):
+            posting = postings.advance_to(target_docId)
+            if posting is not None:
+                self._set_ordinal()
+                return posting
+            # the term has no more postings in this segment, the next one starts above the target
+            self._next_segment()
+            return next(self, None)
+        for posting in self:
+            if posting[0] >= target_docId:
+                return posting
+        return None
+
+
+class SegmentDocStore:
+    def __init__(self, segment_directories, num_deleted=0):
+        self.doc_stores = [DocStore(os.path.join(directory, DOCSTORE_FILE)) for directory in segment_directories]
+        self.first_docIds = [doc_store.first_docId for doc_store in self.doc_stores]
+        self.num_docs = sum(len(doc_store) for doc_store in self.doc_stores) - num_deleted # documents that are not deleted
+
+    def get(self, docId, default=None):
+        i = bisect_right(self.first_docIds, docId) - 1
+        if i < 0:
+            return default
+        return self.doc_stores[i].get(docId, default)
+
+    def __getitem__(self, docId):
+        url = self.get(docId)
+        if url is None:
+            raise KeyError(docId)
+        return url
+
+    def __contains__(self, docId):
+        return self.get(docId) is not None
+
+    def __len__(self):
+        return self.num_docs
+
+    def close(self):
+        for doc_store in self.doc_stores:
+            doc_store.close()
+
+
+class SegmentReader:
+    def __init__(self, main_directory):
+        self.main_directory = main_directory
+        self.manifest = read_manifest(main_directory)
+        self.segments = self.manifest["segments"]
+        self.segment_directories = [os.path.join(main_directory, segment["name"]) for segment in self.segments]
+        self.readers = [IndexReader(directory) for directory in self.segment_directories]
+        self.deleted = frozenset(self.manifest["deleted"])
+        self.scores = Scoring()
+
+        # collection statistics of the documents that are not deleted
+        last_docId = self.segments[-1]["last_docId"] if self.segments else 0
+        self.doc_lengths = array("I", bytes(4 * (last_docId + 1)))
+        total_length = 0
+        num_docs = 0
+        for segment, reader in zip(self.segments, self.readers):
+            first, last = segment["first_docId"], segment["last_docId"]
+            lengths = reader.doc_lengths[first:last + 1] # shorter when the last documents were deleted
+            self.doc_lengths[first:first + len(lengths)] = lengths
+            total_length += reader.stats["avg_doc_length"] * reader.stats["num_docs"]
+            num_docs += reader.stats["num_docs"]
+        for docId in self.deleted:
+            if docId <= last_docId:
+                total_length -= self.doc_lengths[docId]
+        num_docs -= len(self.deleted)
+        self.stats = {
+            "num_docs": num_docs,
+            "avg_doc_length": total_length / num_docs if num_docs else 0,
+            "num_segments": len(self.segments),
+            "impact_bits": None,
+            "impact_scale": 0,
+            "positional": all(reader.has_positions() for reader in self.readers) and bool(self.readers),
+            # shortest champion lists of the segments, terms with fewer postings have none in any segment
+            "champions": min((reader.stats.get("champions") or 0 for reader in self.readers), default=0),
+            "generation": self.manifest["generation"],
+        }
+
+    def get_generation(self):
+        return self.stats["generation"]
+
+    def get_num_docs(self):
+        return self.stats["num_docs"]
+
+    def get_avg_doc_length(self):
+        return self.stats["avg_doc_length"]
+
+    def has_impacts(self):
+        return False # every segment quantizes against its own highest score, so impacts do not add up
+
+    def has_positions(self):
+        return self.stats["positional"]
+
+    def has_champions(self):
+        return all(reader.has_champions() for reader in self.readers) and bool(self.readers)
+
+    def __contains__(self, term):
+        return any(term in reader for reader in self.readers)
+
+    def warm(self, num_terms):
+        for reader in self.readers:
+            reader.warm(num_terms)
+
+    def hot_terms(self, num_terms):
+        """
+        Returns the num_terms terms with the highest document
+        frequency over all segments, out of the hottest
+        terms of every segment.
+        """
+        candidates = dict.fromkeys(term for reader in self.readers for term in reader.hot_terms(num_terms))
+        return heapq.nlargest(num_terms, candidates, key=self.get_df)
+
+    def get_df(self, term):
+        """
+        Returns the document frequency of the term over
+        all segments, at most N since the postings of the
+        deleted documents are still counted.
+        """
+        return min(sum(reader.get_df(term) for reader in self.readers), self.get_num_docs())
+
+    def get_max_score(self, term, scoring_method="tf-idf"):
+        """
+        Returns an upper bound of the score a single posting
+        of the term adds, from the highest frequency of the
+        term in any segment and the statistics of all of them.
+        bm25 takes the shortest possible document, since the
+        bounds of the segments used their own average length.
+        """
+        df = self.get_df(term)
+        if df == 0:
+            return 0
+        max_freq = max(reader.lexicon[term][8] for reader in self.readers if term in reader)
+        if scoring_method == "bm25":
+            return self.scores.bm25(max_freq, self.get_num_docs(), df, 0, self.get_avg_doc_length())
+        return self.scores.tf_idf(max_freq, self.get_num_docs(), df)
+
+    def get_positions(self, term, ordinal):
+        """
+        Returns the positions of the term inside the
+        document of its ordinal-th posting over all segments.
+        """
+        for reader in self.readers:
+            df = reader.get_df(term)
+            if ordinal < df:
+                return reader.get_positions(term, ordinal)
+            ordinal -= df
+        raise IndexError(ordinal)
+
+    def iter_postings(self, term):
+        """
+        Chains the postings of the term in every segment
+        into one iterator of (docId, freq) sorted by docID.
+        """
+        segment_postings = []
+        postings_before = 0
+        for segment, reader in zip(self.segments, self.readers):
+            df = reader.get_df(term)
+            if df:
+                segment_postings.append((reader.iter_postings(term), segment["last_docId"], postings_before))
+                postings_before += df
+        return SegmentPostingsIterator(segment_postings)
+
+    def get_postings(self, term):
+        return list(self.iter_postings(term))
+
+    def iter_champions(self, term):
+        """
+        Chains the champion lists of the term in every
+        segment, each segment choosing its champions among
+        its own postings, so the chain is sorted by docID.
+        """
+        return itertools.chain.from_iterable(reader.iter_champions(term) for reader in self.readers if reader.get_df(term))
+
+    def close(self):
+        for reader in self.readers:
+            reader.close()
+
+
+def open_index(main_directory):
+    """
+    Opens the index inside main_directory, through a
+    SegmentReader if it was built in segments.
+    """
+    if os.path.exists(os.path.join(main_directory, SEGMENTS_FILE)):
+        return SegmentReader(main_directory)
+    return IndexReader(main_directory)
+
+
+def open_doc_store(main_directory):
+    """
+    Opens the docID -> URL store that goes with open_index.
+    """
+    if os.path.exists(os.path.join(main_directory, SEGMENTS_FILE)):
+        manifest = read_manifest(main_directory)
+        segment_directories = [os.path.join(main_directory, segment["name"]) for segment in manifest["segments"]]
+        return SegmentDocStore(segment_directories, len(manifest["deleted"]))
+    return DocStore(os.path.join(main_directory, DOCSTORE_FILE))
+
+
+def read_generation(main_directory):
+    """
+    Returns the generation of the index inside
+    main_directory without opening it.
+    """
+    if os.path.exists(os.path.join(main_directory, SEGMENTS_FILE)):
+        return read_manifest(main_directory)["generation"]
+    return IndexReader.read_stats(main_directory)["generation"]
@@ -1,35 +1,174 @@
-from simhash import Simhash
 import hashlib
+import random
+import time
 
-class Simhashing:
-    
-    def __init__(self):
-        self.url_hashValues = set()
-        self.similarities = set()
-    
-    # the closer to 0 the more similar they are
-    def computeHash(self, url, text):
-        hashValue = Simhash(text).value
 
-        print("this is inside the compute Hash function")
-        for HashValue in self.url_hashValues:
-            if self.hamming_distance(hashValue, HashValue) < 5:
-                self.url_hashValues.add(hashValue)
-                self.similarities.add(url) # similar document has already been found, ignore
-                return False
+"""
+Near-duplicate detection with 64-bit SimHash fingerprints.
+
+The fingerprint of a document is computed from its
+{stemmed token: frequency} inside the IndexBuilder workers:
+every token is hashed to 64 bits, and bit i of the
+fingerprint is set when the tokens with bit i set carry
+more than half of the document's words. Similar documents
+get fingerprints that differ in only a few bits.
+
+Instead of comparing a new fingerprint with every stored
+one (O(n) per document, O(n^2) per crawl), the 64 bits are
+split into max_distance + 1 bands with one hash table per
+band. Two fingerprints at most max_distance bits apart
+differ in at most max_distance bands, so at least one band
+is identical (pigeonhole), and only the fingerprints sharing
+a band value have to be compared. With 16-bit bands the
+buckets stay tiny, so a lookup takes near-constant time.
+"""
+
+FINGERPRINT_BITS = 64
+_LANE_BITS = 32 # one counter per fingerprint bit, packed inside a single int
+_LANE_MASK = (1 << _LANE_BITS) - 1
+
+# _SPREAD[p][v] puts bit b of the byte v (byte p of a token hash) into the lowest bit of lane p * 8 + b,
+# so adding up spread hashes counts the weight of every fingerprint bit in one int addition per token
+_SPREAD = [[sum(1 << ((p * 8 + b) * _LANE_BITS) for b in range(8) if value >> b & 1) for value in range(256)]
+           for p in range(FINGERPRINT_BITS // 8)]
+
 
+def _token_hash(token):
+    return int.from_bytes(hashlib.blake2b(token.encode("utf-8"), digest_size=8).digest(), "little")
 
-        self.url_hashValues.add(hashValue) # if no similar match is found then add it to unique hashValues set
 
-        print(self.url_hashValues)
-        print(self.similarities)
-        print("\n")
+def _spread_hash(token):
+    hash_value = _token_hash(token)
+    return (_SPREAD[0][hash_value & 255] + _SPREAD[1][hash_value >> 8 & 255]
+            + _SPREAD[2][hash_value >> 16 & 255] + _SPREAD[3][hash_value >> 24 & 255]
+            + _SPREAD[4][hash_value >> 32 & 255] + _SPREAD[5][hash_value >> 40 & 255]
+            + _SPREAD[6][hash_value >> 48 & 255] + _SPREAD[7][hash_value >> 56 & 255])
 
-        return True
 
+_SPREAD_CACHE_SIZE = 100000 # spread hashes are ~300 bytes each, so only the first words seen are kept
+_spread_cache = dict() # token -> spread hash, per process since the same words keep coming back
+
+
+def simhash(frequencies):
+    """
+    Returns the 64-bit SimHash fingerprint of a
+    {token: frequency} dictionary, every token
+    weighted by its frequency.
+    """
+    counters = 0
+    total = 0
+    for token, frequency in frequencies.items():
+        spread = _spread_cache.get(token)
+        if spread is None:
+            spread = _spread_hash(token)
+            if len(_spread_cache) < _SPREAD_CACHE_SIZE:
+                _spread_cache[token] = spread
+        counters += spread if frequency == 1 else frequency * spread
+        total += frequency
+
+    fingerprint = 0
+    for bit in range(FINGERPRINT_BITS):
+        if 2 * (counters >> (bit * _LANE_BITS) & _LANE_MASK) > total:
+            fingerprint |= 1 << bit
+    return fingerprint
+
+
+class Simhashing:
+
+    def __init__(self, max_distance=3):
+        self.max_distance = max_distance # fingerprints at most this many bits apart are near-duplicates
+        self.num_bands = max_distance + 1
+        # band i covers the bits [band_starts[i], band_starts[i + 1]), the bands only differ by a bit in width
+        self.band_starts = [band * FINGERPRINT_BITS // self.num_bands for band in range(self.num_bands + 1)]
+        self.tables = [dict() for _ in range(self.num_bands)] # band value -> [(fingerprint, docId)]
+        self.comparisons = 0 # fingerprints compared so far, to check the buckets stay small
+
+    def _bands(self, hashValue):
+        for band in range(self.num_bands):
+            start, end = self.band_starts[band], self.band_starts[band + 1]
+            yield band, hashValue >> start & ((1 << (end - start)) - 1)
 
     def hamming_distance(self, val1, val2):
         return bin(val1 ^ val2).count('1')
 
+    def find_near_duplicate(self, hashValue):
+        """
+        Returns the docId of a stored fingerprint at most
+        max_distance bits away from hashValue, or None.
+        """
+        for band, band_value in self._bands(hashValue):
+            for other_hashValue, docId in self.tables[band].get(band_value, ()):
+                self.comparisons += 1
+                if self.hamming_distance(hashValue, other_hashValue) <= self.max_distance:
+                    return docId
+        return None
+
+    def add(self, hashValue, docId):
+        for band, band_value in self._bands(hashValue):
+            self.tables[band].setdefault(band_value, []).append((hashValue, docId))
+
+    def computeHash(self, docId, hashValue):
+        """
+        Checks the fingerprint of a new document, returning
+        the docId it is a near-duplicate of, or None after
+        storing it if the document is new.
+        """
+        near_duplicate = self.find_near_duplicate(hashValue)
+        if near_duplicate is None:
+            self.add(hashValue, docId)
+        return near_duplicate
+
+    def __len__(self):
+        return sum(len(bucket) for bucket in self.tables[0].values())
+
+
+if __name__ == "__main__":
+    # throughput of the banded index against the linear scan it replaces, on a synthetic crawl
+    # where every 10th document is a copy of an earlier one with a few words changed
+    num_docs = 60000
+    rng = random.Random(42)
+    vocabulary = [f"word{i}" for i in range(20000)]
+    documents = []
+    for docId in range(1, num_docs + 1):
+        if docId % 10 == 0:
+            frequencies = dict(documents[rng.randrange(len(documents))])
+            for token in rng.sample(vocabulary, 2):
+                frequencies[token] = frequencies.get(token, 0) + 1
+        else:
+            frequencies = dict()
+            for token in rng.choices(vocabulary, k=rng.randint(100, 400)):
+                frequencies[token] = frequencies.get(token, 0) + 1
+        documents.append(frequencies)
+
+    time_start = time.time()
+    fingerprints = [simhash(frequencies) for frequencies in documents]
+    time_end = time.time()
+    print(f"fingerprinted {num_docs} documents in {time_end - time_start:.2f} seconds "
+          f"({num_docs / (time_end - time_start):.0f} docs/sec)")
+
+    simhashing = Simhashing(max_distance=3)
+    time_start = time.time()
+    duplicates = sum(simhashing.computeHash(docId, fingerprint) is not None
+                     for docId, fingerprint in enumerate(fingerprints, 1))
+    time_end = time.time()
+    print(f"banded index: {num_docs} documents in {time_end - time_start:.2f} seconds "
+          f"({num_docs / (time_end - time_start):.0f} docs/sec), {duplicates} near-duplicates, "
+          f"{simhashing.comparisons / num_docs:.2f} comparisons per document")
 
+    # the old linear scan, on the first documents only since it is quadratic
+    linear_docs = 5000
+    stored = []
+    time_start = time.time()
+    linear_duplicates = 0
+    for fingerprint in fingerprints[:linear_docs]:
+        if any(bin(fingerprint ^ other).count('1') <= 3 for other in stored):
+            linear_duplicates += 1
+        else:
+            stored.append(fingerprint)
+    time_end = time.time()
+    print(f"linear scan: {linear_docs} documents in {time_end - time_start:.2f} seconds "
+          f"({linear_docs / (time_end - time_start):.0f} docs/sec, and slowing down linearly)")
 
+    check = Simhashing(max_distance=3)
+    assert linear_duplicates == sum(check.computeHash(docId, fingerprint) is not None
+                                    for docId, fingerprint in enumerate(fingerprints[:linear_docs], 1))
@@ -0,0 +1,79 @@
+import pytest
+
+from IndexSegments import SegmentManager
+
+
+"""
+Tier assignment and merge selection of the segments, run with:
+    python -m pytest test_IndexSegments.py
+"""
+
+
+@pytest.mark.parametrize("min_segment_docs, merge_factor", [(1, 10), (1, 3), (1000, 10), (50, 3), (7, 2)])
+def test_tier_boundaries(tmp_path, min_segment_docs, merge_factor):
+    segment_manager = SegmentManager(tmp_path, merge_factor=merge_factor, min_segment_docs=min_segment_docs)
+    assert segment_manager._tier(0) == 0
+    for tier in range(1, 8):
+        bound = min_segment_docs * merge_factor ** tier # the first size of the tier
+        assert segment_manager._tier(bound - 1) == tier - 1
+        assert segment_manager._tier(bound) == tier
+
+
+def test_tier_of_exact_powers(tmp_path):
+    # math.log(1000, 10) and math.log(243, 3) come out just below 3 and 5
+    assert SegmentManager(tmp_path, merge_factor=10, min_segment_docs=1)._tier(1000) == 3
+    assert SegmentManager(tmp_path, merge_factor=3, min_segment_docs=1)._tier(243) == 5
+
+
+def _manifest(sizes, deleted=()):
+    """
+    A manifest of neighbouring segments with the
+    given numbers of documents, named Segment_1, ...
+    """
+    segments = []
+    first_docId = 1
+    for number, num_docs in enumerate(sizes, start=1):
+        segments.append({"name": f"Segment_{number}", "first_docId": first_docId,
+                         "last_docId": first_docId + num_docs - 1, "num_docs": num_docs})
+        first_docId += num_docs
+    return {"segments": segments, "deleted": sorted(deleted)}
+
+
+@pytest.fixture
+def segment_manager(tmp_path):
+    # tier 0 = fewer than 30 live documents, tier 1 = 30 to 89, tier 2 = 90 to 269, ...
+    return SegmentManager(tmp_path, merge_factor=3, min_segment_docs=10)
+
+
+def test_find_merge_same_tier_run(segment_manager):
+    assert segment_manager.find_merge(_manifest([5, 12, 29])) == ["Segment_1", "Segment_2", "Segment_3"]
+    assert segment_manager.find_merge(_manifest([90, 5, 12, 29, 4])) == ["Segment_2", "Segment_3", "Segment_4"]
+
+
+def test_find_merge_not_enough_neighbours(segment_manager):
+    assert segment_manager.find_merge(_manifest([])) is None
+    assert segment_manager.find_merge(_manifest([5, 12])) is None
+    assert segment_manager.find_merge(_manifest([100, 40, 40])) is None
+
+
+def test_find_merge_mixed_tiers(segment_manager):
+    # a segment of another tier breaks the run, only neighbours are merged
+    assert segment_manager.find_merge(_manifest([5, 5, 30, 5, 5])) is None
+    assert segment_manager.find_merge(_manifest([5, 5, 30, 45, 89])) == ["Segment_3", "Segment_4", "Segment_5"]
+    assert segment_manager.find_merge(_manifest([270, 90, 269, 29, 30, 100])) is None
+
+
+def test_find_merge_exact_powers(tmp_path):
+    # 1000 and 1500 documents are both in tier 3, a float log put 1000 in tier 2
+    segment_manager = SegmentManager(tmp_path, merge_factor=10, min_segment_docs=1)
+    sizes = [1000, 1500] * 5
+    assert segment_manager.find_merge(_manifest(sizes)) == [f"Segment_{number}" for number in range(1, 11)]
+
+
+def test_find_merge_mostly_tombstoned(segment_manager):
+    # Segment_2 (docIds 101 to 110) has half of its documents deleted
+    manifest = _manifest([100, 10, 5, 5, 5], deleted=range(101, 106))
+    assert segment_manager.find_merge(manifest) == ["Segment_2"]
+    # fewer tombstones do not trigger a rewrite, but still lower the tier
+    manifest = _manifest([100, 40, 5, 5], deleted=range(101, 112))
+    assert segment_manager.find_merge(manifest) == ["Segment_2", "Segment_3", "Segment_4"]
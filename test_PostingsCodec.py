@@ -0,0 +1,149 @@
+import random
+
+import pytest
+
+from PostingsCodec import (BLOCK_SIZE, CODECS, BlockVarByteCodec, decode_positions, decode_varbyte, encode_positions,
+                           encode_varbyte, get_codec, read_id_records, read_records, write_header, write_id_record,
+                           write_record)
+
+
+"""
+Round trip and skip checks of the postings codecs, run with:
+    python -m pytest test_PostingsCodec.py
+"""
+
+# the largest number of every varbyte length and the smallest of the next one
+VARBYTE_BOUNDARIES = [0, 1, 127, 128, 16383, 16384, 2 ** 21 - 1, 2 ** 21, 2 ** 28 - 1, 2 ** 28, 2 ** 35]
+
+
+def _postings_with_gaps(gaps, freq=1):
+    docId = 0
+    postings = []
+    for gap in gaps:
+        docId += gap
+        postings.append((docId, freq))
+    return postings
+
+
+EDGE_CASES = {
+    "empty": [],
+    "one posting": [(1, 1)],
+    "one posting, docId 0": [(0, 1)],
+    "gaps at the 1 byte boundary": _postings_with_gaps([127, 128, 127, 128]),
+    "gaps at the 2 byte boundary": _postings_with_gaps([16383, 16384, 1, 16383, 16384]),
+    "gaps at the 3 byte boundary": _postings_with_gaps([2 ** 21 - 1, 2 ** 21]),
+    "large docIds": [(5, 3), (2 ** 21, 2 ** 14), (2 ** 35, 1)],
+    "freqs at the boundaries": [(docId + 1, freq) for docId, freq in enumerate([1, 127, 128, 16383, 16384, 2 ** 21])],
+    "one full block": _postings_with_gaps([1] * BLOCK_SIZE),
+    "last block of one posting": _postings_with_gaps([1] * (BLOCK_SIZE + 1)),
+    "last block one short": _postings_with_gaps([3] * (2 * BLOCK_SIZE - 1)),
+    "partial last block, large gaps": _postings_with_gaps([128, 16384] * (BLOCK_SIZE + 10)),
+}
+
+
+@pytest.mark.parametrize("number", VARBYTE_BOUNDARIES)
+def test_varbyte_round_trip(number):
+    output = bytearray(b"\xff") # decoding starts after the bytes before the number
+    encode_varbyte(number, output)
+    assert len(output) - 1 == max(1, (number.bit_length() + 6) // 7)
+    assert decode_varbyte(output, 1) == (number, len(output))
+
+
+@pytest.mark.parametrize("codec_name", sorted(CODECS))
+@pytest.mark.parametrize("case", sorted(EDGE_CASES))
+def test_round_trip(codec_name, case):
+    codec = get_codec(codec_name)
+    postings = EDGE_CASES[case]
+    payload = codec.encode(postings)
+    assert list(codec.decode(memoryview(payload))) == postings
+    assert list(codec.decode(payload)) == postings
+
+
+def test_unknown_codec():
+    with pytest.raises(ValueError):
+        get_codec("gzip")
+
+
+@pytest.mark.parametrize("positions", [[], [0], [0, 127, 128, 16511, 16512], [5, 2 ** 21 + 5]])
+def test_positions_round_trip(positions):
+    output = bytearray(b"\x01\x02")
+    encode_positions(positions, output)
+    assert decode_positions(output, 2, len(output)) == positions
+
+
+def test_empty_blocks_advance_to():
+    iterator = BlockVarByteCodec().decode(BlockVarByteCodec().encode([]))
+    assert iterator.advance_to(1) is None
+    assert list(iterator) == []
+
+
+def test_advance_to_past_the_end():
+    postings = _postings_with_gaps([2] * (BLOCK_SIZE * 3 + 5))
+    codec = BlockVarByteCodec()
+    iterator = codec.decode(codec.encode(postings))
+    assert iterator.advance_to(postings[-1][0]) == postings[-1]
+    assert iterator.advance_to(postings[-1][0] + 1) is None
+    iterator = codec.decode(codec.encode(postings))
+    assert iterator.advance_to(postings[-1][0] + 1) is None
+    assert iterator.advance_to(postings[-1][0] + 1000) is None
+
+
+def test_advance_to_skip_boundaries():
+    # docIds 2, 4, 6, ... so the last docId of block b is 2 * BLOCK_SIZE * (b + 1)
+    postings = _postings_with_gaps([2] * (BLOCK_SIZE * 4 + 3))
+    codec = BlockVarByteCodec()
+    payload = codec.encode(postings)
+    for block in range(4):
+        last_of_block = postings[(block + 1) * BLOCK_SIZE - 1]
+        first_of_next = postings[(block + 1) * BLOCK_SIZE]
+        # onto the last posting of a block, and just past it into the next block
+        assert codec.decode(payload).advance_to(last_of_block[0]) == last_of_block
+        assert codec.decode(payload).advance_to(last_of_block[0] + 1) == first_of_next
+        # from the last posting of a block into the next one
+        iterator = codec.decode(payload)
+        assert iterator.advance_to(last_of_block[0]) == last_of_block
+        assert next(iterator) == first_of_next
+        assert iterator.advance_to(first_of_next[0] + 2) == postings[(block + 1) * BLOCK_SIZE + 1]
+
+
+def test_advance_to_matches_a_linear_scan():
+    rng = random.Random(1)
+    codec = BlockVarByteCodec()
+    for _ in range(200):
+        docIds = sorted(rng.sample(range(1, 5000), rng.randint(1, 1000)))
+        postings = [(docId, docId % 7 + 1) for docId in docIds]
+        iterator = codec.decode(codec.encode(postings))
+        target = 0
+        while True:
+            target += rng.randint(1, 300)
+            expected = next((posting for posting in postings if posting[0] >= target), None)
+            found = iterator.advance_to(target)
+            assert found == expected, (target, found, expected)
+            if found is None:
+                break
+            target = found[0]
+
+
+@pytest.mark.parametrize("codec_name", sorted(CODECS))
+def test_postings_files(tmp_path, codec_name):
+    codec = get_codec(codec_name)
+    terms = {"apple": [(1, 2)], "banana": [], "cherry": EDGE_CASES["partial last block, large gaps"]}
+    index_path = tmp_path / "Final_Index.bin"
+    batch_path = tmp_path / "Output_Batch_1.bin"
+    with open(index_path, "wb") as index_file, open(batch_path, "wb") as batch_file:
+        write_header(index_file, codec)
+        write_header(batch_file, codec)
+        for term_id, (term, postings) in enumerate(terms.items()):
+            write_record(index_file, term, codec.encode(postings))
+            write_id_record(batch_file, term_id * 200, codec.encode(postings))
+    records = [(term, list(record_codec.decode(payload))) for term, record_codec, payload in read_records(index_path)]
+    assert records == list(terms.items())
+    records = [(term_id, list(record_codec.decode(payload))) for term_id, record_codec, payload in read_id_records(batch_path)]
+    assert records == [(term_id * 200, postings) for term_id, postings in enumerate(terms.values())]
+
+
+def test_empty_postings_file(tmp_path):
+    empty_path = tmp_path / "Output_Batch_1.bin"
+    empty_path.write_bytes(b"")
+    assert list(read_records(empty_path)) == []
+    assert list(read_id_records(empty_path)) == []
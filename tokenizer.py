@@ -1,59 +1,139 @@
-from collections import defaultdict
+import re
+import time
+import random
+from collections import Counter, defaultdict
+from nltk.stem import SnowballStemmer
 """
-Tokenizer class that takes in a string of text 
+Tokenizer class that takes in a string of text
 that has been filtered through by Beautiful Soup
-and tokenizes and normalizes the text into 
-individual significant tokens. 
+and tokenizes and normalizes the text into
+individual significant tokens.
 
 Conditions to be considered as a token:
     - alphanumeric
     - at least the length of 3
 """
 
+# runs of at least 3 ASCII letters and digits, matched on text that is already lowercased
+_TOKEN_PATTERN = re.compile(r"[a-z0-9]{3,}")
+
+_STEMMER = SnowballStemmer("english")
+_STEM_CACHE_SIZE = 500000 # stems are ~150 bytes each with their token, so only the first words seen are kept
+_stem_cache = dict() # token -> stem, per process since the same words keep coming back
+
+
+def stem(token):
+    """
+    Returns the english Snowball stem of a token,
+    memoized since stemming is the slow part of
+    indexing a document and most tokens repeat.
+    """
+    stemmed_token = _stem_cache.get(token)
+    if stemmed_token is None:
+        stemmed_token = _STEMMER.stem(token)
+        if len(_stem_cache) < _STEM_CACHE_SIZE:
+            _stem_cache[token] = stemmed_token
+    return stemmed_token
+
+
 class Tokenizer:
-    def __init__(self):
-        self.tokens = defaultdict(int) # keeps track of all the tokens and their frequencies
+    def __init__(self, record_positions=False):
+        self.tokens = Counter() # keeps track of all the tokens and their frequencies
+        self.record_positions = record_positions
+        self.positions = defaultdict(list) # token -> positions (0, 1, 2, ... among the valid tokens), if recorded
 
     def tokenize(self, main_text):
         """
-        Iterates through the main text to build tokens
-        by adding alphanumeric characters to a token, 
-        then checks if the resulting token meets the 
-        condition to be a valid one. 
+        Splits the main text into runs of alphanumeric
+        characters with a single regex pass, keeping the
+        runs that meet the condition to be a valid token.
+
+        Returns the list of valid tokens, lowercased.
+        When record_positions is set, the position of
+        every valid token is recorded in self.positions
+        """
+        # non-ASCII characters become "?" (not alphanumeric, so they still split tokens)
+        # before lowercasing, since lower() turns a few of them into ASCII letters
+        ascii_text = main_text.encode("ascii", "replace").lower().decode("ascii")
+        tokens = _TOKEN_PATTERN.findall(ascii_text)
+        if self.record_positions:
+            positions = self.positions
+            for position, token in enumerate(tokens):
+                positions[token].append(position)
+        return tokens
+
+    def compute_frequencies(self, tokens):
+        """
+        Updates the tokens attribute to keep track
+        of the frequencies of the tokens, in the
+        order the tokens first appear.
         """
+        self.tokens.update(tokens)
+
+    def getTokens(self):
+        return self.tokens
+
+    def getPositions(self):
+        return self.positions
+
+
+if __name__ == "__main__":
+    # checks the regex tokenizer against the character loop it replaced, then
+    # compares their throughput and stemming with and without the stem cache
+    def tokenize_char_loop(main_text, positions=None):
+        position = 0
         current_token = []
         for char in main_text:
-            if ('A' <= char <='Z') or ('a' <= char <= 'z') or ('0' <= char <= '9'): # checking for alphanumeric value
-                    current_token.append(char.lower()) # normalizes it
+            if ('A' <= char <= 'Z') or ('a' <= char <= 'z') or ('0' <= char <= '9'):
+                current_token.append(char.lower())
             else:
                 if current_token and len(current_token) >= 3:
                     combined = ''.join(current_token)
+                    if positions is not None:
+                        positions[combined].append(position)
+                    position += 1
                     yield combined
-                current_token = [] # resets it to make a new token
-
-        if current_token and len(current_token) >= 3: # accounts for the last token to be yielded
+                current_token = []
+        if current_token and len(current_token) >= 3:
             combined = ''.join(current_token)
+            if positions is not None:
+                positions[combined].append(position)
             yield combined
 
-    def compute_frequencies(self, tokens):
-        """
-        Updates the tokens attribute to keep track 
-        of the frequencies of the tokens. 
-        
-        Organizes the tokens in descending order
-        starting with the most frequent token.
-        """
-        for token in tokens:
-            self.tokens[token] += 1
-
-        # sorting the tokens in descending order
-        self.tokens = dict(sorted(self.tokens.items(), key=lambda item: item[1], reverse=True))
-
-    def getTokens(self):
-        return self.tokens
+    rng = random.Random(7)
+    alphabet = "abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789"
+    vocabulary = ["".join(rng.choices(alphabet, k=rng.randint(1, 12))) for _ in range(20000)]
+    separators = [" ", " ", " ", "\n", ", ", ". ", "-", "é", "İ", "K", "_", "ß"]
+    main_text = "".join(word + rng.choice(separators) for word in rng.choices(vocabulary, k=1000000))
 
-    
+    for record_positions in (False, True):
+        expected_positions = defaultdict(list) if record_positions else None
+        time_start = time.time()
+        expected_tokens = list(tokenize_char_loop(main_text, expected_positions))
+        expected_frequencies = Counter(expected_tokens)
+        time_end = time.time()
+        print(f"character loop (record_positions={record_positions}): "
+              f"{len(expected_tokens) / (time_end - time_start):.0f} tokens/sec")
 
+        tokenizer = Tokenizer(record_positions=record_positions)
+        time_start = time.time()
+        tokens = tokenizer.tokenize(main_text)
+        tokenizer.compute_frequencies(tokens)
+        time_end = time.time()
+        print(f"regex (record_positions={record_positions}): {len(tokens) / (time_end - time_start):.0f} tokens/sec")
+        assert tokens == expected_tokens
+        assert tokenizer.getTokens() == expected_frequencies
+        assert tokenizer.getPositions() == (expected_positions or dict())
+    for edge_case in ["", "ab", "abc", "abc!", "!abc", "ab cd efg", "ABCİDEF", "straße", "x" * 5]:
+        expected_positions = defaultdict(list)
+        assert Tokenizer(True).tokenize(edge_case) == list(tokenize_char_loop(edge_case, expected_positions)), edge_case
 
-         
-    
\ No newline at end of file
+    time_start = time.time()
+    expected_stems = [SnowballStemmer("english").stem(token) for token in tokens]
+    time_end = time.time()
+    print(f"new SnowballStemmer per token: {len(tokens) / (time_end - time_start):.0f} stems/sec")
+    time_start = time.time()
+    stems = [stem(token) for token in tokens]
+    time_end = time.time()
+    print(f"stem cache: {len(tokens) / (time_end - time_start):.0f} stems/sec")
+    assert stems == expected_stems